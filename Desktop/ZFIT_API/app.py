@@ -1,26 +1,84 @@
 """
 This file contains Flask API endpoints
 """
-from flask import Flask, request
+from flask import Flask, Response, request, stream_with_context
 from flask_cors import CORS
-from services.ollama_service import generate_plan,alter_program
-from processing.workout_processing import clean_csv,structure_csv,insert_workouts
-from services.supabase_client import supabase
+from services.ollama_service import generate_plan_rows,generate_structured_plan,generate_insights_stream,alter_program,warm_up,PLAN_CSV_SYSTEM,PLAN_SYSTEM
+from processing.workout_processing import clean_csv,structure_csv,insert_workouts,get_past_exercise_page,HISTORY_WINDOW
+from services.jobs import submit_job, get_job, job_events, QueueFullError
+from services.supabase_client import authenticate, set_access_token, dev_account_enabled, AuthenticationError
+from services import metrics
+from processing.mesocycle import generate_mesocycle
+from processing import analytics
+import threading
 import logging
+import json
+import os
+
+PLAN_OUTPUT = os.getenv('ZFIT_PLAN_OUTPUT', 'csv') #csv: plan streamed as csv so exercises are matched while it is written, json: schema constrained plan, both with per day repair
+WARM_UP_LLM = os.getenv('ZFIT_LLM_WARM_UP', '1') == '1' #loads the model at startup instead of on the first request
+PUBLIC_ENDPOINTS = {'get_metrics'} #endpoints that do not read user data and are served without a bearer token
 
 app = Flask(__name__)
 CORS(app)
 
-@app.route("/generateProgram",methods=['POST'])
-def generate_program():
+if WARM_UP_LLM:
+    plan_system = PLAN_CSV_SYSTEM if PLAN_OUTPUT == 'csv' else PLAN_SYSTEM #the system prompt of the first call of every plan
+    threading.Thread(target=warm_up, args=(plan_system,), name='zfit-llm-warm-up', daemon=True).start() #in the background so the api starts even if ollama is down
+
+@app.before_request
+def start_metrics():
+    """
+    Starts timing the request and counting its llm calls and database round trips
+    """
+    metrics.start_request()
+
+@app.before_request
+def use_access_token():
     """
-    Generates a workout plan for the week based on user details and sends it to the front end
+    Makes database calls in the request act as the user in the Authorization: Bearer header.
+    Requests without the header use the development account when it is configured.
+
+    Returns:
+        Response with status 401 if the token is invalid or missing, None otherwise
+    """
+    if request.method == 'OPTIONS' or request.endpoint in PUBLIC_ENDPOINTS:
+        return None
+    header = request.headers.get('Authorization', '')
+    access_token = header[len('Bearer '):].strip() if header.startswith('Bearer ') else None
+    if not access_token and not dev_account_enabled():
+        return {'error':'Missing access token'}, 401
+    if access_token:
+        try:
+            authenticate(access_token)
+        except AuthenticationError as e:
+            logging.warning(f'Rejected request: {e}')
+            return {'error':'Invalid access token'}, 401
+    set_access_token(access_token) #also replaces the token of the worker thread's previous request
+
+@app.after_request
+def finish_metrics(response):
+    """
+    Records the request metrics once the response has been sent, after the last chunk for streamed responses
+    """
+    endpoint = request.url_rule.rule if request.url_rule else 'unknown'
+    stats = metrics.current_request()
+    response.call_on_close(lambda: metrics.finish_request(endpoint, response.status_code, stats))
+    return response
+
+def build_program(data, progress=None):
+    """
+    Runs the workout plan pipeline: generate the plan, match exercises to past sets and structure the program
+
+    Args:
+        data(dict): user information sent by the front end
+        progress(function): called with the name of each stage as it starts
 
     Returns:
         List containing a structured workout plan to be displayed in the front end
     """
+    progress = progress or (lambda stage: None)
     try:
-        data = request.get_json() #data contains user information
         age = data['age']
         gender = data['gender']
         level = data['level']
@@ -31,43 +89,166 @@ def generate_program():
     except Exception as e:
         logging.error(f'Issue extracting user data:{e}')
         return []
-    generate_plan(age, level, gender, goal, days, equipment, startdate) #generates plan into unfiltered_program.csv
-    clean_csv() #processes unfiltered_program.csv info into filtered_program.csv
-    return structure_csv() #structures workout program for front end to process
+    def streamed_rows():
+        yield from generate_plan_rows(age, level, gender, goal, days, equipment, startdate) #streams the plan in csv format, repairing invalid days at the end
+        progress('match')
 
-@app.route("/updateProgram",methods=['POST'])
-def update_program():
+    progress('generate')
+    if PLAN_OUTPUT == 'csv':
+        plan_rows = streamed_rows() #valid exercises in the plan as the llm writes them
+    else:
+        plan_rows = generate_structured_plan(age, level, gender, goal, days, equipment, startdate) #validated exercises in the plan
+        progress('match')
+    program_sets = clean_csv(plan_rows) #matches exercises as they arrive and processes them into sets with lbs and reps
+    progress('structure')
+    return structure_csv(program_sets) #structures workout program for front end to process
+
+def change_program(data, progress=None):
     """
-    Alters original program based on user changes
+    Applies the user's changes to a program
 
-    returns:
+    Args:
+        data(list): the original program followed by the requested changes
+        progress(function): called with the name of each stage as it starts
+
+    Returns:
         New program with changes made by the user
     """
+    progress = progress or (lambda stage: None)
     try:
-        data = request.get_json()
         original_program = data[0]
         changes = data[1]
+        progress('alter')
         return alter_program(original_program,changes)
     except Exception as e:
         logging.error(f'Could not alter program:{e}')
         return []
 
+def queue_job(name, fn, data):
+    """
+    Runs fn in the background and responds with the job id
+
+    Args:
+        name(str): name of the job
+        fn(function): pipeline to run
+        data: request body passed to fn
+
+    Returns:
+        Response containing the job id, status 503 if the job queue is full
+    """
+    try:
+        job_id = submit_job(name, fn, data)
+    except QueueFullError as e:
+        logging.warning(f'Rejected {name} job: {e}')
+        return {'error':'Too many jobs are waiting, try again later'}, 503
+    return {'job_id':job_id,'status':'queued'}, 202
+
+@app.route("/generateProgram",methods=['POST'])
+def generate_program():
+    """
+    Generates a workout plan for the week based on user details and sends it to the front end.
+    With ?mode=job the plan is generated in the background and the job id is returned right away.
+
+    Returns:
+        List containing a structured workout plan to be displayed in the front end
+    """
+    data = request.get_json(silent=True) #data contains user information
+    if request.args.get('mode') == 'job':
+        return queue_job('generateProgram', build_program, data)
+    return build_program(data)
+
+@app.route("/generateMesocycle",methods=['POST'])
+def generate_mesocycle_program():
+    """
+    Generates a multi-week workout plan with lbs and reps progressing every week.
+    The body is the same as /generateProgram with weeks(default 4, max 12) added.
+    Weeks are generated in parallel and streamed as newline delimited json, one line per week in order.
+
+    Returns:
+        Stream of weeks, each with its week number, startdate, focus and structured program
+    """
+    data = request.get_json(silent=True)
+    try:
+        user = {
+            'age':data['age'],
+            'gender':data['gender'],
+            'level':data['level'],
+            'goal':data['goal'],
+            'days':data['days'],
+            'startdate':data['startdate'].split('T')[0],
+            'equipment':data['equipment']
+        }
+        weeks = int(data.get('weeks', 4))
+    except Exception as e:
+        logging.error(f'Issue extracting user data:{e}')
+        return {'error':'Missing or invalid user details'}, 400
+    weeks_stream = generate_mesocycle(user, weeks)
+    return Response(stream_with_context(json.dumps(week)+'\n' for week in weeks_stream), mimetype='application/x-ndjson')
+
+@app.route("/updateProgram",methods=['POST'])
+def update_program():
+    """
+    Alters original program based on user changes.
+    With ?mode=job the program is altered in the background and the job id is returned right away.
+
+    returns:
+        New program with changes made by the user
+    """
+    data = request.get_json(silent=True)
+    if request.args.get('mode') == 'job':
+        return queue_job('updateProgram', change_program, data)
+    return change_program(data)
+
+@app.route("/jobs/<job_id>",methods=['GET'])
+def get_job_status(job_id):
+    """
+    Gets the status, current stage and result of a background job
+
+    Args:
+        job_id(str): id returned when the job was queued
+
+    Returns:
+        Job information, status 404 if the job does not exist or expired
+    """
+    job = get_job(job_id)
+    if job is None:
+        return {'error':'Job not found'}, 404
+    return job
+
+@app.route("/jobs/<job_id>/events",methods=['GET'])
+def stream_job_events(job_id):
+    """
+    Streams a background job's progress as server-sent events
+
+    Args:
+        job_id(str): id returned when the job was queued
+
+    Returns:
+        Event stream that ends when the job finishes
+    """
+    if get_job(job_id) is None:
+        return {'error':'Job not found'}, 404
+    return Response(job_events(job_id), mimetype='text/event-stream', headers={'Cache-Control':'no-cache'})
+
 @app.route("/insertProgram",methods=['POST'])
 def insert_program():
     """
     Inserts the workouts and sets of the customized program into the database
 
     returns:
-        Confirmation that the function has been executed
+        List containing the insert result of each workout, with status 500 if any workout was not inserted
     """
     data = request.get_json()
-    insert_workouts(data)
-    return 'Insert Program Executed'
+    results = insert_workouts(data)
+    status = 200 if all(result['status'] == 'inserted' for result in results) else 500
+    return results, status
 
 @app.route("/getInsights/<name>",methods=['GET'])
 def get_exercise_insights(name):
     """
-    Generates actionable insights based on the workout history for an exercise
+    Generates actionable insights based on the workout history for an exercise.
+    The insights are streamed to the client as the llm writes them.
+    ?window=N sets how many past workouts are analyzed and ?cursor= starts further back in the history.
 
     Args:
         name(str)-name of exercise we want insights for
@@ -75,9 +256,55 @@ def get_exercise_insights(name):
     Returns:
         Actionable insights for the exercise to be displayed in the front end
     """
-    from services.ollama_service import generate_insights
-    insights = generate_insights(name)
-    return insights
+    window = request.args.get('window', type=int)
+    cursor = request.args.get('cursor')
+    return Response(stream_with_context(generate_insights_stream(name, window, cursor)), mimetype='text/plain')
+
+@app.route("/getHistory/<name>",methods=['GET'])
+def get_exercise_history(name):
+    """
+    Gets a page of past workouts containing an exercise, newest first.
+    ?limit=N sets the page size and ?cursor= is the next_cursor of the previous page.
+
+    Args:
+        name(str)-name of exercise we want the history of
+
+    Returns:
+        Past workouts with their sets for the exercise and the cursor of the next page
+    """
+    page = get_past_exercise_page(name, request.args.get('limit', HISTORY_WINDOW, type=int), request.args.get('cursor'))
+    if page is None:
+        return {'error':f'Could not retrieve history for {name}'}, 500
+    workouts, next_cursor = page
+    return {'workouts':workouts,'next_cursor':next_cursor}
+
+@app.route("/getAnalytics/<name>",methods=['GET'])
+def get_exercise_analytics(name):
+    """
+    Gets the progression analytics of an exercise for charts without calling the llm.
+    ?window=N sets how many recent sessions the trends are computed over.
+
+    Args:
+        name(str)-name of exercise we want analytics for
+
+    Returns:
+        Session series(top set, estimated 1RM, volume), best and latest sets, rep PRs, trend slopes and plateau status
+    """
+    features = analytics.exercise_features(name, request.args.get('window', analytics.TREND_SESSIONS, type=int))
+    if features is None:
+        return {'error':f'Could not retrieve analytics for {name}'}, 500
+    return features
+
+@app.route("/metrics",methods=['GET'])
+def get_metrics():
+    """
+    Exports request, stage, llm and database metrics for Prometheus
+
+    Returns:
+        Metrics in the Prometheus text format
+    """
+    data, content_type = metrics.export()
+    return Response(data, content_type=content_type)
 
 if __name__ == "__main__":
     """
@@ -0,0 +1,200 @@
+"""
+This file load tests the api and reports latency and throughput per endpoint and pipeline stage
+
+Requests to /generateProgram, /updateProgram, /getInsights and /insertProgram are sent concurrently
+through Flask's test client. The llm is the stub backend replaying benchmarks/data/llm_recordings.jsonl
+unless ZFIT_LLM_BACKEND is set, and the llm cache is disabled so every request reaches the backend.
+/insertProgram writes the benchmark workouts to the account the requests act as, so it is only sent when
+--token is given for a test account. Every endpoint is called once before the run and the benchmark stops if
+one is rejected, failed requests during the run are counted but left out of the latency. Run from the ZFIT_API directory:
+    python -m benchmarks.api_benchmark --requests 20 --concurrency 4
+"""
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import threading
+import argparse
+import time
+import os
+
+ENDPOINTS = ('generateProgram', 'updateProgram', 'getInsights', 'insertProgram')
+USER_DETAILS = {
+    'age':'25',
+    'gender':'male',
+    'level':'intermediate',
+    'goal':'Build muscle',
+    'days':['Monday','Wednesday','Friday'],
+    'startdate':'2025-01-06T00:00:00.000Z',
+    'equipment':['Barbell','Dumbbells','Cable Machine','Bench']
+}
+CHANGES = ('Make Wednesday focus on legs', 'Add 5 lbs to Bench Press') #the first needs the llm, the second is parsed locally
+INSIGHTS_EXERCISE = 'Bench Press'
+FALLBACK_PROGRAM = [{
+    'title':'Push',
+    'date':['2025-01-06'],
+    'musclegroups':['Chest','Triceps'],
+    'sets':[
+        {'exercise':'Bench Press','set_num':1,'lbs':135,'reps':8},
+        {'exercise':'Bench Press','set_num':2,'lbs':135,'reps':8},
+        {'exercise':'Tricep Pushdown','set_num':1,'lbs':50,'reps':12},
+        {'exercise':'Dumbbell Fly','set_num':1,'lbs':30,'reps':12}
+    ]
+}] #used by /updateProgram and /insertProgram if /generateProgram is not benchmarked or returns nothing
+
+_lock = threading.Lock()
+_timings = {} #endpoint or stage -> list of seconds
+
+def record(name, seconds):
+    """
+    Records how long an endpoint or stage took
+
+    Args:
+        name(str): name of the endpoint or stage
+        seconds(float): duration
+    """
+    with _lock:
+        _timings.setdefault(name, []).append(seconds)
+
+def timed(name, fn):
+    """
+    Wraps a function so every call is recorded as a stage
+
+    Args:
+        name(str): name of the stage
+        fn(function): function to wrap
+
+    Returns:
+        function that calls fn and records its duration
+    """
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            record(name, time.perf_counter()-start)
+    return wrapper
+
+def timed_stream(name, fn):
+    """
+    Wraps a generator function so every call is recorded as a stage, from the call until its last item
+
+    Args:
+        name(str): name of the stage
+        fn(function): generator function to wrap
+
+    Returns:
+        generator function that yields from fn and records its duration
+    """
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            yield from fn(*args, **kwargs)
+        finally:
+            record(name, time.perf_counter()-start)
+    return wrapper
+
+def instrument():
+    """
+    Times the pipeline stages by wrapping the functions the endpoints call
+
+    Returns:
+        the Flask app
+    """
+    import app
+    from services import ollama_service
+    app.generate_plan_rows = timed_stream('generate', app.generate_plan_rows) #the default csv plan, matched while it streams
+    app.generate_structured_plan = timed('generate', app.generate_structured_plan)
+    app.clean_csv = timed('match', app.clean_csv)
+    app.structure_csv = timed('structure', app.structure_csv)
+    app.alter_program = timed('alter', app.alter_program)
+    app.insert_workouts = timed('insert', app.insert_workouts)
+    ollama_service.insights_summary = timed('analytics', ollama_service.insights_summary)
+    ollama_service.generate = timed('llm call', ollama_service.generate)
+    ollama_service.generate_stream = timed_stream('llm call', ollama_service.generate_stream)
+    return app.app
+
+def send(client, endpoint, headers, program, i):
+    """
+    Sends one request and records its latency
+
+    Args:
+        client: Flask test client
+        endpoint(str): endpoint to call
+        headers(dict): headers sent with the request
+        program(list[dict]): program sent to /updateProgram and /insertProgram
+        i(int): number of the request, used to vary the request body
+
+    Returns:
+        the response
+    """
+    start = time.perf_counter()
+    if endpoint == 'generateProgram':
+        response = client.post('/generateProgram', json=USER_DETAILS, headers=headers)
+    elif endpoint == 'updateProgram':
+        response = client.post('/updateProgram', json=[program, CHANGES[i % len(CHANGES)]], headers=headers)
+    elif endpoint == 'getInsights':
+        response = client.get(f'/getInsights/{INSIGHTS_EXERCISE}', headers=headers)
+    else:
+        response = client.post('/insertProgram', json=program, headers=headers)
+    response.get_data() #reads streamed responses to the end
+    if response.status_code >= 400: #a rejected request returns early, its latency would flatter the endpoint
+        record(f'{endpoint} errors', 0)
+    else:
+        record(endpoint, time.perf_counter()-start)
+    return response
+
+def report(wall_seconds):
+    """
+    Prints latency percentiles and throughput for every endpoint and stage
+
+    Args:
+        wall_seconds(float): duration of the whole run
+    """
+    print(f"{'endpoint/stage':<18} {'count':>6} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9} {'per sec':>8}")
+    for name in [*ENDPOINTS, 'generate', 'match', 'structure', 'alter', 'insert', 'analytics', 'llm call']:
+        if name not in _timings:
+            continue
+        milliseconds = np.array(_timings[name])*1000
+        p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+        print(f'{name:<18} {len(milliseconds):>6} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f} {len(milliseconds)/wall_seconds:>8.2f}')
+    for endpoint in ENDPOINTS:
+        if f'{endpoint} errors' in _timings:
+            print(f"{endpoint}: {len(_timings[f'{endpoint} errors'])} requests failed")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load tests the api')
+    parser.add_argument('--requests', type=int, default=20, help='requests sent to each endpoint')
+    parser.add_argument('--concurrency', type=int, default=4, help='requests in flight at once')
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, help='endpoints to benchmark, every endpoint except insertProgram unless --token is given')
+    parser.add_argument('--token', help='supabase access token the requests act as, the development account in ZFIT_DEV_EMAIL/ZFIT_DEV_PASSWORD if not provided')
+    parser.add_argument('--llm-cache', action='store_true', help='keep the llm cache enabled')
+    args = parser.parse_args()
+    if args.endpoints is None:
+        args.endpoints = [endpoint for endpoint in ENDPOINTS if args.token or endpoint != 'insertProgram']
+    elif 'insertProgram' in args.endpoints and not args.token:
+        parser.error('insertProgram writes the benchmark workouts to the account the requests act as, pass --token for a test account')
+    os.environ.setdefault('ZFIT_LLM_BACKEND', 'stub')
+    if not args.llm_cache:
+        os.environ['ZFIT_LLM_CACHE_SIZE'] = '0'
+        os.environ.pop('ZFIT_LLM_CACHE_PATH', None)
+    flask_app = instrument()
+    headers = {'Authorization':f'Bearer {args.token}'} if args.token else {}
+    client = flask_app.test_client()
+
+    program = FALLBACK_PROGRAM
+    for endpoint in args.endpoints: #warms up every endpoint and stops before the run if the requests are rejected
+        if endpoint == 'insertProgram':
+            continue #only the benchmark run writes workouts
+        response = send(client, endpoint, headers, program, 0)
+        if response.status_code >= 400:
+            raise SystemExit(f'/{endpoint} responded {response.status_code}: {response.get_data(as_text=True).strip()[:200]}\nPass --token or set ZFIT_DEV_EMAIL/ZFIT_DEV_PASSWORD')
+        if endpoint == 'generateProgram': #a real program for the other endpoints
+            program = response.get_json() or FALLBACK_PROGRAM
+    _timings.clear()
+
+    calls = [(endpoint, i) for i in range(args.requests) for endpoint in args.endpoints]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(lambda call: send(flask_app.test_client(), call[0], headers, program, call[1]), calls))
+    wall_seconds = time.perf_counter()-start
+    print(f"{len(calls)} requests, concurrency {args.concurrency}, llm backend {os.environ['ZFIT_LLM_BACKEND']}, {wall_seconds:.1f}s")
+    report(wall_seconds)
@@ -0,0 +1,95 @@
+"""
+This file runs the stub llm backend as a local server that speaks ollama's /api/generate protocol
+
+The api can then be benchmarked end to end, including the ollama client, without a model.
+Run from the ZFIT_API directory:
+    python -m benchmarks.llm_stub_server --port 11435
+and start the api with OLLAMA_HOST=http://127.0.0.1:11435
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from datetime import datetime, timezone
+from services.llm_backends import StubBackend, RECORDINGS_PATH, STUB_LATENCY_SECONDS, STUB_CHUNK_SECONDS, STUB_PARALLEL
+import argparse
+import json
+
+GENERATE_ARGUMENTS = ('format', 'options', 'system', 'template', 'context', 'raw') #request fields that are part of a recording's key
+
+def response_body(model, stub_response):
+    """
+    Converts a stub response to an ollama response body
+
+    Args:
+        model(str): name of the model
+        stub_response(StubResponse): the response or part of the response
+
+    Returns:
+        dict containing the ollama response fields
+    """
+    body = {
+        'model':model,
+        'created_at':datetime.now(timezone.utc).isoformat(),
+        'response':stub_response.response,
+        'done':stub_response.done
+    }
+    if stub_response.done:
+        body.update({'done_reason':'stop','prompt_eval_count':stub_response.prompt_eval_count,'eval_count':stub_response.eval_count})
+    return body
+
+def make_handler(stub):
+    """
+    Creates the request handler for the server
+
+    Args:
+        stub(StubBackend): backend answering the requests
+
+    Returns:
+        BaseHTTPRequestHandler subclass
+    """
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1' #keeps connections alive like ollama
+
+        def send_json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path != '/api/generate':
+                self.send_json(404, {'error':f'{self.path} is not supported by the stub'})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            model, prompt = request.get('model', ''), request.get('prompt', '')
+            kwargs = {key:request[key] for key in GENERATE_ARGUMENTS if request.get(key) is not None}
+            if not request.get('stream', True):
+                self.send_json(200, response_body(model, stub.generate(model, prompt, **kwargs)))
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for chunk in stub.generate(model, prompt, stream=True, **kwargs):
+                line = (json.dumps(response_body(model, chunk))+'\n').encode()
+                self.wfile.write(f'{len(line):x}\r\n'.encode()+line+b'\r\n')
+                self.wfile.flush()
+            self.wfile.write(b'0\r\n\r\n')
+
+        def log_message(self, format, *args):
+            pass #one line per request would drown out the benchmark output
+
+    return StubHandler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serves recorded llm responses over the ollama api')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--recordings', default=RECORDINGS_PATH)
+    parser.add_argument('--latency', type=float, default=STUB_LATENCY_SECONDS, help='seconds before the first part of a response')
+    parser.add_argument('--chunk-latency', type=float, default=STUB_CHUNK_SECONDS, help='seconds between streamed parts')
+    parser.add_argument('--parallel', type=int, default=STUB_PARALLEL, help='requests answered at once')
+    args = parser.parse_args()
+    stub = StubBackend(args.recordings, args.latency, args.chunk_latency, args.parallel)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(stub))
+    print(f'Stub llm listening on http://127.0.0.1:{args.port}')
+    server.serve_forever()
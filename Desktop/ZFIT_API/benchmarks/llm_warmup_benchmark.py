@@ -0,0 +1,110 @@
+"""
+This file measures cold and warm llm latency for each call type against an ollama server
+
+Every round unloads the model, then sends each call type once cold and once warm. The cold call has to load the
+model and evaluate the whole prompt. The warm call finds the model loaded and the system prompt cached from the
+call before it, so only the request data is evaluated. The request data is different for every call so neither
+the llm cache nor an identical prompt is reused. Ollama's own load, prompt evaluation and generation times are
+reported next to the total. Run from the ZFIT_API directory with ollama running:
+    python -m benchmarks.llm_warmup_benchmark --rounds 3
+"""
+from services import ollama_service
+from services.ollama_service import (
+    PLAN_CSV_SYSTEM, PLAN_SYSTEM, MATCH_BATCH_SYSTEM, EDIT_SYSTEM, INSIGHTS_SYSTEM, PLAN_OPTIONS,
+    plan_prompt, structured_plan_prompt, insights_prompt, program_summary, call_options
+)
+from services.llm_backends import OllamaBackend
+from processing.plan_validation import PLAN_SCHEMA
+from processing.program_edits import EDIT_SCHEMA
+from benchmarks.api_benchmark import USER_DETAILS, FALLBACK_PROGRAM
+from utils.util import get_dates_list
+import numpy as np
+import argparse
+import time
+
+CALL_TYPES = ('plan_csv', 'plan', 'match_batch', 'edits', 'insights') #plan_csv is the default plan, plan the json plan and its repairs
+PAST_EXERCISES = ['Bench Press','Incline Dumbbell Press','Tricep Pushdown','Squat','Leg Press','Romanian Deadlift','Barbell Row','Lat Pulldown','Overhead Press','Dumbbell Curl']
+NEW_EXERCISES = ['Close Grip Bench Press','Goblet Squat','Cable Row','Hammer Curl','Arnold Press','Hack Squat']
+CHANGES = ['Replace Tricep Pushdown with Skull Crushers', 'Add a set of Dumbbell Fly', 'Move the workout to Tuesday', 'Swap Bench Press for Dumbbell Press']
+NANOSECONDS = 1e9
+
+def call(call_type, i):
+    """
+    Gets the prompt and generation arguments of a call type, with request data that changes with i
+
+    Args:
+        call_type(str): one of CALL_TYPES
+        i(int): number of the call
+
+    Returns:
+        tuple of the prompt and the generation arguments
+    """
+    if call_type == 'plan_csv':
+        prompt = plan_prompt(str(20+i), USER_DETAILS['level'], USER_DETAILS['gender'], USER_DETAILS['goal'], USER_DETAILS['days'], USER_DETAILS['equipment'], USER_DETAILS['startdate'].split('T')[0])
+        return prompt, {'system':PLAN_CSV_SYSTEM,'options':call_options('plan')}
+    if call_type == 'plan':
+        dates_list = get_dates_list(USER_DETAILS['startdate'].split('T')[0], USER_DETAILS['days'])
+        prompt = structured_plan_prompt(str(20+i), USER_DETAILS['level'], USER_DETAILS['gender'], USER_DETAILS['goal'], USER_DETAILS['equipment'], dates_list)
+        return prompt, {'system':PLAN_SYSTEM,'format':PLAN_SCHEMA,'options':call_options('plan', **PLAN_OPTIONS)}
+    if call_type == 'match_batch':
+        batch = NEW_EXERCISES[i % len(NEW_EXERCISES):] + NEW_EXERCISES[:i % len(NEW_EXERCISES)]
+        prompt = f'The list of past exercises is: {PAST_EXERCISES}.\nExercises to match: {batch}\n'
+        return prompt, {'system':MATCH_BATCH_SYSTEM,'format':'json','options':call_options('match_batch')}
+    if call_type == 'edits':
+        prompt = f'This is a workout program:\n{program_summary(FALLBACK_PROGRAM)}\nConvert the changes "{CHANGES[i % len(CHANGES)]}" into a list of edits.\n'
+        return prompt, {'system':EDIT_SYSTEM,'format':EDIT_SCHEMA,'options':call_options('edits')}
+    summary = f'Bench Press: {12+i} sessions from 2024-09-02 to 2024-12-02\nBest set: {165+5*i} lbs x 8 on 2024-11-25 (estimated 1RM {209+6*i} lbs)\nLast PR 1 sessions ago'
+    return insights_prompt('Bench Press', summary), {'system':INSIGHTS_SYSTEM,'options':call_options('insights')}
+
+def timed_call(backend, call_type, i):
+    """
+    Sends one call and gets its timings
+
+    Args:
+        backend(OllamaBackend): backend the call is sent to
+        call_type(str): one of CALL_TYPES
+        i(int): number of the call
+
+    Returns:
+        dict containing the total, load, prompt evaluation and generation seconds and the prompt tokens evaluated
+    """
+    prompt, kwargs = call(call_type, i)
+    start = time.perf_counter()
+    response = backend.generate(ollama_service.model, prompt, **kwargs)
+    return {
+        'total':time.perf_counter()-start,
+        'load':(getattr(response, 'load_duration', None) or 0)/NANOSECONDS,
+        'prompt eval':(getattr(response, 'prompt_eval_duration', None) or 0)/NANOSECONDS,
+        'generation':(getattr(response, 'eval_duration', None) or 0)/NANOSECONDS,
+        'prompt tokens':getattr(response, 'prompt_eval_count', None) or 0
+    }
+
+def report(timings):
+    """
+    Prints the median timings of every call type cold and warm
+
+    Args:
+        timings(dict): (call type, cold or warm) -> list of timings from timed_call
+    """
+    print(f"{'call type':<12} {'state':<5} {'count':>5} {'total(ms)':>10} {'load(ms)':>9} {'prompt(ms)':>11} {'gen(ms)':>9} {'prompt tokens':>14}")
+    for (call_type, state), calls in timings.items():
+        medians = {name:np.median([timing[name] for timing in calls]) for name in calls[0]}
+        print(
+            f"{call_type:<12} {state:<5} {len(calls):>5} {medians['total']*1000:>10.0f} {medians['load']*1000:>9.0f} "
+            f"{medians['prompt eval']*1000:>11.0f} {medians['generation']*1000:>9.0f} {medians['prompt tokens']:>14.0f}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measures cold and warm llm latency per call type')
+    parser.add_argument('--rounds', type=int, default=3, help='cold and warm calls sent for each call type')
+    parser.add_argument('--call-types', nargs='+', choices=CALL_TYPES, default=list(CALL_TYPES))
+    args = parser.parse_args()
+    backend = OllamaBackend()
+    timings = {}
+    for round_number in range(args.rounds):
+        for call_type in args.call_types:
+            backend.unload(ollama_service.model)
+            timings.setdefault((call_type, 'cold'), []).append(timed_call(backend, call_type, 2*round_number))
+            timings.setdefault((call_type, 'warm'), []).append(timed_call(backend, call_type, 2*round_number+1))
+    print(f"{args.rounds} rounds, model {ollama_service.model}, keep alive {backend.keep_alive}, context {ollama_service.NUM_CTX} tokens")
+    report(timings)
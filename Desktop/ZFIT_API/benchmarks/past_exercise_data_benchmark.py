@@ -0,0 +1,100 @@
+"""
+This file benchmarks the query behind get_past_exercise_page on multi-year histories
+
+A local sqlite database stands in for Postgres/PostgREST and runs the SQL shape of both requests:
+- previous: every workout before today with its matching sets embedded(left join), filtered and sliced to 10 in Python
+- current: workouts with an inner join on the exercise, ordered and limited by the database
+Run from the ZFIT_API directory:
+    python -m benchmarks.past_exercise_data_benchmark
+"""
+from datetime import date, timedelta
+import sqlite3
+import random
+import timeit
+import json
+
+WORKOUTS_PER_WEEK = 5
+EXERCISES = ['Bench Press','Squat','Deadlift','Overhead Press','Barbell Row','Lat Pulldown','Leg Press','Dumbbell Curl','Tricep Pushdown','Lateral Raise']
+EXERCISES_PER_WORKOUT = 5
+SETS_PER_EXERCISE = 4
+YEARS = (1, 3, 5, 10)
+WINDOW = 10
+
+def make_history(years):
+    """
+    Creates a database with a synthetic workout history
+
+    Args:
+        years(int): number of years of workouts
+
+    Returns:
+        sqlite3 connection to the database
+    """
+    random.seed(years)
+    connection = sqlite3.connect(':memory:')
+    connection.execute('CREATE TABLE workout (id INTEGER PRIMARY KEY, date TEXT)')
+    connection.execute('CREATE TABLE "set" (id INTEGER REFERENCES workout(id), exercise TEXT, set_num INTEGER, lbs REAL, reps INTEGER)')
+    connection.execute('CREATE INDEX set_id ON "set"(id)')
+    connection.execute('CREATE INDEX set_exercise ON "set"(exercise, id)')
+    connection.execute('CREATE INDEX workout_date ON workout(date, id)')
+    start = date.today() - timedelta(days=365*years)
+    workouts, sets = [], []
+    for day in range(365*years):
+        if day % 7 >= WORKOUTS_PER_WEEK:
+            continue
+        workout_id = len(workouts)+1
+        workouts.append((workout_id, (start+timedelta(days=day)).isoformat()))
+        for exercise in random.sample(EXERCISES, EXERCISES_PER_WORKOUT):
+            for set_num in range(1, SETS_PER_EXERCISE+1):
+                sets.append((workout_id, exercise, set_num, random.randint(50, 300), random.randint(3, 12)))
+    connection.executemany('INSERT INTO workout VALUES (?, ?)', workouts)
+    connection.executemany('INSERT INTO "set" VALUES (?, ?, ?, ?, ?)', sets)
+    return connection
+
+def previous_query(connection, exercise):
+    """
+    Every workout before today with its sets for the exercise, filtered and sliced in Python
+
+    Returns:
+        tuple of the past workouts and the size of the json response in bytes
+    """
+    rows = connection.execute(
+        'SELECT w.id, w.date, s.set_num, s.lbs, s.reps FROM workout w LEFT JOIN "set" s ON s.id = w.id AND s.exercise = ? '
+        'WHERE w.date < ? ORDER BY w.date DESC', (exercise, date.today().isoformat())).fetchall()
+    workouts = {}
+    for workout_id, workout_date, set_num, lbs, reps in rows:
+        workout = workouts.setdefault(workout_id, {'date':workout_date,'set':[]})
+        if set_num is not None:
+            workout['set'].append({'set_num':set_num,'lbs':lbs,'reps':reps})
+    response = json.dumps(list(workouts.values())) #what PostgREST sends back
+    return [workout for workout in json.loads(response) if workout['set']][0:WINDOW], len(response)
+
+def current_query(connection, exercise):
+    """
+    The last WINDOW workouts containing the exercise, selected by the database
+
+    Returns:
+        tuple of the past workouts and the size of the json response in bytes
+    """
+    rows = connection.execute(
+        'SELECT w.id, w.date, s.set_num, s.lbs, s.reps FROM '
+        '(SELECT id, date FROM workout WHERE date < ? AND EXISTS (SELECT 1 FROM "set" WHERE "set".id = workout.id AND exercise = ?) '
+        'ORDER BY date DESC, id DESC LIMIT ?) w JOIN "set" s ON s.id = w.id AND s.exercise = ? ORDER BY w.date DESC, w.id DESC',
+        (date.today().isoformat(), exercise, WINDOW, exercise)).fetchall()
+    workouts = {}
+    for workout_id, workout_date, set_num, lbs, reps in rows:
+        workouts.setdefault(workout_id, {'date':workout_date,'set':[]})['set'].append({'set_num':set_num,'lbs':lbs,'reps':reps})
+    response = json.dumps(list(workouts.values()))
+    return json.loads(response), len(response)
+
+if __name__ == "__main__":
+    print(f"{'years':>6} {'workouts':>9} {'previous(ms)':>13} {'current(ms)':>12} {'previous(KB)':>13} {'current(KB)':>12}")
+    for years in YEARS:
+        connection = make_history(years)
+        workout_count = connection.execute('SELECT COUNT(*) FROM workout').fetchone()[0]
+        previous, previous_bytes = previous_query(connection, 'Bench Press')
+        current, current_bytes = current_query(connection, 'Bench Press')
+        assert [workout['date'] for workout in previous] == [workout['date'] for workout in current], 'queries returned different workouts'
+        previous_ms = min(timeit.repeat(lambda: previous_query(connection, 'Bench Press'), number=1, repeat=5))*1000
+        current_ms = min(timeit.repeat(lambda: current_query(connection, 'Bench Press'), number=1, repeat=5))*1000
+        print(f'{years:>6} {workout_count:>9} {previous_ms:>13.1f} {current_ms:>12.2f} {previous_bytes/1024:>13.1f} {current_bytes/1024:>12.1f}')
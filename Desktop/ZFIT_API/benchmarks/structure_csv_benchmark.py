@@ -0,0 +1,81 @@
+"""
+This file benchmarks structure_csv on multi-week programs
+
+Compares the current implementation against the previous groupby + iterrows implementation
+and checks both produce the same workouts. Run from the ZFIT_API directory:
+    python -m benchmarks.structure_csv_benchmark
+"""
+import pandas as pd
+import timeit
+from processing.workout_processing import structure_csv
+from utils.util import ProgramSet, PROGRAM_HEADER
+
+DAYS_PER_WEEK = 5
+EXERCISES_PER_DAY = 6
+SETS_PER_EXERCISE = 4
+WEEKS = (1, 4, 12, 52)
+
+def iterrows_structure_csv(program_sets):
+    """
+    The previous structure_csv implementation, kept as the baseline
+
+    Args:
+        program_sets(list[ProgramSet]): every set in the workout plan
+
+    Returns:
+        Python dictionary containing workout information
+    """
+    df = pd.DataFrame(program_sets, columns=PROGRAM_HEADER)
+    workouts = []
+    for date,data in df.groupby(['date']):
+        workout = {'title':set(),'date':date,'musclegroups':set(),'sets':[]}
+        for index,row in data.iterrows():
+            workout['title'].add(row['title'])
+            workout['musclegroups'].update(row['musclegroups'].split(';'))
+            workout['sets'].append({'exercise':row['exercise'],'set_num':row['set_num'],'lbs':row['lbs'],'reps':row['reps']})
+        workout['musclegroups'] = sorted(workout['musclegroups']) #sets have no order, sorted so outputs can be compared
+        workout['title'] = '/'.join(sorted(workout['title']))
+        workouts.append(workout)
+    return workouts
+
+def make_program(weeks):
+    """
+    Creates a synthetic program
+
+    Args:
+        weeks(int): number of weeks in the program
+
+    Returns:
+        list[ProgramSet] containing every set in the program
+    """
+    program_sets = []
+    start = pd.Timestamp('2025-01-06')
+    for week in range(weeks):
+        for day in range(DAYS_PER_WEEK):
+            workout_date = (start + pd.Timedelta(days=week*7+day)).date().isoformat()
+            for exercise in range(EXERCISES_PER_DAY):
+                for set_num in range(1, SETS_PER_EXERCISE+1):
+                    program_sets.append(ProgramSet(f'Day {day+1}', workout_date, f'Muscle {exercise%3}', f'Exercise {exercise}', set_num, 100+5*week, 8))
+    return program_sets
+
+def normalize(workouts):
+    """
+    Sorts the unordered fields of each workout so outputs can be compared
+
+    Args:
+        workouts(list[dict]): structured workouts
+
+    Returns:
+        list[dict] with sorted musclegroups
+    """
+    return [{**workout,'musclegroups':sorted(workout['musclegroups'])} for workout in workouts]
+
+if __name__ == "__main__":
+    print(f"{'weeks':>6} {'sets':>8} {'iterrows(ms)':>14} {'current(ms)':>12} {'speedup':>8}")
+    for weeks in WEEKS:
+        program_sets = make_program(weeks)
+        assert normalize(structure_csv(program_sets)) == iterrows_structure_csv(program_sets), 'outputs differ'
+        runs = 3
+        baseline = min(timeit.repeat(lambda: iterrows_structure_csv(program_sets), number=1, repeat=runs))*1000
+        current = min(timeit.repeat(lambda: structure_csv(program_sets), number=1, repeat=runs))*1000
+        print(f'{weeks:>6} {len(program_sets):>8} {baseline:>14.1f} {current:>12.1f} {baseline/current:>7.1f}x')
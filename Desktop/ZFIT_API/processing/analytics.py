@@ -0,0 +1,199 @@
+"""
+This file computes progression analytics for each exercise from the user's full set history
+
+Every exercise gets an estimated one rep max and volume series per session, rep PRs, trend slopes and plateau
+detection, computed with pandas over all of its sets in processing/set_history.py. The sessions of an exercise
+are cached per user and only recomputed after the exercise gets new sets or the history is reloaded.
+"""
+from services.supabase_client import current_user_id
+from processing import set_history
+from services.metrics import traced
+from datetime import date
+import pandas as pd
+import numpy as np
+import threading
+
+TREND_SESSIONS = 10 #most recent sessions the trend slopes are fit over by default
+PLATEAU_SESSIONS = 4 #sessions without a new estimated one rep max before an exercise counts as plateaued
+SUMMARY_SESSIONS = 3 #most recent sessions listed in the summary sent to the llm
+REP_PR_LIMIT = 5 #most recent rep PRs returned
+SET_COLUMNS = ['workout','date','lbs','reps']
+
+_lock = threading.Lock()
+_sessions_cache = {} #(user id, exercise name(title case)) -> (history generation, sets computed, result of compute_sessions)
+
+def _forget(user_id):
+    """
+    Drops a user's sessions when their history is dropped
+
+    Args:
+        user_id(str): id of the user
+    """
+    with _lock:
+        for cache_key in [cache_key for cache_key in _sessions_cache if cache_key[0] == user_id]:
+            del _sessions_cache[cache_key]
+
+set_history.on_evict(_forget)
+
+def compute_sessions(rows):
+    """
+    Groups an exercise's sets into sessions
+
+    Args:
+        rows(list[tuple]): sets of the exercise as (workout id, date, lbs, reps)
+
+    Returns:
+        tuple of a DataFrame with one row per session in date order(date, lbs and reps of the top set, estimated_1rm,
+        volume, reps, sets) and a DataFrame of rep PRs(date, lbs, reps, previous_reps)
+    """
+    sets = pd.DataFrame(rows, columns=SET_COLUMNS)
+    sets['workout'] = sets['workout'].fillna(sets['date']) #sets without a workout are grouped by their date
+    sets['estimated_1rm'] = np.where(sets['reps'] <= 1, sets['lbs'], sets['lbs']*(1+sets['reps']/30)) #Epley formula
+    sets['volume'] = sets['lbs']*sets['reps']
+    sets = sets.sort_values(['date','workout','estimated_1rm','reps'], kind='stable')
+    session_keys = ['date','workout']
+    totals = sets.groupby(session_keys, sort=True).agg(volume=('volume','sum'), total_reps=('reps','sum'), sets=('reps','size'))
+    top_sets = sets.groupby(session_keys, sort=True).tail(1).set_index(session_keys)[['lbs','reps','estimated_1rm']]
+    sessions = top_sets.join(totals).reset_index().rename(columns={'total_reps':'session_reps'})
+
+    by_weight = sets.groupby(['date','workout','lbs'], sort=True)['reps'].max().reset_index() #most reps at each weight in each session
+    by_weight['previous_reps'] = by_weight.groupby('lbs')['reps'].cummax().groupby(by_weight['lbs']).shift()
+    rep_prs = by_weight[by_weight['reps'] > by_weight['previous_reps']][['date','lbs','reps','previous_reps']]
+    return sessions, rep_prs
+
+def _sessions(exercise):
+    """
+    Gets the sessions and rep PRs of an exercise, computing them if its sets changed since they were last computed
+
+    Args:
+        exercise(str): the name of the exercise
+
+    Returns:
+        tuple from compute_sessions, None if the exercise has no sets
+    """
+    cache_key = (current_user_id(), exercise.title())
+    generation, history_sets = set_history.exercise_sets(exercise)
+    rows = [(history_set.workout, history_set.date, float(history_set.lbs), float(history_set.reps)) for history_set in history_sets if history_set.date]
+    if not rows:
+        return None
+    with _lock:
+        cached = _sessions_cache.get(cache_key)
+    if cached is not None and cached[:2] == (generation, len(rows)):
+        return cached[2]
+    computed = compute_sessions(rows)
+    with _lock:
+        _sessions_cache[cache_key] = (generation, len(rows), computed)
+    return computed
+
+def slope_per_week(dates, values):
+    """
+    Fits a line through a series and gets its slope
+
+    Args:
+        dates(pd.Series): dates(YYYY-MM-DD) of the values
+        values(pd.Series): the values
+
+    Returns:
+        float containing the change per week, 0 if the series spans less than two days
+    """
+    days = (pd.to_datetime(dates) - pd.to_datetime(dates.iloc[0])).dt.days.to_numpy(dtype=float) if len(dates) else np.array([])
+    if len(days) < 2 or days[-1] == days[0]:
+        return 0.0
+    return float(np.polyfit(days, values.to_numpy(dtype=float), 1)[0]*7)
+
+def _top_set(session):
+    """
+    Converts a session row to its top set
+
+    Args:
+        session(pd.Series): row of the sessions DataFrame
+
+    Returns:
+        dict containing the date, lbs, reps and estimated one rep max of the top set
+    """
+    return {'date':session['date'],'lbs':round(float(session['lbs']),1),'reps':int(session['reps']),'estimated_1rm':round(float(session['estimated_1rm']),1)}
+
+@traced
+def exercise_features(exercise, window=TREND_SESSIONS, before=None):
+    """
+    Gets the progression features of an exercise
+
+    Args:
+        exercise(str): the name of the exercise
+        window(int): most recent sessions the trend slopes are fit over
+        before(str): only sessions before this date(YYYY-MM-DD) are analyzed, defaults to today
+
+    Returns:
+        dict containing the session series, best and latest top sets, rep PRs, trend slopes and plateau status,
+        None if the history could not be loaded
+    """
+    if not set_history.ensure_warm():
+        return None
+    window = max(2, int(window))
+    before = before or date.today().isoformat()
+    features = {'exercise':exercise,'metric':'estimated_1rm','session_count':0,'best':None,'latest':None,'rep_prs':[],'trend':None,'plateau':None,'sessions':[]}
+    computed = _sessions(exercise)
+    if computed is None:
+        return features
+    sessions, rep_prs = computed
+    sessions = sessions[sessions['date'] < before] #planned workouts are saved ahead of time
+    rep_prs = rep_prs[rep_prs['date'] < before]
+    if sessions.empty:
+        return features
+
+    metric = 'estimated_1rm' if (sessions['lbs'] > 0).any() else 'reps' #bodyweight exercises progress in reps
+    values = sessions[metric]
+    is_pr = values > values.cummax().shift(fill_value=-np.inf)
+    last_pr = int(np.flatnonzero(is_pr.to_numpy())[-1])
+    sessions_since_pr = len(sessions)-1-last_pr
+    recent = sessions.tail(window)
+    features.update({
+        'metric':metric,
+        'session_count':len(sessions),
+        'best':_top_set(sessions.iloc[int(values.to_numpy().argmax())]),
+        'latest':_top_set(sessions.iloc[-1]),
+        'rep_prs':[
+            {'date':pr.date,'lbs':round(float(pr.lbs),1),'reps':int(pr.reps),'previous_reps':int(pr.previous_reps)}
+            for pr in rep_prs.tail(REP_PR_LIMIT).itertuples()
+        ],
+        'trend':{
+            'sessions':len(recent),
+            'slope_per_week':round(slope_per_week(recent['date'], recent[metric]),2),
+            'volume_slope_per_week':round(slope_per_week(recent['date'], recent['volume']),1)
+        },
+        'plateau':{'plateaued':sessions_since_pr >= PLATEAU_SESSIONS,'sessions_since_pr':sessions_since_pr},
+        'sessions':[
+            {'date':session.date,'top_set':{'lbs':round(float(session.lbs),1),'reps':int(session.reps)},'estimated_1rm':round(float(session.estimated_1rm),1),
+             'volume':round(float(session.volume),1),'reps':int(session.session_reps),'sets':int(session.sets)}
+            for session in sessions.itertuples()
+        ]
+    })
+    return features
+
+def feature_summary(features):
+    """
+    Converts the features of an exercise to a compact summary for the llm
+
+    Args:
+        features(dict): features from exercise_features
+
+    Returns:
+        string containing one line per feature
+    """
+    if not features['session_count']:
+        return f"{features['exercise']}: no past sessions"
+    sessions, best, trend = features['sessions'], features['best'], features['trend']
+    unit = 'lbs' if features['metric'] == 'estimated_1rm' else 'reps'
+    lines = [
+        f"{features['exercise']}: {features['session_count']} sessions from {sessions[0]['date']} to {sessions[-1]['date']}",
+        f"Best set: {best['lbs']:g} lbs x {best['reps']} on {best['date']} (estimated 1RM {best['estimated_1rm']:g} lbs)",
+        'Latest sessions (top set, total volume, sets): ' + '; '.join(
+            f"{session['date']}: {session['top_set']['lbs']:g} lbs x {session['top_set']['reps']}, {session['volume']:g} lbs, {session['sets']} sets"
+            for session in sessions[-SUMMARY_SESSIONS:]
+        ),
+        f"Trend over the last {trend['sessions']} sessions: {'estimated 1RM' if unit == 'lbs' else 'top set reps'} {trend['slope_per_week']:+g} {unit}/week, volume {trend['volume_slope_per_week']:+g} lbs/week",
+        f"Last PR {features['plateau']['sessions_since_pr']} sessions ago" + (' (plateaued)' if features['plateau']['plateaued'] else '')
+    ]
+    if features['rep_prs']:
+        lines.append('Recent rep PRs: ' + '; '.join(f"{pr['date']}: {pr['lbs']:g} lbs x {pr['reps']} (was {pr['previous_reps']})" for pr in features['rep_prs']))
+    return '\n'.join(lines)
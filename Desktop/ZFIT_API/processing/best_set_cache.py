@@ -0,0 +1,142 @@
+"""
+This file contains a cache of per-exercise aggregates built from the user's set history
+
+Each exercise keeps its best volume set, last session, estimated one rep max and session count.
+Every user has their own aggregates, folded from processing/set_history.py: sets appended to the history are
+folded in when the aggregates are next read and a reloaded history rebuilds them from scratch.
+"""
+from services.supabase_client import current_user_id
+from processing import set_history
+import threading
+
+_lock = threading.Lock()
+_caches = {} #user id -> {'aggregates': exercise name(title case) -> aggregate dict, 'generation': history generation folded, 'applied': sets of it folded}
+
+def _forget(user_id):
+    """
+    Drops a user's aggregates when their history is dropped
+
+    Args:
+        user_id(str): id of the user
+    """
+    with _lock:
+        _caches.pop(user_id, None)
+
+set_history.on_evict(_forget)
+
+def estimate_one_rep_max(lbs, reps):
+    """
+    Estimates a one rep max using the Epley formula
+
+    Args:
+        lbs(int|float): weight lifted
+        reps(int|float): repetitions performed
+
+    Returns:
+        float containing the estimated one rep max
+    """
+    if reps <= 1:
+        return float(lbs)
+    return lbs*(1+reps/30)
+
+def _new_aggregate():
+    """
+    Creates an aggregate for an exercise that has no sets yet
+
+    Returns:
+        dict containing the default aggregate values
+    """
+    return {
+        'best_set':{'lbs':0,'reps':0},
+        'last_session':None,
+        'estimated_1rm':0.0,
+        'session_count':0,
+        'workout_ids':set()
+    }
+
+def _user_cache(user_id):
+    """
+    Gets a user's cache, callers must hold _lock
+
+    Args:
+        user_id(str): id of the user from current_user_id
+
+    Returns:
+        dict containing the user's aggregates and how much of their history has been folded into them
+    """
+    return _caches.setdefault(user_id, {'aggregates':{},'generation':0,'applied':0})
+
+def _apply_set(aggregates, history_set):
+    """
+    Folds a single set into the aggregates, callers must hold _lock
+
+    Args:
+        aggregates(dict): aggregates keyed by exercise name
+        history_set(HistorySet): set from the history
+    """
+    lbs, reps = history_set.lbs, history_set.reps
+    aggregate = aggregates.setdefault(history_set.exercise.title(), _new_aggregate())
+    best_set = aggregate['best_set']
+    if lbs*reps > best_set['lbs']*best_set['reps']:
+        aggregate['best_set'] = {'lbs':lbs,'reps':reps}
+    elif lbs*reps == 0 and best_set['lbs']*best_set['reps'] == 0:
+        aggregate['best_set'] = {'lbs':lbs,'reps':reps}
+    aggregate['estimated_1rm'] = max(aggregate['estimated_1rm'], estimate_one_rep_max(lbs, reps))
+    workout_id = history_set.workout
+    if workout_id is not None and workout_id not in aggregate['workout_ids']:
+        aggregate['workout_ids'].add(workout_id)
+        aggregate['session_count'] += 1
+    workout_date = history_set.date
+    last_session = aggregate['last_session']
+    if workout_date is not None and (last_session is None or workout_date > last_session['date']):
+        aggregate['last_session'] = {'date':workout_date,'lbs':lbs,'reps':reps}
+    elif last_session is not None and workout_date == last_session['date'] and lbs*reps > last_session['lbs']*last_session['reps']:
+        aggregate['last_session'] = {'date':workout_date,'lbs':lbs,'reps':reps} #keeps the top set of the last session
+
+def ensure_warm():
+    """
+    Loads the user's set history if it has not been loaded yet or is stale
+
+    Returns:
+        True if the cache can be read, False otherwise
+    """
+    return set_history.ensure_warm()
+
+def _sync(user_id):
+    """
+    Folds the sets added to the history since the aggregates were last read
+
+    Args:
+        user_id(str): id of the user from current_user_id
+    """
+    with _lock:
+        cache = _user_cache(user_id)
+        generation, new_sets = set_history.sets_since(cache['generation'], cache['applied'])
+        if generation != cache['generation']: #the history was reloaded
+            cache.update({'aggregates':{},'generation':generation,'applied':0})
+        for history_set in new_sets:
+            _apply_set(cache['aggregates'], history_set)
+        cache['applied'] += len(new_sets)
+
+def get_aggregate(exercise):
+    """
+    Gets the aggregate for an exercise
+
+    Args:
+        exercise(str): the name of the exercise
+
+    Returns:
+        dict containing best_set, last_session, estimated_1rm and session_count, None if the exercise has no sets
+    """
+    user_id = current_user_id()
+    _sync(user_id)
+    with _lock:
+        aggregate = _user_cache(user_id)['aggregates'].get(exercise.title())
+        if aggregate is None:
+            return None
+        return {
+            'best_set':dict(aggregate['best_set']),
+            'last_session':dict(aggregate['last_session']) if aggregate['last_session'] else None,
+            'estimated_1rm':aggregate['estimated_1rm'],
+            'session_count':aggregate['session_count']
+        }
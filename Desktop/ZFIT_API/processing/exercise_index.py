@@ -0,0 +1,237 @@
+"""
+This file contains a similarity index over past exercise names
+
+Exercise names are normalized, split into word and character trigram tokens and hashed into
+fixed size vectors stored in a NumPy array. Nearest neighbour lookups are a single matrix product,
+so matching a planned exercise to a past exercise does not need the LLM when the match is confident.
+Every user has their own index, which is saved to disk and refreshed from the database once it is
+older than INDEX_MAX_AGE_SECONDS. It is dropped from memory with the user's set history.
+"""
+from services.supabase_client import current_user_id
+from processing import set_history
+import numpy as np
+import logging
+import threading
+import hashlib
+import time
+import re
+
+INDEX_PATH = 'data/exercise_index_{}.npz' #formatted with the user id
+VECTOR_SIZE = 1024 #number of hashed token buckets in each exercise vector
+SIMILARITY_THRESHOLD = 0.8 #cosine similarity needed to accept a match without asking the llm
+INDEX_MAX_AGE_SECONDS = 60*60 #exercises logged outside the api are picked up when the index is rebuilt
+
+_lock = threading.Lock()
+_indexes = {} #user id -> index dict
+
+def _forget(user_id):
+    """
+    Drops a user's index from memory when their history is dropped, the saved index is kept
+
+    Args:
+        user_id(str): id of the user
+    """
+    with _lock:
+        _indexes.pop(user_id, None)
+
+set_history.on_evict(_forget)
+
+def normalize_exercise(name):
+    """
+    Normalizes an exercise name so spelling and formatting differences don't affect similarity
+
+    Args:
+        name(str): name of the exercise
+
+    Returns:
+        string containing the lowercase exercise name with punctuation removed and single spaces
+    """
+    return ' '.join(re.findall(r'[a-z0-9]+', str(name).lower()))
+
+def _token_bucket(token):
+    """
+    Maps a token to a stable bucket in the exercise vector
+
+    Args:
+        token(str): word or character trigram
+
+    Returns:
+        int index of the bucket for the token
+    """
+    return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=4).digest(), 'little') % VECTOR_SIZE
+
+def vectorize(names):
+    """
+    Converts exercise names into unit length token vectors
+
+    Args:
+        names(list[str]): exercise names to convert
+
+    Returns:
+        np.ndarray with one row per name
+    """
+    vectors = np.zeros((len(names), VECTOR_SIZE), dtype=np.float32)
+    for i, name in enumerate(names):
+        normalized = normalize_exercise(name)
+        padded = f' {normalized} '
+        for word in normalized.split():
+            vectors[i, _token_bucket(f'w:{word}')] += 2.0 #whole words count more than fragments
+        for j in range(len(padded)-2):
+            vectors[i, _token_bucket(f'c:{padded[j:j+3]}')] += 1.0
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors/norms
+
+def _index_path(user_id):
+    """
+    Gets the file a user's index is saved to
+
+    Args:
+        user_id(str): id of the user from current_user_id
+
+    Returns:
+        string containing the path of the saved index
+    """
+    return INDEX_PATH.format(re.sub(r'[^A-Za-z0-9-]', '', user_id))
+
+def _save(user_id, index):
+    """
+    Writes a user's index to disk, callers must hold _lock
+
+    Args:
+        user_id(str): id of the user the index belongs to
+        index(dict): the user's index
+    """
+    path = _index_path(user_id)
+    try:
+        np.savez(path, names=np.array(index['names'], dtype=str), vectors=index['vectors'], built_at=np.array(index['built_at']))
+    except Exception as e:
+        logging.error(f'Failed to save exercise index to {path}: {e}')
+
+def _load(user_id):
+    """
+    Gets a user's index, loading it from disk the first time it is needed, callers must hold _lock
+
+    Args:
+        user_id(str): id of the user from current_user_id
+
+    Returns:
+        dict containing the past exercise names, their vectors(row i belongs to names[i]) and
+        the time the index was last rebuilt from the full list of past exercises
+    """
+    index = _indexes.get(user_id)
+    if index is not None:
+        return index
+    index = _indexes[user_id] = {'names':[],'vectors':np.zeros((0, VECTOR_SIZE), dtype=np.float32),'built_at':0.0}
+    path = _index_path(user_id)
+    try:
+        with np.load(path) as saved:
+            if saved['vectors'].shape[1] != VECTOR_SIZE:
+                logging.warning('Saved exercise index has a different vector size, it will be rebuilt')
+                return index
+            index.update({
+                'names':saved['names'].tolist(),
+                'vectors':saved['vectors'].astype(np.float32),
+                'built_at':float(saved['built_at'])
+            })
+    except FileNotFoundError:
+        logging.info('No saved exercise index found')
+    except Exception as e:
+        logging.error(f'Failed to load exercise index from {path}: {e}')
+    return index
+
+def is_stale():
+    """
+    Checks whether the index needs to be rebuilt from the database
+
+    Returns:
+        True if the index is empty or older than INDEX_MAX_AGE_SECONDS, False otherwise
+    """
+    user_id = current_user_id()
+    with _lock:
+        index = _load(user_id)
+        return not index['names'] or time.time() - index['built_at'] > INDEX_MAX_AGE_SECONDS
+
+def rebuild(past_exercises):
+    """
+    Replaces the index with the provided past exercises
+
+    Args:
+        past_exercises(list[str]): every unique past exercise name
+    """
+    user_id = current_user_id()
+    names = list(dict.fromkeys(past_exercises))
+    vectors = vectorize(names)
+    with _lock:
+        index = _indexes[user_id] = {'names':names,'vectors':vectors,'built_at':time.time()}
+        _save(user_id, index)
+    logging.info(f'Exercise index rebuilt with {len(names)} exercises')
+
+def add_exercises(exercises):
+    """
+    Adds exercises that are not in the index yet
+
+    Args:
+        exercises(list[str]): exercise names that were just written to the database
+    """
+    user_id = current_user_id()
+    with _lock:
+        index = _load(user_id)
+        known = {normalize_exercise(name) for name in index['names']}
+        new_names = []
+        for exercise in exercises:
+            normalized = normalize_exercise(exercise)
+            if normalized and normalized not in known:
+                known.add(normalized)
+                new_names.append(exercise)
+        if not new_names:
+            return
+        index['names'] = index['names'] + new_names
+        index['vectors'] = np.vstack([index['vectors'], vectorize(new_names)])
+        _save(user_id, index)
+    logging.info(f'Added {len(new_names)} exercises to the exercise index')
+
+def exercise_names():
+    """
+    Gets the past exercise names stored in the index
+
+    Returns:
+        list[str] of past exercise names
+    """
+    user_id = current_user_id()
+    with _lock:
+        return list(_load(user_id)['names'])
+
+def lookup(exercises):
+    """
+    Finds the nearest past exercise for every provided exercise
+
+    Args:
+        exercises(list[str]): exercise names to look up
+
+    Returns:
+        list of (closest past exercise, similarity) tuples in the same order as exercises,
+        (None, 0.0) for every exercise when the index is empty
+    """
+    user_id = current_user_id()
+    with _lock:
+        index = _load(user_id)
+        names, vectors = index['names'], index['vectors']
+    if not names or not exercises:
+        return [(None, 0.0) for _ in exercises]
+    similarities = vectorize(exercises) @ vectors.T #cosine similarity because every row is unit length
+    best = similarities.argmax(axis=1)
+    return [(names[j], float(similarities[i, j])) for i, j in enumerate(best)]
+
+def confident_match(exercise):
+    """
+    Finds the nearest past exercise only if the index is confident about the match
+
+    Args:
+        exercise(str): exercise name to look up
+
+    Returns:
+        string containing the nearest past exercise, None if the similarity is below SIMILARITY_THRESHOLD
+    """
+    nearest_exercise, similarity = lookup([exercise])[0]
+    return nearest_exercise if similarity >= SIMILARITY_THRESHOLD else None
@@ -0,0 +1,171 @@
+"""
+This file generates multi-week mesocycles
+
+The llm plans the split and weekly focus once, then every week is generated by its own llm call.
+The first week runs alone so its exercise matches fill the shared matches, then the other weeks run in
+parallel. Weeks share the exercise matches, exercise index and best set cache, so each exercise is
+usually only matched once. Lbs and reps are not asked from the llm: each week's sets are ramped
+locally from the estimated one rep max of the exercise's best set, with a deload in the last week
+of blocks that are long enough.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from utils.util import get_dates_list
+from processing import best_set_cache
+from processing.best_set_cache import estimate_one_rep_max
+from services.metrics import traced
+import contextvars
+import threading
+import logging
+import os
+
+MAX_MESOCYCLE_WEEKS = 12
+MESOCYCLE_WORKERS = int(os.getenv('OLLAMA_NUM_PARALLEL', '4')) #weeks generated at once, matches the parallel requests ollama serves
+START_INTENSITY = 0.70 #fraction of the estimated one rep max lifted in the first week
+END_INTENSITY = 0.85 #fraction of the estimated one rep max lifted in the last week before the deload
+DELOAD_INTENSITY = 0.60
+MIN_DELOAD_WEEKS = 4 #blocks with at least this many weeks end with a deload week
+REPS_IN_RESERVE = 1 #reps left in the tank compared to a max effort set at the same weight
+LBS_INCREMENT = 5 #lbs are rounded to the nearest plate increment
+
+_week_pool = ThreadPoolExecutor(max_workers=MESOCYCLE_WORKERS, thread_name_prefix='zfit-week') #separate from the resolver pool, which the weeks wait on
+
+def week_intensity(week, weeks):
+    """
+    Gets the fraction of the estimated one rep max lifted in a week
+
+    Args:
+        week(int): number of the week, starting at 1
+        weeks(int): number of weeks in the mesocycle
+
+    Returns:
+        float containing the intensity, ramping linearly from START_INTENSITY to END_INTENSITY
+    """
+    if weeks >= MIN_DELOAD_WEEKS and week == weeks:
+        return DELOAD_INTENSITY
+    training_weeks = weeks-1 if weeks >= MIN_DELOAD_WEEKS else weeks
+    if training_weeks <= 1:
+        return START_INTENSITY
+    return START_INTENSITY + (END_INTENSITY-START_INTENSITY)*(week-1)/(training_weeks-1)
+
+def reps_for_intensity(intensity):
+    """
+    Gets the reps to perform at an intensity, the inverse of the Epley formula minus REPS_IN_RESERVE
+
+    Args:
+        intensity(float): fraction of the estimated one rep max
+
+    Returns:
+        int containing the reps, at least 1
+    """
+    return max(1, round(30*(1/intensity-1)) - REPS_IN_RESERVE)
+
+def progress_set(program_set, week, weeks):
+    """
+    Sets the lbs and reps of a set for a week of the mesocycle
+
+    Args:
+        program_set(ProgramSet): set with the lbs and reps of the exercise's best set
+        week(int): number of the week, starting at 1
+        weeks(int): number of weeks in the mesocycle
+
+    Returns:
+        ProgramSet with the week's lbs and reps
+    """
+    lbs, reps = program_set.lbs, program_set.reps
+    intensity = week_intensity(week, weeks)
+    deload = weeks >= MIN_DELOAD_WEEKS and week == weeks
+    if lbs > 0 and reps > 0:
+        lbs = round(estimate_one_rep_max(lbs, reps)*intensity/LBS_INCREMENT)*LBS_INCREMENT
+        reps = reps_for_intensity(START_INTENSITY if deload else intensity) #the deload keeps the reps of the first week with less weight
+    elif reps > 0: #bodyweight exercise, one more rep every week
+        reps = max(1, round(reps*0.7)) if deload else reps+week-1
+    return program_set._replace(lbs=lbs, reps=reps)
+
+def apply_progression(program_sets, week, weeks):
+    """
+    Sets the lbs and reps of every set for a week of the mesocycle
+
+    Args:
+        program_sets(list[ProgramSet]): sets with the lbs and reps of each exercise's best set
+        week(int): number of the week, starting at 1
+        weeks(int): number of weeks in the mesocycle
+
+    Returns:
+        list[ProgramSet] with the week's lbs and reps
+    """
+    return [progress_set(program_set, week, weeks) for program_set in program_sets]
+
+@traced
+def build_week(user, week, weeks, focus, split, resolved_exercises):
+    """
+    Generates, matches, progresses and structures one week of the mesocycle
+
+    Args:
+        user(dict): age, level, gender, goal, days, equipment and startdate of the mesocycle
+        week(int): number of the week, starting at 1
+        weeks(int): number of weeks in the mesocycle
+        focus(str): focus of the week from the skeleton
+        split(dict): training day -> title and musclegroups from the skeleton
+        resolved_exercises(dict): exercise matches shared by every week
+
+    Returns:
+        dict containing the week number, its start date, focus and structured program
+    """
+    from services.ollama_service import generate_structured_plan, mesocycle_week_instructions
+    from processing.workout_processing import clean_csv, structure_csv
+    startdate = (datetime.strptime(user['startdate'], '%Y-%m-%d').date() + timedelta(weeks=week-1)).isoformat()
+    instructions = mesocycle_week_instructions(week, weeks, focus, split, get_dates_list(startdate, user['days']))
+    plan_rows = generate_structured_plan(user['age'], user['level'], user['gender'], user['goal'], user['days'], user['equipment'], startdate, instructions)
+    program_sets = apply_progression(clean_csv(plan_rows, resolved_exercises), week, weeks)
+    return {'week':week,'startdate':startdate,'focus':focus,'program':structure_csv(program_sets)}
+
+def generate_mesocycle(user, weeks):
+    """
+    Starts generating the first week of a mesocycle, then the other weeks in parallel once it is done
+
+    Args:
+        user(dict): age, level, gender, goal, days, equipment and startdate('YYYY-MM-DD') of the mesocycle
+        weeks(int): number of weeks, at most MAX_MESOCYCLE_WEEKS
+
+    Returns:
+        generator yielding each week's dict from build_week in order as soon as it and the weeks before it are done
+    """
+    from services.ollama_service import generate_mesocycle_skeleton, get_exercise_vocabulary
+    weeks = max(1, min(weeks, MAX_MESOCYCLE_WEEKS))
+    split, focuses = generate_mesocycle_skeleton(user['age'], user['level'], user['gender'], user['goal'], user['days'], user['equipment'], weeks)
+    get_exercise_vocabulary() #warms the shared caches once instead of in every week
+    best_set_cache.ensure_warm()
+    resolved_exercises = {} #exercise matches shared by every week
+    later_contexts = [(week, contextvars.copy_context()) for week in range(2, weeks+1)] #copied here since the later weeks are submitted from a pool thread
+    later_weeks = []
+    fanned_out = threading.Event()
+
+    def fan_out(_):
+        try:
+            for week, context in later_contexts:
+                later_weeks.append(_week_pool.submit(context.run, build_week, user, week, weeks, focuses[week-1], split, resolved_exercises))
+        except Exception as e:
+            logging.error(f'Failed to start the later weeks of the mesocycle: {e}')
+        finally:
+            fanned_out.set()
+
+    first_week = _week_pool.submit(contextvars.copy_context().run, build_week, user, 1, weeks, focuses[0], split, resolved_exercises)
+    first_week.add_done_callback(fan_out) #later weeks reuse the exercise matches of the first week instead of all matching them at once
+
+    def failed_week(week):
+        return {'week':week,'startdate':None,'focus':focuses[week-1],'program':[],'error':f'Could not generate week {week}'}
+
+    def week_result(week, future):
+        try:
+            return future.result()
+        except Exception as e:
+            logging.error(f'Failed to generate week {week} of the mesocycle: {e}')
+            return failed_week(week)
+
+    def results():
+        yield week_result(1, first_week)
+        fanned_out.wait()
+        for week in range(2, weeks+1):
+            yield week_result(week, later_weeks[week-2]) if week-2 < len(later_weeks) else failed_week(week)
+    return results()
@@ -0,0 +1,212 @@
+"""
+This file contains the json schemas for structured workout plans and mesocycle skeletons and the validators for llm output
+
+The schemas are passed to ollama so the model can only produce a plan in this shape. The plan validators
+check every requested date has a valid workout so only missing or invalid days need to be regenerated.
+"""
+from utils.util import PlanRow
+import logging
+
+MIN_EXERCISES_PER_WORKOUT = 3
+MAX_SETS_PER_EXERCISE = 10
+
+PLAN_SCHEMA = {
+    'type':'object',
+    'properties':{
+        'workouts':{
+            'type':'array',
+            'items':{
+                'type':'object',
+                'properties':{
+                    'title':{'type':'string'},
+                    'date':{'type':'string'},
+                    'exercises':{
+                        'type':'array',
+                        'items':{
+                            'type':'object',
+                            'properties':{
+                                'musclegroup':{'type':'string'},
+                                'exercise':{'type':'string'},
+                                'sets':{'type':'integer'}
+                            },
+                            'required':['musclegroup','exercise','sets']
+                        }
+                    }
+                },
+                'required':['title','date','exercises']
+            }
+        }
+    },
+    'required':['workouts']
+}
+
+MESOCYCLE_SCHEMA = {
+    'type':'object',
+    'properties':{
+        'split':{
+            'type':'array',
+            'items':{
+                'type':'object',
+                'properties':{
+                    'day':{'type':'string'},
+                    'title':{'type':'string'},
+                    'musclegroups':{'type':'array','items':{'type':'string'}}
+                },
+                'required':['day','title','musclegroups']
+            }
+        },
+        'weeks':{
+            'type':'array',
+            'items':{
+                'type':'object',
+                'properties':{'focus':{'type':'string'}},
+                'required':['focus']
+            }
+        }
+    },
+    'required':['split','weeks']
+}
+
+def _valid_exercise(exercise):
+    """
+    Checks a single exercise in a structured workout
+
+    Args:
+        exercise(dict): exercise with musclegroup, exercise and sets
+
+    Returns:
+        True if every field is present and sets is a whole number from 1 to MAX_SETS_PER_EXERCISE, False otherwise
+    """
+    if not isinstance(exercise, dict):
+        return False
+    sets = exercise.get('sets')
+    return (isinstance(exercise.get('exercise'), str) and exercise['exercise'].strip() != ''
+        and isinstance(exercise.get('musclegroup'), str) and exercise['musclegroup'].strip() != ''
+        and isinstance(sets, int) and not isinstance(sets, bool) and 1 <= sets <= MAX_SETS_PER_EXERCISE)
+
+def validate_plan(plan, dates_list, problems=None):
+    """
+    Finds the valid workout for each requested date in a structured plan
+
+    Args:
+        plan(dict): structured plan produced with PLAN_SCHEMA
+        dates_list(list[str]): dates('YYYY-MM-DD') that need a workout
+        problems(dict): date -> why it has no valid workout, filled in for every invalid date if provided
+
+    Returns:
+        tuple of a dict mapping each date with a valid workout to that workout and
+        the list of dates that are missing or have an invalid workout
+    """
+    valid_workouts = {}
+    problems = {} if problems is None else problems
+    workouts = plan.get('workouts') if isinstance(plan, dict) else None
+    for workout in workouts if isinstance(workouts, list) else []:
+        if not isinstance(workout, dict) or workout.get('date') not in dates_list or workout['date'] in valid_workouts:
+            continue
+        exercises = [exercise for exercise in workout.get('exercises') or [] if _valid_exercise(exercise)]
+        unique_exercises = {exercise['exercise'].strip().lower() for exercise in exercises}
+        if len(unique_exercises) < MIN_EXERCISES_PER_WORKOUT:
+            logging.warning(f"Workout on {workout['date']} only has {len(unique_exercises)} valid exercises")
+            problems.setdefault(workout['date'], f'only had {len(unique_exercises)} valid exercises')
+            continue
+        title = workout.get('title')
+        valid_workouts[workout['date']] = {
+            'title':title.strip() if isinstance(title, str) and title.strip() else 'Workout',
+            'date':workout['date'],
+            'exercises':exercises
+        }
+    invalid_dates = [workout_date for workout_date in dates_list if workout_date not in valid_workouts]
+    for workout_date in invalid_dates:
+        problems.setdefault(workout_date, 'was missing')
+    for workout_date in valid_workouts:
+        problems.pop(workout_date, None) #a later workout on the same date was valid
+    return valid_workouts, invalid_dates
+
+def rows_from_plan(valid_workouts, dates_list):
+    """
+    Converts validated workouts into plan rows
+
+    Args:
+        valid_workouts(dict): valid workout for each date from validate_plan
+        dates_list(list[str]): dates('YYYY-MM-DD') in plan order
+
+    Returns:
+        list[PlanRow] with one row per exercise
+    """
+    return [
+        PlanRow(workout['title'], workout['date'], exercise['musclegroup'].strip(), exercise['exercise'].strip(), str(exercise['sets']))
+        for workout in (valid_workouts[workout_date] for workout_date in dates_list if workout_date in valid_workouts)
+        for exercise in workout['exercises']
+    ]
+
+def exercise_from_row(row):
+    """
+    Converts a row of a csv plan into an exercise of a structured workout
+
+    Args:
+        row(PlanRow): exercise parsed from the csv plan
+
+    Returns:
+        dict with musclegroup, exercise and sets, sets is None if it is not a whole number
+    """
+    sets = row.sets.strip()
+    return {'musclegroup':row.musclegroups,'exercise':row.exercise,'sets':int(sets) if sets.isdigit() else None}
+
+def validate_plan_rows(plan_rows, dates_list, valid_workouts=None, problems=None):
+    """
+    Validates the rows of a csv plan as they arrive with the same rules as validate_plan.
+    A date's rows are held back until its workout has MIN_EXERCISES_PER_WORKOUT different exercises.
+
+    Args:
+        plan_rows(iterable[PlanRow]): rows parsed from the csv plan
+        dates_list(list[str]): dates('YYYY-MM-DD') that need a workout
+        valid_workouts(dict): filled with the valid workout for each date that was yielded, if provided
+        problems(dict): date -> why it has no valid workout, filled in for every invalid date if provided
+
+    Yields:
+        PlanRow for each valid exercise on a date with a valid workout
+    """
+    valid_workouts = {} if valid_workouts is None else valid_workouts
+    workouts = {} #date -> exercises written so far for a date that is not valid yet
+    for row in plan_rows:
+        row_date, exercise = row.date.strip(), exercise_from_row(row)
+        if row_date not in dates_list or not _valid_exercise(exercise):
+            continue
+        if row_date in valid_workouts:
+            valid_workouts[row_date]['exercises'].append(exercise)
+            yield from rows_from_plan({row_date:{**valid_workouts[row_date],'exercises':[exercise]}}, [row_date])
+            continue
+        workout = workouts.setdefault(row_date, {'title':row.title,'date':row_date,'exercises':[]})
+        workout['exercises'].append(exercise)
+        if len({exercise['exercise'].strip().lower() for exercise in workout['exercises']}) >= MIN_EXERCISES_PER_WORKOUT:
+            valid_workouts.update(validate_plan({'workouts':[workouts.pop(row_date)]}, [row_date])[0])
+            yield from rows_from_plan(valid_workouts, [row_date])
+    invalid_dates = [workout_date for workout_date in dates_list if workout_date not in valid_workouts]
+    validate_plan({'workouts':list(workouts.values())}, invalid_dates, problems) #only fills in why each date is invalid
+
+def validate_skeleton(skeleton, days, weeks):
+    """
+    Cleans a mesocycle skeleton produced with MESOCYCLE_SCHEMA
+
+    Args:
+        skeleton(dict): skeleton from the llm
+        days(list[str]): days(Monday-Sunday) the user trains
+        weeks(int): number of weeks in the mesocycle
+
+    Returns:
+        tuple of the split as a dict mapping each training day with a valid workout to its title and musclegroups,
+        and a list with the focus of every week, empty strings for weeks the llm left out
+    """
+    split = {}
+    entries = skeleton.get('split') if isinstance(skeleton, dict) else None
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict) or entry.get('day') not in days or entry['day'] in split:
+            continue
+        title = entry.get('title')
+        musclegroups = [group.strip() for group in entry.get('musclegroups') or [] if isinstance(group, str) and group.strip()]
+        if isinstance(title, str) and title.strip() and musclegroups:
+            split[entry['day']] = {'title':title.strip(),'musclegroups':musclegroups}
+    focuses = skeleton.get('weeks') if isinstance(skeleton, dict) else None
+    focuses = [week.get('focus') if isinstance(week, dict) else None for week in focuses] if isinstance(focuses, list) else []
+    focuses = [focus.strip() if isinstance(focus, str) else '' for focus in focuses[:weeks]]
+    return split, focuses + ['']*(weeks-len(focuses))
@@ -0,0 +1,283 @@
+"""
+This file contains edit operations for altering a structured workout program
+
+Instead of rewriting the whole program, the llm returns a short list of edits following EDIT_SCHEMA
+which are applied and validated locally. Common requests such as "add 10 lbs to all bench sets"
+are parsed into edits directly without calling the llm.
+"""
+import copy
+import logging
+import re
+import string
+
+EDIT_OPERATIONS = ['replace_exercise', 'change_value', 'add_set', 'remove_set', 'remove_exercise', 'move_day']
+
+EDIT_SCHEMA = {
+    'type':'object',
+    'properties':{
+        'edits':{
+            'type':'array',
+            'items':{
+                'type':'object',
+                'properties':{
+                    'op':{'type':'string','enum':EDIT_OPERATIONS},
+                    'date':{'type':'string'}, #limits the edit to the workout on this date(YYYY-MM-DD)
+                    'exercise':{'type':'string'},
+                    'new_exercise':{'type':'string'}, #replace_exercise
+                    'set_num':{'type':'integer'}, #limits change_value and remove_set to one set
+                    'field':{'type':'string','enum':['lbs','reps']}, #change_value
+                    'mode':{'type':'string','enum':['set','add','multiply']}, #change_value
+                    'value':{'type':'number'}, #change_value amount, add_set count
+                    'to_date':{'type':'string'} #move_day
+                },
+                'required':['op']
+            }
+        }
+    },
+    'required':['edits']
+}
+
+EDIT_DESCRIPTIONS = """
+- replace_exercise: replace exercise with new_exercise
+- change_value: change field(lbs or reps) of exercise's sets, mode set replaces it with value, add adds value(negative to subtract), multiply multiplies it by value
+- add_set: add value(default 1) sets of exercise copying its last set
+- remove_set: remove set set_num of exercise, or its last set when set_num is not given
+- remove_exercise: remove every set of exercise
+- move_day: move the workout on date to to_date
+date limits an edit to the workout on that date, leave it out to edit every workout
+"""
+
+NUMBER = r'(\d+(?:\.\d+)?)'
+UNITS = {'lb':'lbs','lbs':'lbs','pound':'lbs','pounds':'lbs','rep':'reps','reps':'reps'}
+SIMPLE_EDIT_PATTERNS = [
+    (re.compile(rf'^(?:add|increase(?: by)?|bump(?: up)?(?: by)?)\s+{NUMBER}\s*(lbs?|pounds?|reps?)\s+(?:to|on|for)\s+(?:all\s+|every\s+|the\s+)?(?:of\s+)?(?:the\s+|my\s+)?(.+?)(?:\s+sets?)?$'), 'add'),
+    (re.compile(rf'^(?:remove|subtract|decrease(?: by)?|reduce(?: by)?|drop|take)\s+{NUMBER}\s*(lbs?|pounds?|reps?)\s+(?:from|on|for|off)\s+(?:all\s+|every\s+|the\s+)?(?:of\s+)?(?:the\s+|my\s+)?(.+?)(?:\s+sets?)?$'), 'subtract'),
+    (re.compile(rf'^(?:change|set|make)\s+(?:all\s+|every\s+|the\s+)?(?:of\s+)?(?:the\s+|my\s+)?(.+?)(?:\s+sets?)?\s+(?:to|at)\s+{NUMBER}\s*(lbs?|pounds?|reps?)$'), 'set'),
+    (re.compile(r"^(?:replace|swap|substitute|change)\s+(?:the\s+|my\s+)?(.+?)\s+(?:with|for|to)\s+(?:a\s+|an\s+|the\s+)?([a-z][a-z'\- ]*)$"), 'replace'),
+    (re.compile(r'^add\s+(\d+|a|an|one)\s+(?:more\s+|extra\s+)?sets?\s+(?:of|to|for)\s+(?:the\s+|my\s+)?(.+)$'), 'add_set'),
+    (re.compile(r'^(?:remove|delete|drop)\s+(?:a|one|the last)\s+sets?\s+(?:of|from)\s+(?:the\s+|my\s+)?(.+)$'), 'remove_set'),
+]
+EXTRA_CLAUSE = re.compile(r'\b(?:for|with|to|at|on|in|of|instead|but|so)\b') #words that start a clause after the new exercise, e.g. "leg press for higher reps"
+
+def workout_date(workout):
+    """
+    Gets a workout's date whether it is stored as a string or a one item list
+
+    Args:
+        workout(dict): workout in the program
+
+    Returns:
+        string containing the date(YYYY-MM-DD)
+    """
+    value = workout.get('date')
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else ''
+    return str(value).strip().strip('"').strip()
+
+def _matching_exercise(program, name):
+    """
+    Finds the exercise in the program that a short name refers to, e.g. "bench" for "Bench Press"
+
+    Args:
+        program(list[dict]): the workout program
+        name(str): exercise name written by the user
+
+    Returns:
+        string containing the exercise name in the program, None if no exercise or more than one exercise matches
+    """
+    name = name.strip().lower().rstrip('s')
+    exercises = list(dict.fromkeys(workout_set['exercise'] for workout in program for workout_set in workout.get('sets', [])))
+    matches = [exercise for exercise in exercises if exercise.lower().rstrip('s') == name] #exact matches take priority over partial matches
+    if not matches:
+        words = name.split()
+        matches = [exercise for exercise in exercises if words and all(word in exercise.lower() for word in words)]
+    return matches[0] if len(matches) == 1 else None #e.g. "press" could be any press, so the llm decides
+
+def parse_simple_edits(changes, program):
+    """
+    Parses common change requests into edits without the llm
+
+    Args:
+        changes(str): the changes requested by the user
+        program(list[dict]): the workout program the changes apply to
+
+    Returns:
+        list of edits, None if any part of the request is not understood
+    """
+    clauses = [clause.strip() for clause in re.split(r'\s*(?:[,;]|\.(?=\s|$)|\band\b|\bthen\b)\s*', changes.lower()) if clause.strip()]
+    if not clauses:
+        return None
+    edits = []
+    for clause in clauses:
+        clause_edits = None
+        for pattern, kind in SIMPLE_EDIT_PATTERNS:
+            match = pattern.match(clause)
+            if match is None:
+                continue
+            if kind in ('add', 'subtract'):
+                value, unit, name = match.groups()
+                sign = 1 if kind == 'add' else -1
+                exercise = _matching_exercise(program, name)
+                clause_edits = exercise and [{'op':'change_value','exercise':exercise,'field':UNITS[unit],'mode':'add','value':sign*float(value)}]
+            elif kind == 'set':
+                name, value, unit = match.groups()
+                exercise = _matching_exercise(program, name)
+                clause_edits = exercise and [{'op':'change_value','exercise':exercise,'field':UNITS[unit],'mode':'set','value':float(value)}]
+            elif kind == 'replace':
+                name, new_exercise = match.groups()
+                if EXTRA_CLAUSE.search(new_exercise):
+                    break #the rest of the clause is left to the llm
+                exercise = _matching_exercise(program, name)
+                clause_edits = exercise and [{'op':'replace_exercise','exercise':exercise,'new_exercise':string.capwords(new_exercise)}]
+            elif kind == 'add_set':
+                count, name = match.groups()
+                count = int(count) if count.isdigit() else 1
+                exercise = _matching_exercise(program, name)
+                clause_edits = exercise and [{'op':'add_set','exercise':exercise,'value':count}]
+            elif kind == 'remove_set':
+                exercise = _matching_exercise(program, match.group(1))
+                clause_edits = exercise and [{'op':'remove_set','exercise':exercise}]
+            break
+        if not clause_edits:
+            return None #the clause is not a simple edit or does not name exactly one exercise in the program
+        edits.extend(clause_edits)
+    return edits
+
+def _renumber_sets(workout):
+    """
+    Numbers each exercise's sets from 1 in the order they appear
+
+    Args:
+        workout(dict): workout whose sets are renumbered in place
+    """
+    counts = {}
+    for workout_set in workout['sets']:
+        counts[workout_set['exercise']] = counts.get(workout_set['exercise'], 0) + 1
+        workout_set['set_num'] = counts[workout_set['exercise']]
+
+def _apply_edit(program, edit):
+    """
+    Applies a single edit to the program in place
+
+    Args:
+        program(list[dict]): the workout program
+        edit(dict): edit following EDIT_SCHEMA
+
+    Raises:
+        ValueError: if the edit is invalid or does not match anything in the program
+    """
+    op = edit.get('op')
+    if op not in EDIT_OPERATIONS:
+        raise ValueError(f'Unknown edit operation {op}')
+    workouts = [workout for workout in program if not edit.get('date') or workout_date(workout) == edit['date']]
+    if not workouts:
+        raise ValueError(f"No workout on {edit.get('date')}")
+    if op == 'move_day':
+        to_date = edit.get('to_date')
+        if not edit.get('date') or not isinstance(to_date, str) or not re.fullmatch(r'\d{4}-\d{2}-\d{2}', to_date):
+            raise ValueError('move_day needs a date and a to_date(YYYY-MM-DD)')
+        if any(workout_date(workout) == to_date for workout in program):
+            raise ValueError(f'There is already a workout on {to_date}')
+        for workout in workouts:
+            workout['date'] = [to_date] if isinstance(workout['date'], (list, tuple)) else to_date
+        return
+    exercise = edit.get('exercise')
+    matched_sets = [(workout, workout_set) for workout in workouts for workout_set in workout['sets'] if workout_set['exercise'] == exercise]
+    if not matched_sets:
+        raise ValueError(f'{exercise} is not in the program')
+    if op == 'replace_exercise':
+        if not isinstance(edit.get('new_exercise'), str) or not edit['new_exercise'].strip():
+            raise ValueError('replace_exercise needs a new_exercise')
+        for workout, workout_set in matched_sets:
+            workout_set['exercise'] = edit['new_exercise'].strip()
+    elif op == 'change_value':
+        field, mode, value = edit.get('field'), edit.get('mode', 'set'), edit.get('value')
+        if field not in ('lbs', 'reps') or mode not in ('set', 'add', 'multiply') or not isinstance(value, (int, float)):
+            raise ValueError(f'Invalid change_value edit: {edit}')
+        targets = [workout_set for workout, workout_set in matched_sets if edit.get('set_num') is None or workout_set['set_num'] == edit['set_num']]
+        if not targets:
+            raise ValueError(f"{exercise} has no set {edit.get('set_num')}")
+        for workout_set in targets:
+            current = workout_set[field] if isinstance(workout_set[field], (int, float)) else 0
+            new_value = value if mode == 'set' else current + value if mode == 'add' else current * value
+            new_value = max(0, round(new_value) if field == 'reps' else round(new_value, 2)) #lbs keep fractional plates, e.g. adding 2.5 lbs
+            workout_set[field] = int(new_value) if float(new_value).is_integer() else new_value
+    elif op == 'add_set':
+        count = int(edit.get('value') or 1)
+        if not 1 <= count <= 10:
+            raise ValueError(f'Cannot add {count} sets')
+        for workout in dict((id(workout), workout) for workout, workout_set in matched_sets).values():
+            last_index = max(i for i, workout_set in enumerate(workout['sets']) if workout_set['exercise'] == exercise)
+            for i in range(count):
+                workout['sets'].insert(last_index+1+i, dict(workout['sets'][last_index]))
+            _renumber_sets(workout)
+    elif op == 'remove_set':
+        for workout in dict((id(workout), workout) for workout, workout_set in matched_sets).values():
+            indexes = [i for i, workout_set in enumerate(workout['sets']) if workout_set['exercise'] == exercise]
+            if edit.get('set_num') is not None:
+                indexes = [i for i in indexes if workout['sets'][i]['set_num'] == edit['set_num']]
+            if indexes:
+                del workout['sets'][indexes[-1]]
+            _renumber_sets(workout)
+    elif op == 'remove_exercise':
+        for workout in workouts:
+            workout['sets'] = [workout_set for workout_set in workout['sets'] if workout_set['exercise'] != exercise]
+
+def validate_program(program):
+    """
+    Checks a program has the structure the front end expects
+
+    Args:
+        program(list[dict]): the workout program
+
+    Returns:
+        list of problems found, empty if the program is valid
+    """
+    problems = []
+    if not isinstance(program, list):
+        return ['Program must be a list of workouts']
+    dates = [workout_date(workout) for workout in program if isinstance(workout, dict)]
+    if len(dates) != len(set(dates)):
+        problems.append('Only one workout can be performed each day')
+    for workout in program:
+        if not isinstance(workout, dict) or not isinstance(workout.get('sets'), list):
+            problems.append(f'Invalid workout: {workout}')
+            continue
+        if not workout['sets']:
+            problems.append(f'Workout on {workout_date(workout)} has no sets')
+        for workout_set in workout['sets']:
+            if not isinstance(workout_set.get('exercise'), str) or not workout_set['exercise']:
+                problems.append(f'Set without an exercise on {workout_date(workout)}')
+            for field in ('set_num', 'lbs', 'reps'):
+                if not isinstance(workout_set.get(field), (int, float)) or workout_set[field] < 0:
+                    problems.append(f"Invalid {field} for {workout_set.get('exercise')} on {workout_date(workout)}")
+    return problems
+
+def apply_edits(program, edits):
+    """
+    Applies edits to a copy of the program, skipping edits that are invalid
+
+    Args:
+        program(list[dict]): the original workout program
+        edits(list[dict]): edits following EDIT_SCHEMA
+
+    Returns:
+        tuple of the edited program and the list of edits that were applied
+    """
+    edited_program = copy.deepcopy(program)
+    existing_problems = set(validate_program(edited_program)) #problems the program already had are not blamed on an edit
+    applied = []
+    for edit in edits:
+        candidate = copy.deepcopy(edited_program)
+        try:
+            _apply_edit(candidate, edit)
+        except Exception as e:
+            logging.warning(f'Skipping edit {edit}: {e}')
+            continue
+        problems = [problem for problem in validate_program(candidate) if problem not in existing_problems]
+        if problems:
+            logging.warning(f'Skipping edit {edit}: {problems}')
+            continue
+        edited_program = candidate
+        applied.append(edit)
+    return edited_program, applied
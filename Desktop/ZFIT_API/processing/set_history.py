@@ -0,0 +1,183 @@
+"""
+This file contains the per-user store of set history shared by the best set cache, analytics and exercise matching
+
+Every user's sets are loaded with one paginated query, appended to as sets are inserted and reloaded from scratch
+once they are older than CACHE_MAX_AGE_SECONDS so sets logged outside the api are picked up. Each reload starts a new
+generation. Between reloads sets are only appended, so readers can keep what they derived and fold in new sets.
+Histories of the MAX_USERS most recently seen users are kept. Caches derived from a history register with on_evict
+so a user is dropped from all of them at once.
+"""
+from services.supabase_client import get_supabase, current_user_id, select_all
+from collections import OrderedDict
+from typing import NamedTuple
+from utils import singleflight
+import itertools
+import threading
+import logging
+import time
+import os
+
+CACHE_MAX_AGE_SECONDS = 60*60
+MAX_USERS = int(os.getenv('ZFIT_CACHED_USERS', '64')) #users whose history and derived caches are kept, least recently seen dropped first
+
+_lock = threading.Lock()
+_generations = itertools.count(1)
+_histories = OrderedDict() #user id -> {'sets': list of HistorySet, 'by_exercise': exercise name(title case) -> list of HistorySet, 'names': unique exercise names as saved, 'generation', 'built_at'}, most recently seen last
+_evict_hooks = [] #functions called with the id of every user dropped from _histories
+
+class HistorySet(NamedTuple):
+    """
+    A saved set with the date of its workout
+    """
+    exercise: str #exercise name as saved
+    workout: object #id of the workout
+    date: str #date('YYYY-MM-DD') of the workout, None if unknown
+    lbs: float
+    reps: float
+
+def on_evict(hook):
+    """
+    Registers a cache derived from the history so it drops a user when their history is dropped
+
+    Args:
+        hook(function): called with the user id of every dropped user
+    """
+    _evict_hooks.append(hook)
+
+def _evict(user_ids):
+    """
+    Drops users from every registered cache, callers must not hold _lock
+
+    Args:
+        user_ids(list[str]): ids of the users dropped from _histories
+    """
+    for user_id in user_ids:
+        for hook in _evict_hooks:
+            hook(user_id)
+    if user_ids:
+        logging.info(f'Dropped the cached history of {len(user_ids)} users')
+
+def _new_history():
+    """
+    Creates the history of a user whose sets have not been loaded
+
+    Returns:
+        dict containing no sets
+    """
+    return {'sets':[],'by_exercise':{},'names':{},'generation':0,'built_at':None}
+
+def _add_set(history, workout_set):
+    """
+    Appends a single set to a user's history, callers must hold _lock unless the history is not shared yet
+
+    Args:
+        history(dict): the user's history
+        workout_set(dict): set with exercise, lbs, reps, id(workout id) and date
+    """
+    history['names'].setdefault(str(workout_set['exercise']), None) #invalid sets still count as past exercises
+    lbs, reps = workout_set.get('lbs'), workout_set.get('reps')
+    if not isinstance(lbs,(int,float)) or not isinstance(reps,(int,float)):
+        logging.warning(f"Skipping invalid set: {workout_set}")
+        return
+    workout_date = workout_set.get('date')
+    history_set = HistorySet(str(workout_set['exercise']), workout_set.get('id'), workout_date[:10] if isinstance(workout_date, str) else None, lbs, reps)
+    history['sets'].append(history_set)
+    history['by_exercise'].setdefault(history_set.exercise.title(), []).append(history_set)
+
+def rebuild():
+    """
+    Reloads the user's full set history, fetched a page at a time
+
+    Returns:
+        True if the history was loaded, False otherwise
+    """
+    user_id = current_user_id()
+    try:
+        rows = select_all(lambda: get_supabase().table('set').select('id,exercise,set_num,lbs,reps,workout(date)').order('id').order('exercise').order('set_num'))
+    except Exception as e:
+        logging.error(f'Failed to load the set history: {e}')
+        return False
+    history = _new_history()
+    for row in rows:
+        _add_set(history, {**row, 'date':(row.get('workout') or {}).get('date')})
+    history.update({'generation':next(_generations),'built_at':time.time()})
+    with _lock:
+        _histories[user_id] = history
+        _histories.move_to_end(user_id)
+        evicted = [_histories.popitem(last=False)[0] for _ in range(len(_histories)-MAX_USERS)]
+    _evict(evicted)
+    logging.info(f"Set history loaded with {len(history['sets'])} sets of {len(history['by_exercise'])} exercises")
+    return True
+
+def ensure_warm():
+    """
+    Loads the history if it has not been loaded yet or is older than CACHE_MAX_AGE_SECONDS
+
+    Returns:
+        True if the history can be read, False otherwise
+    """
+    user_id = current_user_id()
+    with _lock:
+        built_at = _histories.get(user_id, _new_history())['built_at']
+        if user_id in _histories:
+            _histories.move_to_end(user_id)
+    is_fresh = built_at is not None and time.time() - built_at <= CACHE_MAX_AGE_SECONDS
+    return is_fresh or singleflight.do('set_history', user_id, rebuild) #concurrent requests of a user share one load
+
+def record_sets(sets):
+    """
+    Appends sets that were just inserted
+
+    Args:
+        sets(list[dict]): sets with exercise, lbs, reps, id(workout id) and date
+    """
+    user_id = current_user_id()
+    with _lock:
+        history = _histories.get(user_id)
+        if history is None or history['built_at'] is None:
+            return #the first load will include these sets
+        for workout_set in sets:
+            _add_set(history, workout_set)
+
+def sets_since(generation, count):
+    """
+    Gets the sets added after a reader last read the history
+
+    Args:
+        generation(int): generation the reader last read, 0 if it has not read the history
+        count(int): number of sets the reader has already read from that generation
+
+    Returns:
+        tuple of the current generation and the sets the reader has not read, every set if the history was reloaded
+    """
+    user_id = current_user_id()
+    with _lock:
+        history = _histories.get(user_id, _new_history())
+        start = count if history['generation'] == generation else 0
+        return history['generation'], history['sets'][start:]
+
+def exercise_sets(exercise):
+    """
+    Gets every set of an exercise
+
+    Args:
+        exercise(str): the name of the exercise, in any capitalization
+
+    Returns:
+        tuple of the current generation and the list of the exercise's HistorySet
+    """
+    user_id = current_user_id()
+    with _lock:
+        history = _histories.get(user_id, _new_history())
+        return history['generation'], list(history['by_exercise'].get(exercise.title(), ()))
+
+def exercise_names():
+    """
+    Gets every unique exercise name in the history
+
+    Returns:
+        list[str] of exercise names as saved, in order of first appearance
+    """
+    user_id = current_user_id()
+    with _lock:
+        return list(_histories.get(user_id, _new_history())['names'])
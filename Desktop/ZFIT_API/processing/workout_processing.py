@@ -2,12 +2,32 @@
 This file focuses on processing data related to workouts and sets
 """
 import pandas as pd
-from services.supabase_client import supabase
-from utils.util import list_from_csv
-import csv
+import numpy as np
+from services.supabase_client import get_supabase, current_user_id
+from utils.util import ProgramSet, PROGRAM_HEADER, dump_csv
+from processing import exercise_index, best_set_cache, set_history
+from processing.program_edits import workout_date
+from services import llm_cache
+from services.metrics import traced
+from utils import singleflight
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import threading
 import logging
+import re
+import time
+import os
 from datetime import date
 
+INSERT_CHUNK_SIZE = 500 #max rows sent in a single insert request
+HISTORY_WINDOW = 10 #past workouts sent to the llm for insights by default
+MAX_HISTORY_WINDOW = 100 #largest history window a client can request
+RESOLVER_WORKERS = int(os.getenv('OLLAMA_NUM_PARALLEL', '4')) #exercises resolved at once, matches the parallel requests ollama serves
+EXERCISE_TIMEOUT_SECONDS = float(os.getenv('ZFIT_EXERCISE_TIMEOUT', '90')) #exercises not resolved this long after a worker starts them, or not started this long after being queued, get default lbs and reps
+
+_resolver_pool = ThreadPoolExecutor(max_workers=RESOLVER_WORKERS, thread_name_prefix='zfit-resolver') #shared by every request so ollama is never sent more than RESOLVER_WORKERS calls from clean_csv
+
+@traced
 def find_exercise_lbs_reps(exercise):
     """
     Finds the user's highest volume set for the provided exercise
@@ -19,8 +39,14 @@ def find_exercise_lbs_reps(exercise):
         best_set(dict): the best lbs and reps for a given exercise
     """
     best_set = {'lbs':0,'reps':0} #default lbs and reps
-    try:
-        response = supabase.table('set').select('lbs','reps').eq("exercise",exercise.title()).execute()
+    if best_set_cache.ensure_warm():
+        aggregate = best_set_cache.get_aggregate(exercise)
+        if aggregate is None:
+            logging.warning('There are no past sets of that exercise')
+            return best_set
+        return aggregate['best_set']
+    try: #falls back to scanning the exercise's sets when the cache could not be warmed
+        response = singleflight.do('exercise_sets', (current_user_id(), exercise.title()), lambda: get_supabase().table('set').select('lbs','reps').eq("exercise",exercise.title()).execute())
         if not response.data:
             logging.warning('There are no past sets of that exercise')
         else:
@@ -36,129 +62,318 @@ def find_exercise_lbs_reps(exercise):
         logging.error(f'Failed to find lbs and reps for that exercise: {e}')
     return best_set
 
-def clean_csv():
+@traced
+def resolve_exercise(exercise, closest_exercise):
+    """
+    Pairs an exercise with its closest past exercise and that exercise's best lbs and reps
+
+    Args:
+        exercise(str): the name of the exercise in the plan
+        closest_exercise(str): the most similar past exercise, None if no match was found
+
+    Returns:
+        dict mapping exercise to its closest exercise and lbs_reps
+    """
+    if closest_exercise is None:
+        logging.warning(f'Could not find closest exercise for {exercise}')
+        return {exercise:{'closest_exercise':'','lbs_reps':{'lbs':0,'reps':0}}}
+    return {exercise:{'closest_exercise':closest_exercise,'lbs_reps':find_exercise_lbs_reps(closest_exercise)}}
+
+@traced
+def match_and_resolve_exercises(exercises):
+    """
+    Matches exercises the exercise index is not confident about and resolves their best lbs and reps
+
+    Args:
+        exercises(list[str]): names of the exercises in the plan
+
+    Returns:
+        dict mapping each exercise to its closest exercise and lbs_reps
+    """
+    from services.ollama_service import find_closest_exercises
+    closest_exercises = find_closest_exercises(exercises) #resolves the exercises in one or a few llm calls
+    resolved = {}
+    for exercise in exercises:
+        resolved.update(resolve_exercise(exercise, closest_exercises[exercise]))
+    return resolved
+
+def _submit_resolver_task(fn, *args):
     """
-    Cleans the workout plan in unfiltered_program.csv and writes it to filtered_program.csv 
+    Submits a call to the resolver pool, run as the request's user
+
+    Args:
+        fn(function): function resolving exercises
+        args: arguments passed to fn
+
+    Returns:
+        tuple of the future and the task dict recording when the call was queued and started
     """
-    from services.ollama_service import find_closest_exercise
-    filtered_rows = list_from_csv() #list of exercises in the plan
+    context = contextvars.copy_context() #workers act as the request's user
+    task = {'queued_at':time.monotonic(),'started_at':None,'started':threading.Event()}
+
+    def run():
+        task['started_at'] = time.monotonic()
+        task['started'].set()
+        return context.run(fn, *args)
+    return _resolver_pool.submit(run), task
+
+def _resolver_task_result(future, task):
+    """
+    Waits for a call submitted with _submit_resolver_task, allowing EXERCISE_TIMEOUT_SECONDS from when a worker starts it
+    so time spent queued behind other requests is not counted
+
+    Args:
+        future(Future): future returned by _submit_resolver_task
+        task(dict): task returned by _submit_resolver_task
+
+    Returns:
+        the result of the call
+
+    Raises:
+        TimeoutError: if the call did not start or finish in time, calls that did not start are cancelled
+    """
+    if not task['started'].wait(max(0, task['queued_at']+EXERCISE_TIMEOUT_SECONDS-time.monotonic())) and future.cancel():
+        raise TimeoutError(f'Not started within {EXERCISE_TIMEOUT_SECONDS} seconds')
+    task['started'].wait() #cancel only fails once a worker has picked the call up
+    return future.result(timeout=max(0, task['started_at']+EXERCISE_TIMEOUT_SECONDS-time.monotonic()))
+
+@traced
+def clean_csv(plan_rows, resolved_exercises=None):
+    """
+    Cleans the exercises in the workout plan into individual sets with lbs and reps.
+    Exercises are resolved concurrently as their rows arrive so plan_rows can be a stream from the llm.
+
+    Args:
+        plan_rows(iterable[PlanRow]): exercises in the workout plan
+        resolved_exercises(dict): exercise -> closest exercise and lbs_reps shared between plans(e.g. the weeks of a mesocycle),
+            exercises in it are not resolved again and newly resolved exercises are added to it
+
+    Returns:
+        list[ProgramSet] containing every set in the workout plan
+    """
+    from services.ollama_service import get_exercise_vocabulary
+    filtered_rows = [] #list of exercises in the plan
+    exercise_futures = {} #exercise -> (future resolving it, its task from _submit_resolver_task)
+    unresolved_exercises = [] #exercises the index is not confident about, matched by the llm once the plan is complete
+    resolved_exercises = {} if resolved_exercises is None else resolved_exercises
     closest_exercise_dict = {} #contains an exercise along with its closest exercise from past workouts and best lbs and reps
-    new_rows = [['title', 'date', 'musclegroups', 'exercise', 'set_num','lbs','reps']] #Contains only header for now
+    for row in plan_rows:
+        if not filtered_rows:
+            get_exercise_vocabulary() #refreshes the exercise index while the rest of the plan is generated
+        filtered_rows.append(row)
+        exercise = row.exercise
+        if exercise in exercise_futures or exercise in unresolved_exercises or exercise in closest_exercise_dict:
+            continue
+        if exercise in resolved_exercises:
+            closest_exercise_dict[exercise] = resolved_exercises[exercise]
+            continue
+        closest_exercise = exercise_index.confident_match(exercise)
+        if closest_exercise is None:
+            unresolved_exercises.append(exercise)
+        else:
+            exercise_futures[exercise] = _submit_resolver_task(resolve_exercise, exercise, closest_exercise)
+    if unresolved_exercises: #matched in one task so the past exercises are sent to the llm once, the timeout applies to the whole batch
+        future_and_task = _submit_resolver_task(match_and_resolve_exercises, unresolved_exercises)
+        for exercise in unresolved_exercises:
+            exercise_futures[exercise] = future_and_task
+    for exercise, (future, task) in exercise_futures.items():
+        try:
+            closest_exercise_dict[exercise] = _resolver_task_result(future, task)[exercise]
+            resolved_exercises[exercise] = closest_exercise_dict[exercise]
+        except Exception as e:
+            logging.error(f'Could not resolve {exercise}: {e!r}')
+            closest_exercise_dict[exercise] = {'closest_exercise':'','lbs_reps':{'lbs':0,'reps':0}}
+    new_rows = [] #sets in the program
     for row in filtered_rows:
-        exercise = row[3]
-        if exercise not in closest_exercise_dict.keys():
-            closest_exercise = find_closest_exercise(exercise)
-            if closest_exercise is None:
-                logging.warning(f'Could not find closest exercise for {exercise}')
-                closest_exercise_dict[exercise] = {
-                    'closest_exercise':'',
-                    'lbs_reps':{'lbs':0,'reps':0}
-                }
-            else:
-                closest_exercise_dict[exercise] = {
-                    'closest_exercise':closest_exercise,
-                    'lbs_reps':find_exercise_lbs_reps(closest_exercise)
-                }
+        exercise = row.exercise
         try:
-            num_sets = int(row[4])#number of sets to perform of exercise
+            num_sets = int(row.sets)#number of sets to perform of exercise
         except Exception as e:
-            logging.error(f'Could not cast {row[4]} as an int:{e}')
+            logging.error(f'Could not cast {row.sets} as an int:{e}')
             num_sets = 3 # default number of sets to 3
+        lbs_reps = closest_exercise_dict[exercise]['lbs_reps']
         for i in range(num_sets):
-            new_rows.append([row[0],row[1],row[2],row[3],i+1,closest_exercise_dict[exercise]['lbs_reps']['lbs'],closest_exercise_dict[exercise]['lbs_reps']['reps']])
-    try:
-        with open('data/filtered_program.csv','w',newline='') as f:
-            writer = csv.writer(f)
-            writer.writerows(new_rows)
-            logging.info('Filtered workout plan successfully written to filtered_program.csv')
-    except Exception as e:
-        logging.error(f'Failed to write workout plan to filtered_program.csv')
+            new_rows.append(ProgramSet(row.title,row.date,row.musclegroups,exercise,i+1,lbs_reps['lbs'],lbs_reps['reps']))
+    dump_csv('data/filtered_program.csv', PROGRAM_HEADER, new_rows)
+    return new_rows
 
-def structure_csv():
+@traced
+def structure_csv(program_sets):
     """
-    Structures filtered_program.csv in a way that can be easily parsed for display in the front end
+    Structures the sets in the program in a way that can be easily parsed for display in the front end
+
+    Args:
+        program_sets(list[ProgramSet]): every set in the workout plan
 
     returns:
         Python dictionary containing workout information
     """
     try:
-        df = pd.read_csv('data/filtered_program.csv')
+        df = pd.DataFrame(program_sets, columns=PROGRAM_HEADER)
     except Exception as e:
-        logging.error(f'Failed to create dataframe from filtered_program.csv: {e}')
+        logging.error(f'Failed to create dataframe from the program sets: {e}')
         return []
 
     workouts = []
-    grouped_by_date = df.groupby(['date'])
-    for date,data in grouped_by_date:
-        workout = {
-            'title':set(),
-            'date':date,
-            'musclegroups': set(),
-            'sets':[]
-        }
-        for index,row in data.iterrows():
-            workout['title'].add(row['title'])
-            workout['musclegroups'].update(row['musclegroups'].split(';'))
-            workout['sets'].append({
-                'exercise':row['exercise'],
-                'set_num':row['set_num'],
-                'lbs':row['lbs'],
-                'reps':row['reps']})
-        workout['musclegroups'] = list(workout['musclegroups'])
-        workout['title'] = '/'.join(list(workout['title']))
-        workouts.append(workout)
+    if df.empty:
+        return workouts
+    date_codes, dates = pd.factorize(df['date'], sort=True) #date_codes[i] is the position of row i's date in dates
+    order = np.argsort(date_codes, kind='stable') #rows grouped by date, keeping plan order within each date
+    boundaries = np.flatnonzero(np.diff(date_codes[order])) + 1 #positions in order where a new date starts
+    columns = {column:df[column].to_numpy(dtype=object)[order].tolist() for column in PROGRAM_HEADER}
+    for plan_date, start, end in zip(dates.tolist(), [0, *boundaries.tolist()], [*boundaries.tolist(), len(order)]):
+        musclegroups = dict.fromkeys(group for musclegroup in columns['musclegroups'][start:end] for group in musclegroup.split(';'))
+        workouts.append({
+            'title':'/'.join(dict.fromkeys(columns['title'][start:end])),
+            'date':(plan_date,), #grouping by ['date'] always produced one item tuples, kept so the response is unchanged
+            'musclegroups':list(musclegroups),
+            'sets':[
+                {'exercise':exercise,'set_num':set_num,'lbs':lbs,'reps':reps}
+                for exercise, set_num, lbs, reps in zip(columns['exercise'][start:end], columns['set_num'][start:end], columns['lbs'][start:end], columns['reps'][start:end])
+            ]
+        })
     return workouts
 
+def _delete_workouts(workout_ids):
+    """
+    Deletes workouts and their sets, used to undo workouts that could not be saved along with their sets
+
+    Args:
+        workout_ids(list): ids of the workouts to delete
+    """
+    if not workout_ids:
+        return
+    try:
+        get_supabase().table('set').delete().in_('id',workout_ids).execute()
+        get_supabase().table('workout').delete().in_('id',workout_ids).execute()
+        logging.info(f'Rolled back workouts: {workout_ids}')
+    except Exception as e:
+        logging.error(f'Failed to roll back workouts: {workout_ids}. Error: {e}')
+
+def _insert_rows(table, rows):
+    """
+    Inserts rows into a table using one multi-row insert
+
+    Args:
+        table(str): name of the table
+        rows(list[dict]): rows to insert
+
+    Returns:
+        list of the inserted rows in the same order as rows
+    """
+    response = get_supabase().table(table).insert(rows).execute()
+    if len(response.data) != len(rows):
+        if table == 'workout':
+            _delete_workouts([row['id'] for row in response.data]) #the rows that did come back would be left without their sets
+        raise ValueError(f'Expected {len(rows)} inserted rows in {table} but received {len(response.data)}')
+    return response.data
+
+@traced
 def insert_workouts(data):
     """
-    Inserts workouts into the database after user confirmation
+    Inserts workouts into the database after user confirmation.
+    Workouts are inserted with one multi-row insert per chunk and their sets with one multi-row insert per chunk of workouts.
+    A workout and its sets are saved together or not at all.
 
     Args:
         data(list): list of workouts
+
+    Returns:
+        list containing the result(title, date, status, id, sets, error) of each workout in data
     """
-    for workout in data:
-        workout_to_insert = {
-            "title":workout['title'],
-            "inprogress":True,
-            "date":workout['date'],
-            "musclegroups":', '.join(workout['musclegroups']),
-            "duration":0
-        }
+    results = [{'title':workout.get('title'),'date':workout.get('date'),'status':'failed','id':None,'sets':0,'error':None} for workout in data]
+    workout_ids = [None]*len(data) #id of each workout in data once inserted
+    for start in range(0, len(data), INSERT_CHUNK_SIZE):
+        chunk = range(start, min(start+INSERT_CHUNK_SIZE, len(data)))
+        try:
+            workouts_to_insert = [{
+                "title":data[i]['title'],
+                "inprogress":True,
+                "date":data[i]['date'],
+                "musclegroups":', '.join(data[i]['musclegroups']),
+                "duration":0
+            } for i in chunk]
+            inserted_workouts = _insert_rows('workout', workouts_to_insert)
+            for i, inserted_workout in zip(chunk, inserted_workouts):
+                workout_ids[i] = inserted_workout['id']
+            logging.info(f'Workouts inserted: {len(inserted_workouts)}')
+        except Exception as e:
+            logging.error(f'Failed to insert workouts {chunk.start}-{chunk.stop-1}. Error: {e}')
+            for i in chunk:
+                results[i]['error'] = str(e)
+    inserted_sets = [] #sets that were saved along with their workout id and date
+    set_chunk = [] #indexes of the workouts whose sets are sent in the next insert
+    set_chunk_size = 0
+    pending = [i for i in range(len(data)) if workout_ids[i] is not None]
+    for position, i in enumerate(pending):
+        set_chunk.append(i)
+        set_chunk_size += len(data[i]['sets'])
+        is_last = position == len(pending)-1
+        if not is_last and set_chunk_size + len(data[pending[position+1]]['sets']) <= INSERT_CHUNK_SIZE:
+            continue #a workout's sets are never split across inserts so each workout stays all-or-nothing
         try:
-            workout_response = supabase.table('workout').insert(workout_to_insert).execute()
-            logging.info(f'Workout inserted: {workout_response}')
+            sets_to_insert = []
+            set_dates = [] #date of the workout each set belongs to
+            for j in set_chunk:
+                for set in data[j]['sets']:
+                    sets_to_insert.append({
+                        "id":workout_ids[j],
+                        "exercise":set['exercise'],
+                        "set_num":set['set_num'],
+                        "lbs":set['lbs'],
+                        "reps":set['reps']
+                    })
+                    set_dates.append(workout_date(data[j])) #the front end sends the date as a one item list
+            if sets_to_insert:
+                _insert_rows('set', sets_to_insert)
+            logging.info(f'Sets inserted: {len(sets_to_insert)}')
+            for j in set_chunk:
+                results[j].update({'status':'inserted','id':workout_ids[j],'sets':len(data[j]['sets'])})
+            inserted_sets.extend({**set_to_insert, 'date':set_date} for set_to_insert, set_date in zip(sets_to_insert, set_dates))
         except Exception as e:
-            logging.error(f'Failed to insert workout: {workout_to_insert}. Error: {e}')
-        for set in workout['sets']:
-            set_to_insert = {
-                "id":workout_response.data[0]['id'],
-                "exercise":set['exercise'],
-                "set_num":set['set_num'],
-                "lbs":set['lbs'],
-                "reps":set['reps']
-            }
-            try:
-                response = supabase.table('set').insert(set_to_insert).execute()
-                logging.info(f'Set inserted: {response}')
-            except Exception as e:
-                logging.error(f'Failed to insert set: {set_to_insert}. Error: {e}')
-
-def get_past_exercise_data(exercise):
-    """
-    Retrieves set, lbs, and reps information for the provided exercise in the past 10 workouts 
+            logging.error(f'Failed to insert sets for workouts {[workout_ids[j] for j in set_chunk]}. Error: {e}')
+            _delete_workouts([workout_ids[j] for j in set_chunk])
+            for j in set_chunk:
+                results[j]['error'] = str(e)
+        set_chunk, set_chunk_size = [], 0
+    exercise_index.add_exercises([inserted_set['exercise'] for inserted_set in inserted_sets]) #keeps exercise matching aware of newly saved exercises
+    set_history.record_sets(inserted_sets) #best sets and analytics are derived from the history
+    for exercise in {inserted_set['exercise'] for inserted_set in inserted_sets}:
+        llm_cache.invalidate_tag(llm_cache.insights_tag(exercise)) #insights must reflect the new sets
+    return results
+
+@traced
+def get_past_exercise_page(exercise, limit=HISTORY_WINDOW, cursor=None):
+    """
+    Retrieves set, lbs, and reps information for the provided exercise in the most recent workouts containing it.
+    Workouts without the exercise are filtered out and the limit is applied by the database.
 
     Args:
         exercise(str): exercise we want to find past info for
-    
+        limit(int): max number of workouts to return
+        cursor(str): next_cursor from the previous page, starts from today if not provided
+
     returns:
-        a list containing the past information for the exercise, none otherwise
+        a tuple of the list of past workouts for the exercise and the cursor for the next page(None on the last page),
+        None otherwise
     """
-    today_iso = date.today().isoformat()
+    limit = max(1, min(int(limit), MAX_HISTORY_WINDOW))
     try:
-        response = supabase.table('workout').select('date,set(set_num,lbs,reps)').eq('set.exercise',exercise).lt('date',today_iso).order('date',desc=True).execute()
-        filtered_workouts = list(filter(lambda workout:len(workout['set']) != 0,response.data))[0:10]
-        logging.info(f'Successfully found past exercise info: {filtered_workouts}')
-        return filtered_workouts
+        query = get_supabase().table('workout').select('id,date,set!inner(set_num,lbs,reps)').eq('set.exercise',exercise)
+        if cursor:
+            cursor_date, cursor_id = cursor.split('_',1) #workouts on the cursor's date are paged by id
+            cursor_date = date.fromisoformat(cursor_date).isoformat()
+            if not re.fullmatch(r'[0-9A-Za-z-]+', cursor_id):
+                raise ValueError(f'Invalid cursor: {cursor}')
+            query = query.or_(f'date.lt.{cursor_date},and(date.eq.{cursor_date},id.lt.{cursor_id})')
+        else:
+            query = query.lt('date',date.today().isoformat())
+        response = query.order('date',desc=True).order('id',desc=True).limit(limit).execute()
+        workouts = response.data
+        next_cursor = f"{workouts[-1]['date']}_{workouts[-1]['id']}" if len(workouts) == limit else None
+        past_workouts = [{'date':workout['date'],'set':workout['set']} for workout in workouts]
+        logging.info(f'Successfully found {len(past_workouts)} past workouts for {exercise}')
+        return past_workouts, next_cursor
     except Exception as e:
         logging.error(f'Could not retrieve past exercise info: {e}')
         return None
@@ -0,0 +1,168 @@
+"""
+This file contains an in-process background job queue
+
+Long running requests are submitted as jobs that run on a bounded thread pool.
+Clients poll a job for its status or follow its progress events, and finished jobs
+are removed once they are older than JOB_TTL_SECONDS.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from services import metrics
+import contextvars
+import logging
+import threading
+import time
+import uuid
+import json
+import os
+
+MAX_WORKERS = int(os.getenv('ZFIT_JOB_WORKERS', '2')) #jobs running at the same time
+MAX_QUEUED_JOBS = int(os.getenv('ZFIT_JOB_QUEUE_DEPTH', '20')) #jobs waiting for a worker before new jobs are rejected
+JOB_TTL_SECONDS = int(os.getenv('ZFIT_JOB_TTL', '600')) #how long finished jobs and their results are kept
+HEARTBEAT_SECONDS = 15 #how often an idle event stream sends a comment to keep the connection open
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='zfit-job')
+_condition = threading.Condition() #guards _jobs and wakes event streams when a job changes
+_jobs = {} #job id -> job dict
+
+class QueueFullError(Exception):
+    """
+    Raised when a job is submitted while MAX_QUEUED_JOBS jobs are already waiting
+    """
+
+def _expire_jobs():
+    """
+    Removes finished jobs older than JOB_TTL_SECONDS, callers must hold _condition
+    """
+    now = time.time()
+    expired = [job_id for job_id, job in _jobs.items() if job['finished_at'] is not None and now - job['finished_at'] > JOB_TTL_SECONDS]
+    for job_id in expired:
+        del _jobs[job_id]
+
+def _add_event(job, event, data):
+    """
+    Records an event for a job and wakes any event streams, callers must hold _condition
+
+    Args:
+        job(dict): the job the event belongs to
+        event(str): name of the event
+        data(dict): event payload
+    """
+    job['events'].append((event, data))
+    _condition.notify_all()
+
+def _run_job(job_id, fn, args):
+    """
+    Runs a job on a worker thread and records its result
+
+    Args:
+        job_id(str): id of the job
+        fn(function): function to run, called with args and a progress keyword argument
+        args(tuple): positional arguments for fn
+    """
+    def progress(stage):
+        with _condition:
+            job['stage'] = stage
+            _add_event(job, 'stage', {'stage':stage})
+
+    metrics.start_request() #the job gets its own totals, separate from the request that queued it
+    with _condition:
+        job = _jobs[job_id]
+        job['status'] = 'running'
+        job['started_at'] = time.time()
+        _add_event(job, 'status', {'status':'running'})
+    try:
+        result = fn(*args, progress=progress)
+        with _condition:
+            job.update({'status':'done','result':result,'finished_at':time.time()})
+            _add_event(job, 'done', {'status':'done','result':result})
+        metrics.finish_request(f"job:{job['name']}", 'done')
+    except Exception as e:
+        logging.error(f'Job {job_id} failed: {e}')
+        with _condition:
+            job.update({'status':'failed','error':str(e),'finished_at':time.time()})
+            _add_event(job, 'done', {'status':'failed','error':str(e)})
+        metrics.finish_request(f"job:{job['name']}", 'failed')
+
+def submit_job(name, fn, *args):
+    """
+    Queues a function to run in the background
+
+    Args:
+        name(str): name of the job shown to clients
+        fn(function): function to run, called with args and a progress keyword argument
+        args: positional arguments for fn
+
+    Returns:
+        string containing the id of the job
+
+    Raises:
+        QueueFullError: if MAX_QUEUED_JOBS jobs are already waiting
+    """
+    with _condition:
+        _expire_jobs()
+        queued = sum(1 for job in _jobs.values() if job['status'] == 'queued')
+        if queued >= MAX_QUEUED_JOBS:
+            raise QueueFullError(f'{queued} jobs are already waiting')
+        job_id = uuid.uuid4().hex
+        _jobs[job_id] = {
+            'id':job_id,
+            'name':name,
+            'status':'queued',
+            'stage':None,
+            'result':None,
+            'error':None,
+            'created_at':time.time(),
+            'started_at':None,
+            'finished_at':None,
+            'events':[('status',{'status':'queued'})]
+        }
+    context = contextvars.copy_context() #the job sees the context variables of the request that submitted it
+    _executor.submit(context.run, _run_job, job_id, fn, args)
+    logging.info(f'Job {job_id} queued: {name}')
+    return job_id
+
+def get_job(job_id):
+    """
+    Gets the current state of a job
+
+    Args:
+        job_id(str): id of the job
+
+    Returns:
+        dict containing the job's id, name, status, stage, result and error, None if the job does not exist or expired
+    """
+    with _condition:
+        _expire_jobs()
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        return {key:value for key,value in job.items() if key != 'events'}
+
+def job_events(job_id):
+    """
+    Streams a job's events in server-sent events format until the job finishes
+
+    Args:
+        job_id(str): id of the job
+
+    Yields:
+        string containing one server-sent event
+    """
+    sent = 0 #number of the job's events already sent
+    while True:
+        with _condition:
+            job = _jobs.get(job_id)
+            if job is not None and sent == len(job['events']):
+                _condition.wait(timeout=HEARTBEAT_SECONDS)
+            events = job['events'][sent:] if job is not None else None
+        if events is None:
+            yield f"event: error\ndata: {json.dumps({'error':'Job not found'})}\n\n"
+            return
+        if not events:
+            yield ': heartbeat\n\n'
+            continue
+        for event, data in events:
+            yield f'event: {event}\ndata: {json.dumps(data)}\n\n'
+            sent += 1
+            if event == 'done':
+                return
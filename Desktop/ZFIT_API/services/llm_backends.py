@@ -0,0 +1,222 @@
+"""
+This file contains the llm backends used by ollama_service
+
+Every backend has a generate(model, prompt, stream=False, **kwargs) method that works like
+ollama.Client.generate: it returns a response with a .response string, or when streaming an iterator
+of partial responses. The backend is chosen with ZFIT_LLM_BACKEND:
+-ollama: sends prompts to the ollama server in OLLAMA_HOST, keeping the model loaded for ZFIT_LLM_KEEP_ALIVE after each call
+-stub: replays recorded responses with a configurable delay so the api can be benchmarked without a model
+When ZFIT_LLM_RECORD_PATH is set every response is also appended to that file so it can be replayed by the stub.
+"""
+from typing import NamedTuple
+from services import llm_cache
+import threading
+import hashlib
+import logging
+import ollama
+import json
+import time
+import re
+import os
+
+BACKEND = os.getenv('ZFIT_LLM_BACKEND', 'ollama')
+MODEL = os.getenv('ZFIT_LLM_MODEL', 'llama3')
+KEEP_ALIVE = os.getenv('ZFIT_LLM_KEEP_ALIVE', '30m') #how long ollama keeps the model loaded after a call: a duration like 30m, seconds, or -1 for forever
+RECORDINGS_PATH = os.getenv('ZFIT_LLM_RECORDINGS', 'benchmarks/data/llm_recordings.jsonl') #responses replayed by the stub
+RECORD_PATH = os.getenv('ZFIT_LLM_RECORD_PATH') #file responses are appended to, disabled when unset
+STUB_LATENCY_SECONDS = float(os.getenv('ZFIT_LLM_STUB_LATENCY', '0.5')) #delay before the first part of a response
+STUB_CHUNK_SECONDS = float(os.getenv('ZFIT_LLM_STUB_CHUNK_LATENCY', '0.01')) #delay before every other part of a response
+STUB_PARALLEL = int(os.getenv('OLLAMA_NUM_PARALLEL', '4')) #calls the stub answers at once, later calls wait like they would for ollama
+
+class StubResponse(NamedTuple):
+    """
+    Response from the stub backend, with the fields of an ollama response the api reads
+    """
+    response: str
+    done: bool = True
+    prompt_eval_count: int = 0 #tokens in the prompt, estimated from the number of words
+    eval_count: int = 0 #tokens in the response, estimated from the number of words
+
+def recording_format(format, system=None):
+    """
+    Gets the name responses with the provided format are grouped under
+
+    Args:
+        format(str|dict): format argument of the call, None for plain text
+        system(str): system prompt of the call, plain text calls with different system prompts are grouped apart
+
+    Returns:
+        string containing 'text' optionally followed by ':' and a hash of the system prompt, 'json' or 'schema:' followed by a hash of the json schema
+    """
+    if not format:
+        return 'text:'+hashlib.sha256(system.encode()).hexdigest()[:12] if system else 'text' #a csv plan is no answer to an insights prompt
+    if isinstance(format, str):
+        return format
+    return 'schema:'+hashlib.sha256(json.dumps(format, sort_keys=True).encode()).hexdigest()[:12]
+
+def parse_keep_alive(keep_alive):
+    """
+    Converts a keep alive setting to the value ollama expects
+
+    Args:
+        keep_alive(str): a duration like 30m or a number of seconds
+
+    Returns:
+        int containing the seconds for numbers, the duration string otherwise
+    """
+    try:
+        return int(keep_alive)
+    except ValueError:
+        return keep_alive
+
+class OllamaBackend:
+    """
+    Sends prompts to an ollama server
+    """
+    def __init__(self, host=None, keep_alive=KEEP_ALIVE):
+        self.client = ollama.Client(host=host) #uses OLLAMA_HOST when host is not provided
+        self.keep_alive = parse_keep_alive(keep_alive)
+
+    def generate(self, model, prompt, stream=False, **kwargs):
+        kwargs.setdefault('keep_alive', self.keep_alive) #not part of the call's cache key, it only affects how long the model stays loaded
+        return self.client.generate(model=model, prompt=prompt, stream=stream, **kwargs)
+
+    def unload(self, model):
+        """
+        Unloads the model so the next call has to load it again
+
+        Args:
+            model(str): name of the model
+        """
+        self.client.generate(model=model, prompt='', keep_alive=0)
+
+class StubBackend:
+    """
+    Replays recorded responses without a model
+
+    A call with the same model, prompt and arguments as a recording gets that recording's response.
+    Other calls get a recording with the same format, picked by a hash of the prompt so the
+    same call always gets the same response, or an empty response if there is none.
+    """
+    def __init__(self, path=RECORDINGS_PATH, latency=STUB_LATENCY_SECONDS, chunk_latency=STUB_CHUNK_SECONDS, parallel=STUB_PARALLEL):
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.slots = threading.BoundedSemaphore(parallel)
+        self.responses = {} #cache key -> response
+        self.fallbacks = {} #recording format -> responses in the order they were recorded
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        recording = json.loads(line)
+                        self.responses[recording['key']] = recording['response']
+                        self.fallbacks.setdefault(recording['format'], []).append(recording['response'])
+            logging.info(f'Loaded {len(self.responses)} llm recordings from {path}')
+        except FileNotFoundError:
+            logging.warning(f'No llm recordings found at {path}, the stub will send empty responses')
+
+    def lookup(self, model, prompt, **kwargs):
+        """
+        Finds the response for a call
+
+        Args:
+            model(str): name of the model
+            prompt(str): the prompt sent to the model
+            kwargs: other generation arguments such as format or options
+
+        Returns:
+            string containing the recorded response
+        """
+        response = self.responses.get(llm_cache.cache_key(model, prompt, **kwargs))
+        if response is not None:
+            return response
+        format = recording_format(kwargs.get('format'), kwargs.get('system'))
+        fallbacks = self.fallbacks.get(format)
+        if not fallbacks:
+            return '' if format.startswith('text') else '{}'
+        return fallbacks[int(hashlib.sha256(prompt.encode()).hexdigest(), 16) % len(fallbacks)]
+
+    def generate(self, model, prompt, stream=False, **kwargs):
+        response = self.lookup(model, prompt, **kwargs)
+        prompt_tokens, response_tokens = len(prompt.split()), len(response.split())
+        if stream:
+            return self._stream(response, prompt_tokens, response_tokens)
+        chunks = re.findall(r'\S+\s*|\s+', response)
+        with self.slots:
+            time.sleep(self.latency + self.chunk_latency*max(len(chunks)-1, 0))
+        return StubResponse(response, True, prompt_tokens, response_tokens)
+
+    def _stream(self, response, prompt_tokens, response_tokens):
+        with self.slots:
+            time.sleep(self.latency)
+            for i, chunk in enumerate(re.findall(r'\S+\s*|\s+', response)):
+                if i:
+                    time.sleep(self.chunk_latency)
+                yield StubResponse(chunk, False)
+        yield StubResponse('', True, prompt_tokens, response_tokens)
+
+class RecordingBackend:
+    """
+    Wraps another backend and appends every completed response to a file the stub can replay
+    """
+    def __init__(self, backend, path=RECORD_PATH):
+        self.backend = backend
+        self.path = path
+        self.lock = threading.Lock()
+
+    def record(self, model, prompt, response, **kwargs):
+        """
+        Appends a response to the recordings file
+
+        Args:
+            model(str): name of the model
+            prompt(str): the prompt sent to the model
+            response(str): the model's response
+            kwargs: other generation arguments such as format or options
+        """
+        recording = {
+            'key':llm_cache.cache_key(model, prompt, **kwargs),
+            'format':recording_format(kwargs.get('format'), kwargs.get('system')),
+            'prompt':prompt,
+            'response':response
+        }
+        try:
+            with self.lock, open(self.path, 'a') as f:
+                f.write(json.dumps(recording)+'\n')
+        except Exception as e:
+            logging.error(f'Failed to record llm response to {self.path}: {e}')
+
+    def generate(self, model, prompt, stream=False, **kwargs):
+        if not stream:
+            response = self.backend.generate(model, prompt, **kwargs)
+            self.record(model, prompt, response.response, **kwargs)
+            return response
+        return self._stream(model, prompt, **kwargs)
+
+    def _stream(self, model, prompt, **kwargs):
+        parts = []
+        for chunk in self.backend.generate(model, prompt, stream=True, **kwargs):
+            parts.append(chunk.response)
+            yield chunk
+        self.record(model, prompt, ''.join(parts), **kwargs)
+
+def create_backend(name=BACKEND):
+    """
+    Creates the llm backend
+
+    Args:
+        name(str): ollama or stub
+
+    Returns:
+        backend with a generate method, wrapped in a RecordingBackend when RECORD_PATH is set
+    """
+    if name == 'ollama':
+        backend = OllamaBackend()
+    elif name == 'stub':
+        backend = StubBackend()
+    else:
+        raise ValueError(f'Unknown llm backend: {name}')
+    if RECORD_PATH:
+        backend = RecordingBackend(backend)
+    logging.info(f'Using the {name} llm backend')
+    return backend
@@ -0,0 +1,184 @@
+"""
+This file contains a content-addressed cache for llm responses
+
+Responses are keyed by a hash of the model, prompt and generation options and kept in an
+in-memory LRU. When ZFIT_LLM_CACHE_PATH is set responses are also stored in a sqlite file so
+they survive restarts. Entries expire after their TTL and can be tagged so related entries
+(e.g. every insight for an exercise) can be invalidated together. The counters are exported on /metrics.
+"""
+from services import metrics
+from collections import OrderedDict
+import threading
+import sqlite3
+import hashlib
+import logging
+import json
+import time
+import os
+
+MAX_ENTRIES = int(os.getenv('ZFIT_LLM_CACHE_SIZE', '256')) #responses kept in memory
+DEFAULT_TTL_SECONDS = int(os.getenv('ZFIT_LLM_CACHE_TTL', str(24*60*60)))
+DISK_CACHE_PATH = os.getenv('ZFIT_LLM_CACHE_PATH') #sqlite file for the on-disk tier, disabled when unset
+
+_lock = threading.Lock()
+_entries = OrderedDict() #key -> (response, tags, expires_at), most recently used last
+_stats = {'hits':0,'disk_hits':0,'misses':0,'evictions':0,'invalidations':0}
+
+def insights_tag(exercise):
+    """
+    Gets the llm cache tag for an exercise's insights
+
+    Args:
+        exercise(str): name of the exercise
+
+    Returns:
+        string containing the tag
+    """
+    return f'insights:{exercise.title()}'
+
+def cache_key(model, prompt, **options):
+    """
+    Creates the cache key for an llm call
+
+    Args:
+        model(str): name of the model
+        prompt(str): the prompt sent to the model
+        options: any other generation arguments such as format or options
+
+    Returns:
+        string containing the sha256 hex digest identifying the call
+    """
+    payload = json.dumps({'model':model,'prompt':prompt,'options':options}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _connect():
+    """
+    Opens the on-disk cache, creating its table the first time
+
+    Returns:
+        sqlite3 connection, None if the on-disk tier is disabled
+    """
+    if not DISK_CACHE_PATH:
+        return None
+    connection = sqlite3.connect(DISK_CACHE_PATH, timeout=5)
+    connection.execute('CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, response TEXT, tags TEXT, expires_at REAL)')
+    return connection
+
+def _count(event, count=1):
+    """
+    Adds to a cache counter and exports it, callers must hold _lock
+
+    Args:
+        event(str): key of _stats
+        count(int): amount to add
+    """
+    _stats[event] += count
+    metrics.record_cache_event(event, count)
+
+def _remember(key, response, tags, expires_at):
+    """
+    Adds an entry to the in-memory LRU, callers must hold _lock
+
+    Args:
+        key(str): cache key
+        response(str): llm response
+        tags(tuple[str]): tags used for invalidation
+        expires_at(float): time the entry expires
+    """
+    _entries[key] = (response, tags, expires_at)
+    _entries.move_to_end(key)
+    while len(_entries) > MAX_ENTRIES:
+        _entries.popitem(last=False)
+        _count('evictions')
+    metrics.record_cache_size(len(_entries))
+
+def get(key):
+    """
+    Gets a cached response
+
+    Args:
+        key(str): cache key
+
+    Returns:
+        string containing the cached response, None on a miss
+    """
+    now = time.time()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[2] > now:
+            _entries.move_to_end(key)
+            _count('hits')
+            return entry[0]
+        if _entries.pop(key, None) is not None: #expired
+            metrics.record_cache_size(len(_entries))
+    try:
+        connection = _connect()
+        if connection is not None:
+            with connection:
+                row = connection.execute('SELECT response, tags, expires_at FROM llm_cache WHERE key = ?', (key,)).fetchone()
+            connection.close()
+            if row is not None and row[2] > now:
+                with _lock:
+                    _remember(key, row[0], tuple(json.loads(row[1])), row[2])
+                    _count('disk_hits')
+                return row[0]
+    except Exception as e:
+        logging.error(f'Failed to read from the llm cache: {e}')
+    with _lock:
+        _count('misses')
+    return None
+
+def put(key, response, tags=(), ttl=None):
+    """
+    Stores a response
+
+    Args:
+        key(str): cache key
+        response(str): llm response
+        tags(tuple[str]): tags used for invalidation
+        ttl(int): seconds until the entry expires, DEFAULT_TTL_SECONDS if not provided
+    """
+    expires_at = time.time() + (DEFAULT_TTL_SECONDS if ttl is None else ttl)
+    tags = tuple(tags)
+    with _lock:
+        _remember(key, response, tags, expires_at)
+    try:
+        connection = _connect()
+        if connection is not None:
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?)', (key, response, json.dumps(tags), expires_at))
+            connection.close()
+    except Exception as e:
+        logging.error(f'Failed to write to the llm cache: {e}')
+
+def invalidate_tag(tag):
+    """
+    Removes every cached response with the provided tag
+
+    Args:
+        tag(str): tag of the entries to remove
+    """
+    with _lock:
+        keys = [key for key, entry in _entries.items() if tag in entry[1]]
+        for key in keys:
+            del _entries[key]
+        _count('invalidations', len(keys))
+        metrics.record_cache_size(len(_entries))
+    try:
+        connection = _connect()
+        if connection is not None:
+            with connection:
+                connection.execute('DELETE FROM llm_cache WHERE tags LIKE ?', (f'%{json.dumps(tag)}%',))
+            connection.close()
+    except Exception as e:
+        logging.error(f'Failed to invalidate {tag} in the llm cache: {e}')
+
+def cache_stats():
+    """
+    Gets the cache counters
+
+    Returns:
+        dict containing hits, disk_hits, misses, evictions, invalidations and the number of entries in memory
+    """
+    with _lock:
+        return {**_stats, 'entries':len(_entries)}
@@ -0,0 +1,212 @@
+"""
+This file contains the api's timing and metrics instrumentation
+
+Functions are wrapped in spans with @traced, and llm calls, llm cache lookups, supabase round trips and coalesced calls are counted.
+Everything is exported as Prometheus metrics on /metrics. Each request also keeps its own totals,
+which are logged when it finishes so a slow request shows whether the time went to the llm,
+the database or local processing.
+"""
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+import contextvars
+import functools
+import threading
+import inspect
+import logging
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_SECONDS = Histogram('zfit_stage_seconds', 'Time spent in each traced function', ['stage'], buckets=LATENCY_BUCKETS)
+REQUEST_SECONDS = Histogram('zfit_request_seconds', 'Time to handle an api request or background job', ['endpoint','status'], buckets=LATENCY_BUCKETS)
+LLM_CALLS = Counter('zfit_llm_calls', 'Calls to the llm', ['cached'])
+LLM_TOKENS = Counter('zfit_llm_tokens', 'Tokens processed by the llm', ['kind'])
+LLM_SECONDS = Histogram('zfit_llm_seconds', 'Time for the llm to answer a call that was not cached', buckets=LATENCY_BUCKETS)
+DB_ROUND_TRIPS = Counter('zfit_db_round_trips', 'Requests sent to supabase', ['table'])
+DB_SECONDS = Histogram('zfit_db_seconds', 'Time for supabase to answer a request', ['table'], buckets=LATENCY_BUCKETS)
+REQUEST_DB_ROUND_TRIPS = Histogram('zfit_request_db_round_trips', 'Supabase round trips per api request', ['endpoint'], buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200))
+FLIGHT_CALLS = Counter('zfit_singleflight_calls', 'Calls through the single flight layer, coalesced ones waited for an identical call in flight', ['group','coalesced'])
+LLM_CACHE_EVENTS = Counter('zfit_llm_cache_events', 'Llm cache lookups and removals', ['event'])
+LLM_CACHE_ENTRIES = Gauge('zfit_llm_cache_entries', 'Llm responses cached in memory')
+REQUEST_LLM_TOKENS = Histogram('zfit_request_llm_tokens', 'Llm prompt and response tokens per api request', ['endpoint'], buckets=(0, 250, 500, 1000, 2000, 5000, 10000, 20000, 50000))
+
+_lock = threading.Lock() #guards the request totals, which are shared with the request's worker threads
+_request_stats = contextvars.ContextVar('request_stats', default=None) #totals of the current request
+
+def start_request():
+    """
+    Starts collecting totals for the current request or job
+    """
+    _request_stats.set({
+        'started_at':time.perf_counter(),
+        'stages':{},
+        'llm_calls':0,
+        'cached_llm_calls':0,
+        'prompt_tokens':0,
+        'response_tokens':0,
+        'db_round_trips':0,
+        'coalesced_calls':0
+    })
+
+def _add(**amounts):
+    """
+    Adds to the current request's totals
+
+    Args:
+        amounts: total name -> amount to add
+    """
+    stats = _request_stats.get()
+    if stats is None:
+        return
+    with _lock:
+        for name, amount in amounts.items():
+            stats[name] += amount
+
+def current_request():
+    """
+    Gets the current request's totals
+
+    Returns:
+        dict containing the totals, None outside of a request or job
+    """
+    return _request_stats.get()
+
+def finish_request(endpoint, status, stats=None):
+    """
+    Records a request's latency and totals and logs a one line summary
+
+    Args:
+        endpoint(str): route or job name
+        status(int|str): response status code or job status
+        stats(dict): totals from current_request, the current request's totals if not provided
+    """
+    stats = stats if stats is not None else _request_stats.get()
+    if stats is None:
+        return
+    with _lock:
+        if stats.get('finished'):
+            return
+        stats['finished'] = True
+    seconds = time.perf_counter()-stats['started_at']
+    tokens = stats['prompt_tokens']+stats['response_tokens']
+    REQUEST_SECONDS.labels(endpoint, str(status)).observe(seconds)
+    REQUEST_DB_ROUND_TRIPS.labels(endpoint).observe(stats['db_round_trips'])
+    REQUEST_LLM_TOKENS.labels(endpoint).observe(tokens)
+    with _lock:
+        stages = ', '.join(f'{stage}={stage_seconds*1000:.0f}ms' for stage, stage_seconds in sorted(stats['stages'].items(), key=lambda item: -item[1]))
+    logging.info(
+        f"{endpoint} {status} in {seconds*1000:.0f}ms: {stats['db_round_trips']} db round trips, "
+        f"{stats['llm_calls']} llm calls({stats['cached_llm_calls']} cached), {stats['prompt_tokens']}+{stats['response_tokens']} tokens, "
+        f"{stats['coalesced_calls']} coalesced calls"
+        + (f', {stages}' if stages else '')
+    )
+
+def record_stage(stage, seconds):
+    """
+    Records the time spent in a stage
+
+    Args:
+        stage(str): name of the stage
+        seconds(float): time spent
+    """
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    stats = _request_stats.get()
+    if stats is not None:
+        with _lock:
+            stats['stages'][stage] = stats['stages'].get(stage, 0.0) + seconds
+
+def traced(fn):
+    """
+    Wraps a function in a span named after it. Generator functions are timed until the generator is exhausted or closed.
+
+    Args:
+        fn(function): function to trace
+
+    Returns:
+        function that calls fn and records the time spent in it
+    """
+    if inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def generator_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                yield from fn(*args, **kwargs)
+            finally:
+                record_stage(fn.__name__, time.perf_counter()-start)
+        return generator_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            record_stage(fn.__name__, time.perf_counter()-start)
+    return wrapper
+
+def record_llm_call(prompt_tokens=0, response_tokens=0, seconds=None, cached=False):
+    """
+    Records a call to the llm
+
+    Args:
+        prompt_tokens(int): tokens in the prompt, 0 if unknown
+        response_tokens(int): tokens in the response, 0 if unknown
+        seconds(float): time the model took to answer, None for cached responses
+        cached(bool): whether the response came from the llm cache
+    """
+    LLM_CALLS.labels(str(cached).lower()).inc()
+    LLM_TOKENS.labels('prompt').inc(prompt_tokens)
+    LLM_TOKENS.labels('response').inc(response_tokens)
+    if seconds is not None:
+        LLM_SECONDS.observe(seconds)
+    _add(llm_calls=1, cached_llm_calls=int(cached), prompt_tokens=prompt_tokens, response_tokens=response_tokens)
+
+def record_db_round_trip(table, seconds):
+    """
+    Records a request sent to supabase
+
+    Args:
+        table(str): table or service the request was sent to
+        seconds(float): time supabase took to answer
+    """
+    DB_ROUND_TRIPS.labels(table).inc()
+    DB_SECONDS.labels(table).observe(seconds)
+    _add(db_round_trips=1)
+
+def record_flight(group, coalesced):
+    """
+    Records a call through the single flight layer
+
+    Args:
+        group(str): kind of call
+        coalesced(bool): whether the call waited for an identical call in flight instead of running
+    """
+    FLIGHT_CALLS.labels(group, str(coalesced).lower()).inc()
+    _add(coalesced_calls=int(coalesced))
+
+def record_cache_event(event, count=1):
+    """
+    Records llm cache lookups and removals
+
+    Args:
+        event(str): hits, disk_hits, misses, evictions or invalidations
+        count(int): number of times the event happened
+    """
+    LLM_CACHE_EVENTS.labels(event).inc(count)
+
+def record_cache_size(entries):
+    """
+    Records the number of llm responses cached in memory
+
+    Args:
+        entries(int): responses cached in memory
+    """
+    LLM_CACHE_ENTRIES.set(entries)
+
+def export():
+    """
+    Gets every metric in the Prometheus text format
+
+    Returns:
+        tuple of the metrics and their content type
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
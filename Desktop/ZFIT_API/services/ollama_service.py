@@ -1,191 +1,718 @@
 """
 This file contains functions that involving prompting llama3(LLM) 
+The model is reached through the backend chosen in services/llm_backends.py
 
 Functions include:
--creating a workout plan for the week
+-creating a workout plan for the week, as csv or as json constrained to a schema
+-creating the skeleton of a multi-week mesocycle
 -altering that plan
--finding past exercises that match a provided exercise
+-finding past exercises that match provided exercises
+-generating insights from an exercise's progression summary
 """
-import ollama
-from utils.util import get_dates_list
-from services.supabase_client import supabase
-import pandas as pd
+from utils.util import get_dates_list, rows_from_csv, dump_csv, DEBUG_CSV_DUMP, DEBUG_PAYLOADS, PLAN_HEADER, DAYS_IN_WEEK
+from processing.program_edits import EDIT_SCHEMA, EDIT_DESCRIPTIONS, parse_simple_edits, apply_edits, workout_date
+from processing.plan_validation import PLAN_SCHEMA, MESOCYCLE_SCHEMA, MIN_EXERCISES_PER_WORKOUT, MAX_SETS_PER_EXERCISE, validate_plan, validate_plan_rows, validate_skeleton, rows_from_plan
+from processing import exercise_index, analytics, set_history
+from services import llm_cache, llm_backends, metrics
+from services.metrics import traced
+from utils import singleflight
 import logging
 import textwrap
 import json
+import time
+import os
+from datetime import datetime
 
-client = ollama.Client()
-model = 'llama3'
+model = llm_backends.MODEL
+EXERCISE_MATCH_BATCH_SIZE = 25 #max number of exercises matched in a single llm call
+MAX_PLAN_REPAIRS = 2 #times missing or invalid days are regenerated
+PLAN_OPTIONS = {'temperature':0,'seed':42} #the same user details always produce the same plan
+NUM_CTX = int(os.getenv('ZFIT_LLM_NUM_CTX', '4096')) #context size of every call, ollama reloads the model whenever it changes so it is not set per call type
+NUM_PREDICT = { #max tokens the model writes for each call type
+    'plan':2048,
+    'mesocycle':512,
+    'match_batch':1024,
+    'edits':512,
+    'insights':512,
+    'warm_up':1
+}
+
+#static instructions are sent as system prompts ahead of the request data so ollama can reuse their cached prefix between calls
+PLAN_CSV_SYSTEM = textwrap.dedent(
+    f"""
+        You are an expert exercise scientist that creates workout plans. 
+        The output must be in csv format and include the header at the top of the output: {','.join(PLAN_HEADER)} 
+        title is the name of the workout, date is when the workout takes place.
+        musclegroups must have exactly one muscle trained in the exercise.
+        exercise is the name of the exercise. sets is the number of sets the exercise should be performed.
+        An example of a row in the csv is: Workout Title,YYYY-MM-DD,musclegroup,exercise,sets.
+        Output requirements:
+        - Choose exercises for the workouts based on user details
+        - Only one workout can be performed each day
+        - Each line in the csv represents an exercise in a workout
+        - Each of the user's dates must have its own workout (required).
+        - Each workout must have at least 3 different exercises (required). 
+        Do not output any explanation, context, or anything that isn't the csv or header
+    """
+)
+PLAN_SYSTEM = textwrap.dedent(
+    f"""
+        You are an expert exercise scientist that creates workout plans. 
+        The output must be a json object with a list of workouts. Each workout has a title, a date(YYYY-MM-DD) and a list of exercises.
+        Each exercise has the musclegroup it trains(exactly one muscle), the name of the exercise and the number of sets(an integer from 1 to {MAX_SETS_PER_EXERCISE}).
+        Output requirements:
+        - Choose exercises for the workouts based on user details
+        - Each of the user's dates must have exactly one workout (required).
+        - Each workout must have at least {MIN_EXERCISES_PER_WORKOUT} different exercises (required).
+    """
+)
+MESOCYCLE_SYSTEM = textwrap.dedent(
+    """
+        You are an expert exercise scientist that plans training blocks. 
+        The output must be a json object with:
+        - split: one workout for each of the user's training days, with the day, a title and the musclegroups it trains. The split is repeated every week.
+        - weeks: exactly one item for each week of the block in order, each with a short focus for that week(e.g. volume, intensity, deload).
+        Do not choose exercises, sets, lbs or reps.
+    """
+)
+MATCH_BATCH_SYSTEM = textwrap.dedent(
+    """
+        For each exercise to match, select exactly one exercise from the list of past exercises that is most comparable to it based only on similarity of typical weight lifted.
+        - Ignore muscle groups, movement patterns, or equipment differences.
+        - Each selected exercise must be copied exactly from the list of past exercises, with the exact capitalization.
+        - The output must be a json object where each key is an exercise to match and each value is the selected past exercise.
+        - Example output: {"Incline Bench Press": "Bench Press", "Goblet Squat": "Squat"}
+        - Do not output any explanation, context, or anything that isn't the json object.
+    """
+)
+EDIT_SYSTEM = textwrap.dedent(
+    """
+        You convert requested changes to a workout program into a list of edits. The available edit operations are:
+        {edit_descriptions}
+        - exercise must be copied exactly from the program.
+        - Only include the edits needed to perform the changes.
+    """
+).format(edit_descriptions=EDIT_DESCRIPTIONS)
+INSIGHTS_SYSTEM = textwrap.dedent(
+    """
+        You are a professional fitness trainer who is given a summary of a client's progress on an exercise.
+        The estimated 1RM uses the Epley formula, volume is lbs times reps, a rep PR is more reps than ever before at a weight
+        and a PR is a new best estimated 1RM.
+        1. Explain the trends in the user's lifting numbers (how has the weight and reps changed?).
+        2. Suggest the optimal lbs and reps the user should aim for in their **next session** based on past performance.
+        3. Provide actionable advice on how to safely increase lbs and reps over time for the exercise(progression strategies, tips for improvement, etc.). If the exercise has plateaued, suggest how to break through it.
+
+        Output format:  
+        - Use numbered recommendations (1, 2, 3).  
+        - Do not include anything other than the recommendations.  
+        - Keep it concise, actionable, and easy to understand.
+    """
+)
 
 logging.basicConfig(level=logging.INFO)
+backend = llm_backends.create_backend() #ollama, or the stub when benchmarking without a model
 
-def generate_plan(age, level, gender, goal, dates, equipment_available, startdate):
+def call_options(call_type, **options):
     """
-    Creates csv file containing a workout plan for the week given user inputs
+    Gets the generation options for a call type
+
+    Args:
+        call_type(str): key of NUM_PREDICT
+        options: other options such as temperature or seed
+
+    Returns:
+        dict containing the context size, the max tokens written and the other options
+    """
+    return {'num_ctx':NUM_CTX,'num_predict':NUM_PREDICT[call_type],**options}
+
+def user_details(age, level, gender, goal, equipment_available):
+    """
+    Describes the user for the request part of a prompt
 
     Args:
         age(str): the age of the user
         level(str): experience level in the gym: beginner, intermediate, expert
+        gender(str): the gender of the user
         goal(str): focus of the workouts
-        dates(list[str]): contains all the days from Monday-Sunday to create a workout for
         equipment_available(list[str]): contains all the gym equipment the user has at their disposal
-        startdate(str): the first day('YYYY-MM-DD') of the week workout plan 
 
     Returns:
-        string containing the workout plan in csv format
+        string containing the user details
     """
-    dates_list = get_dates_list(startdate, dates)  # list of dates('YYYY-MM-DD') to generate workouts for
-    prompt = textwrap.dedent(
+    return textwrap.dedent(
         f"""
-            You are an expert exercise scientist that creates workout plans. 
             User details:
             - The user is a {age} year old {gender} who is a {level} lifter
             - Their goal is: {goal}
             - They only have access to the following equipment: {equipment_available}
-            The output must be in csv format and include the header at the top of the output: title,date,musclegroups,exercise,sets 
-            title is the name of the workout, date is when the workout takes place.
-            musclegroups must have exactly one muscle trained in the exercise.
-            exercise is the name of the exercise. sets is the number of sets the exercise should be performed.
-            An example of a row in the csv is: Workout Title,YYYY-MM-DD,musclegroup,exercise,sets.
-            Output requirements:
-            - Choose exercises for the workouts based on user details
-            - Only one workout can be performed each day
-            - Each line in the csv represents an exercise in a workout
-            - Each date in {dates_list} must have its own workout (required).
-            - Each workout must have at least 3 different exercises (required). 
-            Do not output any explanation, context, or anything that isn't the csv or header
         """
     )
-    try:    
-        csv_string = client.generate(model=model, prompt=prompt).response # a string with the csv workout plan
-        with open('data/unfiltered_program.csv', 'w') as f:  
-            f.write(csv_string)
-        logging.info('Workout plan successfully generated and added to csv file!')
-        return csv_string
-    except Exception as e:
-        logging.error(f'Failed to generate a workout plan or write to csv: {e}')
-        return None
 
-def find_closest_exercise(exercise):
+@traced
+def warm_up(system=PLAN_SYSTEM):
     """
-    Finds the exercise from past workouts that is most similar to the provided exercise
+    Loads the model and caches the plan system prompt before the first request so it does not wait for a cold load
 
     Args:
-        exercise(str): the name of the exercise we want to find closest exercise for
+        system(str): system prompt of the plans the api generates, PLAN_CSV_SYSTEM or PLAN_SYSTEM
 
     Returns:
-        string containing the most similar past exercise to parameter exercise
+        True if the model answered, False otherwise
     """
+    start = time.perf_counter()
+    target = backend.backend if isinstance(backend, llm_backends.RecordingBackend) else backend #the warm up response is not worth replaying
     try:
-        response = supabase.table('set').select('*').execute()
-        if not response.data:
-            logging.warning("There are no past exercises in the database")
-            raise ValueError("No past exercises available")
-        df = pd.DataFrame.from_dict(response.data)
-        past_exercises = df['exercise'].drop_duplicates().tolist() #list of unique exercise names
-        prompt = textwrap.dedent(
-            f"""The list of past exercises is: {past_exercises}.
-                Select exactly one exercise from this list that is most comparable to "{exercise}" based only on similarity of typical weight lifted.
-                - Ignore muscle groups, movement patterns, or equipment differences.
-                - Return only the exercise name, copied exactly from the list.
-                - The output must be exactly one of the items from {past_exercises}, with the exact capitalization.
-                - Do not add anything else. No commas, quotes, or extra text.
-                - Example output: Bench Press
-            """
-        )
-        response = client.generate(model=model, prompt=prompt).response
-        logging.info(f'The most similar past exercise: {response}')
+        target.generate(model, 'Reply with OK', system=system, options=call_options('warm_up'))
+    except Exception as e:
+        logging.error(f'Failed to warm up {model}: {e}')
+        return False
+    logging.info(f'{model} warmed up in {time.perf_counter()-start:.1f}s')
+    return True
+
+@traced
+def generate(prompt, tags=(), ttl=None, is_valid=None, **kwargs):
+    """
+    Sends a prompt to the model, reusing the cached response for identical calls and sharing the response of an identical call in flight
+
+    Args:
+        prompt(str): the prompt sent to the model
+        tags(tuple[str]): llm cache tags used to invalidate the response
+        ttl(int): seconds the response is cached, the llm cache default if not provided
+        is_valid(function): returns whether a response can be cached, every response is cached if not provided
+        kwargs: other generation arguments such as format or options
+
+    Returns:
+        string containing the model's response
+    """
+    key = llm_cache.cache_key(model, prompt, **kwargs)
+    response = llm_cache.get(key)
+    if response is not None:
+        metrics.record_llm_call(cached=True)
         return response
+
+    def call_llm():
+        start = time.perf_counter()
+        result = backend.generate(model, prompt, **kwargs)
+        metrics.record_llm_call(result.prompt_eval_count or 0, result.eval_count or 0, time.perf_counter()-start)
+        if is_valid is None or is_valid(result.response): #an invalid response would be replayed to every identical call until it expires
+            llm_cache.put(key, result.response, tags, ttl)
+        return result.response
+    return singleflight.do('llm', key, call_llm)
+
+@traced
+def generate_stream(prompt, tags=(), ttl=None, is_valid=None, **kwargs):
+    """
+    Sends a prompt to the model and yields the response as it is written.
+    A cached response is yielded all at once and a completed stream is added to the cache.
+    While an identical stream is in flight the caller waits for it and gets its whole response at once.
+
+    Args:
+        prompt(str): the prompt sent to the model
+        tags(tuple[str]): llm cache tags used to invalidate the response
+        ttl(int): seconds the response is cached, the llm cache default if not provided
+        is_valid(function): returns whether a completed response can be cached, every response is cached if not provided
+        kwargs: other generation arguments such as format or options
+
+    Yields:
+        string containing the next part of the model's response
+    """
+    key = llm_cache.cache_key(model, prompt, **kwargs)
+    response = llm_cache.get(key)
+    if response is not None:
+        metrics.record_llm_call(cached=True)
+        yield response
+        return
+    flight, is_leader = singleflight.begin('llm', key)
+    if not is_leader:
+        try:
+            yield singleflight.wait(flight)
+            return
+        except Exception as e:
+            logging.warning(f'The identical llm call failed, calling the llm again: {e}')
+    parts, error = [], None
+    start = time.perf_counter()
+    try:
+        for chunk in backend.generate(model, prompt, stream=True, **kwargs):
+            parts.append(chunk.response)
+            yield chunk.response
+            if chunk.done: #the last chunk has the token counts
+                metrics.record_llm_call(chunk.prompt_eval_count or 0, chunk.eval_count or 0, time.perf_counter()-start)
+        if is_valid is None or is_valid(''.join(parts)):
+            llm_cache.put(key, ''.join(parts), tags, ttl)
+    except BaseException as e: #includes the client disconnecting before the stream finished
+        error = e if isinstance(e, Exception) else RuntimeError('The llm call was stopped before it finished')
+        raise
+    finally:
+        if is_leader:
+            singleflight.land('llm', key, flight, None if error else ''.join(parts), error)
+
+def plan_prompt(age, level, gender, goal, dates, equipment_available, startdate):
+    """
+    Creates the prompt asking for a week workout plan in csv format
+
+    Args:
+        age(str): the age of the user
+        level(str): experience level in the gym: beginner, intermediate, expert
+        goal(str): focus of the workouts
+        dates(list[str]): contains all the days from Monday-Sunday to create a workout for
+        equipment_available(list[str]): contains all the gym equipment the user has at their disposal
+        startdate(str): the first day('YYYY-MM-DD') of the week workout plan 
+
+    Returns:
+        string containing the prompt sent after PLAN_CSV_SYSTEM
+    """
+    dates_list = get_dates_list(startdate, dates)  # list of dates('YYYY-MM-DD') to generate workouts for
+    prompt = user_details(age, level, gender, goal, equipment_available) + f'Create a workout for each of these dates: {dates_list}\n'
+    return prompt
+
+def is_valid_csv_plan(dates_list):
+    """
+    Creates the check deciding whether a csv plan response is cached
+
+    Args:
+        dates_list(list[str]): dates('YYYY-MM-DD') the plan was asked for
+
+    Returns:
+        function returning True if a response has a valid workout for every date, False otherwise
+    """
+    def is_valid(response):
+        problems = {} #date -> why its workout was rejected
+        for _ in validate_plan_rows(rows_from_csv(response.splitlines()), dates_list, problems=problems):
+            pass
+        return not problems
+    return is_valid
+
+@traced
+def generate_plan_stream(age, level, gender, goal, dates, equipment_available, startdate):
+    """
+    Creates a workout plan in csv format for the week given user inputs, yielding each line as the llm writes it
+
+    Args:
+        age(str): the age of the user
+        level(str): experience level in the gym: beginner, intermediate, expert
+        goal(str): focus of the workouts
+        dates(list[str]): contains all the days from Monday-Sunday to create a workout for
+        equipment_available(list[str]): contains all the gym equipment the user has at their disposal
+        startdate(str): the first day('YYYY-MM-DD') of the week workout plan 
+
+    Yields:
+        string containing one line of the workout plan in csv format
+    """
+    prompt = plan_prompt(age, level, gender, goal, dates, equipment_available, startdate)
+    lines = [] #every line generated, kept for the debug csv
+    partial_line = '' #text received after the last newline
+    try:
+        is_valid = is_valid_csv_plan(get_dates_list(startdate, dates))
+        for text in generate_stream(prompt, is_valid=is_valid, system=PLAN_CSV_SYSTEM, options=call_options('plan')):
+            partial_line += text
+            *complete_lines, partial_line = partial_line.split('\n')
+            for line in complete_lines:
+                lines.append(line)
+                yield line
+        if partial_line:
+            lines.append(partial_line)
+            yield partial_line
+        logging.info('Workout plan successfully generated!')
     except Exception as e:
-        logging.error(f'Could not find the closest exercise: {e}')
+        logging.error(f'Failed to generate a workout plan: {e}')
+    if DEBUG_CSV_DUMP:
+        with open('data/unfiltered_program.csv', 'w') as f:
+            f.write('\n'.join(lines))
+
+def structured_plan_prompt(age, level, gender, goal, equipment_available, dates_list, planned_exercises=(), week_instructions='', problems=None):
+    """
+    Creates the prompt asking for workouts on specific dates as json following PLAN_SCHEMA
+
+    Args:
+        age(str): the age of the user
+        level(str): experience level in the gym: beginner, intermediate, expert
+        goal(str): focus of the workouts
+        equipment_available(list[str]): contains all the gym equipment the user has at their disposal
+        dates_list(list[str]): dates('YYYY-MM-DD') that need a workout
+        planned_exercises(list[str]): exercises already planned on other days of the week
+        week_instructions(str): instructions for this week of a mesocycle from mesocycle_week_instructions
+        problems(dict): date -> why the previous attempt's workout on that date was rejected
+
+    Returns:
+        string containing the prompt sent after PLAN_SYSTEM
+    """
+    prompt = user_details(age, level, gender, goal, equipment_available) + f'Create a workout for each of these dates: {dates_list}\n'
+    if planned_exercises:
+        prompt += f'The rest of the week already contains these exercises, balance the new workouts around them: {list(planned_exercises)}\n'
+    if week_instructions:
+        prompt += week_instructions
+    if problems:
+        prompt += f"A previous attempt was rejected because the workout on {'; '.join(f'{workout_date} {problem}' for workout_date, problem in problems.items())}. Every workout needs at least {MIN_EXERCISES_PER_WORKOUT} different exercises.\n"
+    return prompt
+
+def is_valid_plan(dates_list):
+    """
+    Creates the check deciding whether a structured plan response is cached
+
+    Args:
+        dates_list(list[str]): dates('YYYY-MM-DD') the plan was asked for
+
+    Returns:
+        function returning True if a response has a valid workout for every date, False otherwise
+    """
+    def is_valid(response):
+        try:
+            return not validate_plan(json.loads(response), dates_list)[1]
+        except Exception:
+            return False
+    return is_valid
+
+def generate_workouts(age, level, gender, goal, equipment_available, dates_list, valid_workouts, week_instructions='', problems=None, attempts=MAX_PLAN_REPAIRS+1):
+    """
+    Generates structured workouts for the dates without a valid workout, regenerating only the dates that are still missing or invalid
+
+    Args:
+        age(str): the age of the user
+        level(str): experience level in the gym: beginner, intermediate, expert
+        goal(str): focus of the workouts
+        equipment_available(list[str]): contains all the gym equipment the user has at their disposal
+        dates_list(list[str]): dates('YYYY-MM-DD') that need a workout
+        valid_workouts(dict): date -> validated workout, the new workouts are added to it
+        week_instructions(str): instructions for this week of a mesocycle from mesocycle_week_instructions
+        problems(dict): date -> why an earlier attempt's workout was rejected
+        attempts(int): calls made before giving up on the remaining dates
+
+    Returns:
+        list of the dates that still have no valid workout
+    """
+    invalid_dates = [workout_date for workout_date in dates_list if workout_date not in valid_workouts]
+    problems = problems or {}
+    for attempt in range(attempts):
+        if not invalid_dates:
+            break
+        planned_exercises = list(dict.fromkeys(exercise['exercise'] for workout in valid_workouts.values() for exercise in workout['exercises']))
+        prompt = structured_plan_prompt(age, level, gender, goal, equipment_available, invalid_dates, planned_exercises, week_instructions, problems)
+        options = call_options('plan', **{**PLAN_OPTIONS, 'seed':PLAN_OPTIONS['seed']+attempt}) #a repair must not replay the answer it is repairing
+        try:
+            plan = json.loads(generate(prompt, is_valid=is_valid_plan(invalid_dates), system=PLAN_SYSTEM, format=PLAN_SCHEMA, options=options))
+        except Exception as e:
+            logging.error(f'Failed to generate workouts for {invalid_dates}: {e}')
+            plan = {}
+        problems = {}
+        new_workouts, invalid_dates = validate_plan(plan, invalid_dates, problems)
+        valid_workouts.update(new_workouts)
+        if invalid_dates:
+            logging.warning(f'Workouts for {invalid_dates} are missing or invalid (attempt {attempt+1})')
+    if invalid_dates:
+        logging.error(f'Could not generate valid workouts for {invalid_dates}')
+    return invalid_dates
+
+@traced
+def generate_structured_plan(age, level, gender, goal, dates, equipment_available, startdate, week_instructions=''):
+    """
+    Creates a workout plan for the week as json constrained to PLAN_SCHEMA.
+    Days that are missing or invalid are regenerated on their own instead of regenerating the whole week.
+
+    Args:
+        age(str): the age of the user
+        level(str): experience level in the gym: beginner, intermediate, expert
+        goal(str): focus of the workouts
+        dates(list[str]): contains all the days from Monday-Sunday to create a workout for
+        equipment_available(list[str]): contains all the gym equipment the user has at their disposal
+        startdate(str): the first day('YYYY-MM-DD') of the week workout plan 
+        week_instructions(str): instructions for this week of a mesocycle from mesocycle_week_instructions
+
+    Returns:
+        list[PlanRow] containing the exercises of every valid workout
+    """
+    dates_list = get_dates_list(startdate, dates)  # list of dates('YYYY-MM-DD') to generate workouts for
+    valid_workouts = {} #date -> validated workout
+    generate_workouts(age, level, gender, goal, equipment_available, dates_list, valid_workouts, week_instructions)
+    plan_rows = rows_from_plan(valid_workouts, dates_list)
+    logging.info(f'Workout plan successfully generated with {len(plan_rows)} exercises!')
+    dump_csv('data/unfiltered_program.csv', PLAN_HEADER, plan_rows)
+    return plan_rows
+
+@traced
+def generate_plan_rows(age, level, gender, goal, dates, equipment_available, startdate):
+    """
+    Streams a workout plan in csv format with the same per day validation as generate_structured_plan.
+    Each day's exercises are yielded once the day is valid and the days that were missing or invalid
+    are regenerated as json after the stream ends.
+
+    Args:
+        age(str): the age of the user
+        level(str): experience level in the gym: beginner, intermediate, expert
+        goal(str): focus of the workouts
+        dates(list[str]): contains all the days from Monday-Sunday to create a workout for
+        equipment_available(list[str]): contains all the gym equipment the user has at their disposal
+        startdate(str): the first day('YYYY-MM-DD') of the week workout plan 
+
+    Yields:
+        PlanRow for each exercise of every valid workout
+    """
+    dates_list = get_dates_list(startdate, dates)  # list of dates('YYYY-MM-DD') to generate workouts for
+    valid_workouts, problems = {}, {} #date -> validated workout, date -> why the streamed workout was rejected
+    lines = generate_plan_stream(age, level, gender, goal, dates, equipment_available, startdate)
+    yield from validate_plan_rows(rows_from_csv(lines), dates_list, valid_workouts, problems)
+    if not problems:
+        return
+    streamed_dates = set(valid_workouts)
+    generate_workouts(age, level, gender, goal, equipment_available, dates_list, valid_workouts, problems=problems, attempts=MAX_PLAN_REPAIRS)
+    yield from rows_from_plan({workout_date:workout for workout_date, workout in valid_workouts.items() if workout_date not in streamed_dates}, dates_list)
+
+def mesocycle_skeleton_prompt(age, level, gender, goal, days, equipment_available, weeks):
+    """
+    Creates the prompt asking for the split and weekly focus of a mesocycle as json following MESOCYCLE_SCHEMA
+
+    Args:
+        age(str): the age of the user
+        level(str): experience level in the gym: beginner, intermediate, expert
+        goal(str): focus of the workouts
+        days(list[str]): days(Monday-Sunday) the user trains
+        equipment_available(list[str]): contains all the gym equipment the user has at their disposal
+        weeks(int): number of weeks in the mesocycle
+
+    Returns:
+        string containing the prompt sent after MESOCYCLE_SYSTEM
+    """
+    return user_details(age, level, gender, goal, equipment_available) + f'Plan a {weeks} week training block for these training days: {days}\n'
+
+@traced
+def generate_mesocycle_skeleton(age, level, gender, goal, days, equipment_available, weeks):
+    """
+    Creates the split and weekly focus shared by every week of a mesocycle
+
+    Args:
+        age(str): the age of the user
+        level(str): experience level in the gym: beginner, intermediate, expert
+        goal(str): focus of the workouts
+        days(list[str]): days(Monday-Sunday) the user trains
+        equipment_available(list[str]): contains all the gym equipment the user has at their disposal
+        weeks(int): number of weeks in the mesocycle
+
+    Returns:
+        tuple of the split(dict mapping each training day to its title and musclegroups) and the focus of every week,
+        an empty split and focuses if the skeleton could not be generated
+    """
+    prompt = mesocycle_skeleton_prompt(age, level, gender, goal, days, equipment_available, weeks)
+    try:
+        skeleton = json.loads(generate(prompt, system=MESOCYCLE_SYSTEM, format=MESOCYCLE_SCHEMA, options=call_options('mesocycle', **PLAN_OPTIONS)))
+    except Exception as e:
+        logging.error(f'Failed to generate the mesocycle skeleton: {e}')
+        skeleton = {}
+    split, focuses = validate_skeleton(skeleton, days, weeks)
+    logging.info(f'Mesocycle skeleton generated with {len(split)} of {len(days)} training days')
+    return split, focuses
+
+def mesocycle_week_instructions(week, weeks, focus, split, dates_list):
+    """
+    Creates the part of the plan prompt that ties a week to its mesocycle
+
+    Args:
+        week(int): number of the week, starting at 1
+        weeks(int): number of weeks in the mesocycle
+        focus(str): focus of the week from the skeleton
+        split(dict): training day -> title and musclegroups from the skeleton
+        dates_list(list[str]): dates('YYYY-MM-DD') of the week's workouts
+
+    Returns:
+        string containing the instructions
+    """
+    instructions = f'This is week {week} of a {weeks} week training block.'
+    if focus:
+        instructions += f' The focus of this week is: {focus}.'
+    workouts = []
+    for day_date in dates_list:
+        day = DAYS_IN_WEEK[datetime.strptime(day_date, '%Y-%m-%d').weekday()]
+        if day in split:
+            workouts.append(f"{day_date}: {split[day]['title']}({', '.join(split[day]['musclegroups'])})")
+    if workouts:
+        instructions += f" Follow this split: {'; '.join(workouts)}."
+    return instructions + ' Keep the main exercises the same every week so they can be progressed.\n'
+
+@traced
+def get_past_exercises():
+    """
+    Finds every unique exercise name the user has performed in past sets.
+    The names come from the user's set history, which concurrent calls load only once.
+
+    Returns:
+        list[str] of unique past exercise names, None if they could not be retrieved
+    """
+    if not set_history.ensure_warm():
+        logging.error('Could not retrieve past exercises')
         return None
+    past_exercises = set_history.exercise_names()
+    if not past_exercises:
+        logging.warning("There are no past exercises in the database")
+    return past_exercises
+
+@traced
+def get_exercise_vocabulary(past_exercises=None):
+    """
+    Gets the past exercise names to match against, rebuilding the exercise index when it is empty or stale
+
+    Args:
+        past_exercises(list[str]): unique past exercise names, fetched from the database if not provided and the index is stale
+
+    Returns:
+        list[str] of past exercise names
+    """
+    if exercise_index.is_stale():
+        if past_exercises is None:
+            past_exercises = get_past_exercises()
+        if past_exercises:
+            exercise_index.rebuild(past_exercises)
+    return past_exercises if past_exercises is not None else exercise_index.exercise_names()
+
+@traced
+def find_closest_exercises(exercises, past_exercises=None):
+    """
+    Finds the most similar past exercise for every provided exercise.
+    Confident matches come from the exercise index and the rest are resolved using as few llm calls as possible.
+
+    Args:
+        exercises(list[str]): names of the exercises we want to find closest exercises for
+        past_exercises(list[str]): unique past exercise names, fetched from the database if not provided
+
+    Returns:
+        dict mapping each exercise to its most similar past exercise, None when no match was found
+    """
+    matches = {exercise:None for exercise in exercises}
+    past_exercises = get_exercise_vocabulary(past_exercises)
+    if not past_exercises:
+        logging.warning('No past exercises available to match against')
+        return matches
+    unique_exercises = list(matches.keys())
+    nearest_exercises = dict(zip(unique_exercises, exercise_index.lookup(unique_exercises))) #exercise -> (nearest past exercise, similarity)
+    unresolved_exercises = [] #exercises the index is not confident about
+    for exercise, (nearest_exercise, similarity) in nearest_exercises.items():
+        if nearest_exercise is not None and similarity >= exercise_index.SIMILARITY_THRESHOLD:
+            matches[exercise] = nearest_exercise
+        else:
+            unresolved_exercises.append(exercise)
+    logging.info(f'{len(unique_exercises)-len(unresolved_exercises)} of {len(unique_exercises)} exercises matched by the index')
+    canonical_names = {name.lower():name for name in past_exercises} #lets us restore the exact capitalization from the list
+    for i in range(0, len(unresolved_exercises), EXERCISE_MATCH_BATCH_SIZE):
+        batch = unresolved_exercises[i:i+EXERCISE_MATCH_BATCH_SIZE]
+        prompt = f'The list of past exercises is: {past_exercises}.\nExercises to match: {batch}\n' #past exercises first, they are the same for every batch
+        try:
+            response = generate(prompt, system=MATCH_BATCH_SYSTEM, format='json', options=call_options('match_batch'))
+            batch_matches = json.loads(response)
+            if DEBUG_PAYLOADS:
+                logging.info(f'The most similar past exercises: {batch_matches}')
+        except Exception as e:
+            logging.error(f'Could not find the closest exercises for {batch}: {e}')
+            batch_matches = {}
+        for exercise in batch:
+            closest_exercise = batch_matches.get(exercise)
+            if isinstance(closest_exercise, str) and closest_exercise.strip().lower() in canonical_names:
+                matches[exercise] = canonical_names[closest_exercise.strip().lower()]
+            else: #the llm skipped the exercise or answered with a name outside the list
+                matches[exercise] = nearest_exercises[exercise][0]
+    return matches
+
+
+def program_summary(program):
+    """
+    Summarizes a program in a compact form the llm can reference when writing edits
 
+    Args:
+        program(list[dict]): list containing workouts and their info
+
+    Returns:
+        string with one line per exercise in each workout
+    """
+    lines = []
+    for workout in program:
+        lines.append(f"{workout_date(workout)} {workout.get('title','')}:")
+        exercises = {}
+        for workout_set in workout.get('sets', []):
+            exercises.setdefault(workout_set['exercise'], []).append(f"{workout_set['lbs']}x{workout_set['reps']}")
+        for exercise, sets in exercises.items():
+            lines.append(f"- {exercise}: {', '.join(sets)} (lbs x reps per set)")
+    return '\n'.join(lines)
 
+@traced
 def alter_program(past_program, changes):
     """
-    Alters the generated program with requested changes
+    Alters the generated program with requested changes.
+    Common changes are parsed without the llm, otherwise the llm returns a list of edits that are applied locally.
 
     Args:
         past_program(list[dict]): list containing workouts and their info
         changes(str): the changes to be made to the program
 
     Returns:
-        return(list): list containing altered workouts, empty list otherwise
-    """
-    prompt = textwrap.dedent(
-            f"""
-                {past_program} is a list where each item represents a workout. The list has the structure:
-                [{{
-                    date: day the workout took place in the form YYYY-MM-DD,
-                    musclegroups:list of muscle groups trained in the workout,
-                    sets:{{
-                        exercise: name of the exercise performed,
-                        set_num: the set number of the exercise ** set_num must be an integer**,
-                        lbs:number of lbs lifted for set set_num of the exercise ** lbs must be an integer**,
-                        reps:number of repetitions performed in set set_num for the exercise  ** reps must be an integer**
-                    }}[],
-                    title:name of the workout,
-                }},...]
-                Perform the changes {changes} on the list.
-                Output must only contain {past_program} with the changes applied in valid json format. 
-                No explanations, commentary, or extra text. Ensure the output is strictly valid JSON with double quotes only.
-            """
-        )
+        return(list): list containing altered workouts, the original program if no change could be applied
+    """
+    edits = parse_simple_edits(changes, past_program)
+    if edits is not None:
+        logging.info(f'Parsed {len(edits)} edits without the llm' + (f': {edits}' if DEBUG_PAYLOADS else ''))
+    else:
+        prompt = f'This is a workout program:\n{program_summary(past_program)}\nConvert the changes "{changes}" into a list of edits.\n'
+        try:
+            edits = json.loads(generate(prompt, system=EDIT_SYSTEM, format=EDIT_SCHEMA, options=call_options('edits'))).get('edits', [])
+            logging.info(f'The llm returned {len(edits)} edits' + (f': {edits}' if DEBUG_PAYLOADS else ''))
+        except Exception as e:
+            logging.error(f'Failed to alter program: {e}')
+            return past_program
+    altered_program, applied_edits = apply_edits(past_program, edits)
+    if len(applied_edits) < len(edits):
+        logging.warning(f'Applied {len(applied_edits)} of {len(edits)} edits')
+    return altered_program
+
+def insights_prompt(exercise, summary):
+    """
+    Creates the prompt asking for actionable insights for an exercise
+
+    Args:
+        exercise(str)- name of exercise we want insights for
+        summary(str)- progression summary of the exercise from analytics.feature_summary
+
+    Returns:
+        string containing the prompt sent after INSIGHTS_SYSTEM
+    """
+    prompt = f'Exercise: {exercise}\nProgress summary:\n{summary}\n'
+    return prompt
+
+def insights_summary(exercise, window=None, cursor=None):
+    """
+    Gets the progression summary sent to the llm for insights
+
+    Args:
+        exercise(str)- name of exercise we want insights for
+        window(int)- number of recent sessions the trends are computed over, analytics.TREND_SESSIONS if not provided
+        cursor(str)- only analyze workouts before the date of this history cursor
+
+    Returns:
+        string containing the summary, None if the history could not be analyzed
+    """
     try:
-        response = client.generate(model=model, prompt=prompt).response
-        first_bracket_index = response.find('[') #index of workout list start
-        last_bracket_index = response.rfind(']') #index of workout list end
-        just_workout = response[first_bracket_index:last_bracket_index+1] #contains just the workout list as a string
-        logging.info(f'The altered program: {just_workout}')
-        return json.loads(just_workout)
-    except Exception as e:
-        logging.error(f'Failed to alter program: {e}')
-        return []
+        before = datetime.strptime(cursor.split('_',1)[0], '%Y-%m-%d').date().isoformat() if cursor else None
+    except ValueError as e:
+        logging.error(f'Invalid history cursor {cursor}: {e}')
+        return None
+    features = analytics.exercise_features(exercise, window or analytics.TREND_SESSIONS, before)
+    return None if features is None else analytics.feature_summary(features)
 
-def generate_insights(exercise):
+@traced
+def generate_insights_stream(exercise, window=None, cursor=None):
     """
-    Generates actionable insights for a given exercise
+    Generates actionable insights for a given exercise, yielding the text as the llm writes it
 
     Args:
         exercise(str)- name of exercise we want insights for
-    
-    Returns:
-        String containing the actionable insights to be displayed
-    """
-    from processing.workout_processing import get_past_exercise_data
-    past_exercise_data = get_past_exercise_data(exercise)
-    if past_exercise_data is None:
-        return f'Error generating insights for {exercise}'
-    prompt = f"""
-                You are a professional fitness trainer who is given the past exercise history of a client.
-                The client's past exercise history is a list with the following format.
-                [
-                    {{
-                        "date": "YYYY-MM-DD",   # The date that the user performed the exercise
-                        "set": [
-                            {{
-                                "lbs": int or float,        # How many lbs the user lifted for this set
-                                "reps": int or float,       # How many repetitions were performed for this set
-                                "set_num": int or float     # The set number in the workout on that date
-                            }},
-                            ...
-                        ]  # "set" is a list containing all sets for the exercise on that date
-                    }},
-                    ...
-                ]
-                Here is the client's past history: {past_exercise_data}
-                1. Analyze trends in the user's lifting numbers across sessions (how has the weight and reps changed?).
-                2. Suggest the optimal lbs and reps the user should aim for in their **next session** based on past performance.
-                3. Provide actionable advice on how to safely increase lbs and reps over time for {exercise}(progression strategies, tips for improvement, etc.).
-
-                Output format:  
-                - Use numbered recommendations (1, 2, 3).  
-                - Do not include anything other than the recommendations.  
-                - Keep it concise, actionable, and easy to understand.
-            """
+        window(int)- number of recent sessions the trends are computed over, analytics.TREND_SESSIONS if not provided
+        cursor(str)- only analyze workouts before the date of this history cursor
+
+    Yields:
+        String containing the next part of the actionable insights
+    """
+    summary = insights_summary(exercise, window, cursor)
+    if summary is None:
+        yield f'Error generating insights for {exercise}'
+        return
+    prompt = insights_prompt(exercise, summary)
     try:
-        response = client.generate(model=model, prompt=prompt).response
-        return response
+        for text in generate_stream(prompt, tags=(llm_cache.insights_tag(exercise),), system=INSIGHTS_SYSTEM, options=call_options('insights')):
+            if text:
+                yield text
     except Exception as e:
         logging.error(f'Failed to generate actionable insights: {e}')
-        return []
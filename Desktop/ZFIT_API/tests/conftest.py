@@ -0,0 +1,144 @@
+"""
+This file contains the fixtures shared by the tests
+
+The supabase client is replaced with an in-memory fake before any module under test imports it, so the tests
+never touch the network. The fake only supports the query builder calls the code under test makes.
+"""
+import os
+import re
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MAX_ROWS = 1000 #postgrest's default max-rows, applied to every select like the real api
+
+class FakeResponse:
+    """
+    Response of an executed query
+    """
+    def __init__(self, data):
+        self.data = data
+
+class FakeQuery:
+    """
+    Select query on a table of FakeDatabase
+    """
+    def __init__(self, database, table):
+        self.database, self.table = database, table
+        self.filters, self.embedded_filters, self.orders = [], [], []
+        self.start, self.end = 0, None
+        self.action, self.payload = 'select', None
+
+    def select(self, *columns):
+        return self
+
+    def insert(self, rows):
+        self.action, self.payload = 'insert', rows if isinstance(rows, list) else [rows]
+        return self
+
+    def delete(self):
+        self.action = 'delete'
+        return self
+
+    def in_(self, column, values):
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def eq(self, column, value):
+        if '.' in column: #filter on an embedded table, e.g. set.exercise with set!inner
+            embedded, embedded_column = column.split('.', 1)
+            self.embedded_filters.append((embedded, embedded_column, value))
+        else:
+            self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: row[column] < value)
+        return self
+
+    def or_(self, condition):
+        match = re.fullmatch(r'date\.lt\.([^,]+),and\(date\.eq\.([^,]+),id\.lt\.([^)]+)\)', condition) #the only or_ the api sends
+        assert match, f'Unsupported or_ condition {condition}'
+        before, on, id_before = match.groups()
+        self.filters.append(lambda row: row['date'] < before or (row['date'] == on and row['id'] < int(id_before)))
+        return self
+
+    def order(self, column, desc=False):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self.end = self.start + count
+        return self
+
+    def range(self, start, end):
+        self.start, self.end = start, end+1
+        return self
+
+    def _join(self, row):
+        """
+        Keeps only the embedded rows matching the embedded filters, None if none match(an inner join)
+        """
+        row = dict(row)
+        for embedded, column, value in self.embedded_filters:
+            row[embedded] = [embedded_row for embedded_row in row.get(embedded, []) if embedded_row.get(column) == value]
+            if not row[embedded]:
+                return None
+        return row
+
+    def execute(self):
+        self.database.calls.append((self.table, self.action))
+        table = self.database.tables.setdefault(self.table, [])
+        if self.action == 'insert':
+            if self.table in self.database.failing_inserts:
+                raise ConnectionError(f'Insert into {self.table} failed')
+            inserted = []
+            for row in self.payload:
+                row = dict(row)
+                if self.table == 'workout':
+                    self.database.last_id += 1
+                    row['id'] = self.database.last_id
+                table.append(row)
+                inserted.append(row)
+            return FakeResponse(inserted[:len(inserted)-self.database.short_inserts.get(self.table, 0)]) #short_inserts fakes responses missing rows
+        if self.action == 'delete':
+            deleted = [row for row in table if all(keep(row) for keep in self.filters)]
+            table[:] = [row for row in table if row not in deleted]
+            return FakeResponse(deleted)
+        rows = [self._join(row) for row in self.database.tables.get(self.table, []) if all(keep(row) for keep in self.filters)]
+        rows = [row for row in rows if row is not None]
+        for column, desc in reversed(self.orders): #stable sorts, the first order is applied last so it wins
+            rows.sort(key=lambda row: row[column], reverse=desc)
+        end = self.start + MAX_ROWS if self.end is None else min(self.end, self.start + MAX_ROWS)
+        return FakeResponse(rows[self.start:end])
+
+class FakeDatabase:
+    """
+    In-memory tables standing in for the supabase client
+    """
+    def __init__(self):
+        self.tables, self.calls = {}, []
+        self.last_id = 0
+        self.failing_inserts = set() #tables whose inserts raise
+        self.short_inserts = {} #table -> rows left out of each insert's response
+
+    def table(self, table):
+        return FakeQuery(self, table)
+
+fake_database = FakeDatabase()
+
+from services import supabase_client #importing it never touches the network
+supabase_client.get_supabase = lambda: fake_database #replaced before the modules under test import them
+supabase_client.current_user_id = lambda: 'test-user'
+
+@pytest.fixture
+def database():
+    """
+    Empties the fake database before a test
+
+    Returns:
+        the FakeDatabase the code under test reads
+    """
+    fake_database.__init__()
+    return fake_database
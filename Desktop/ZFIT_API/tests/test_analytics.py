@@ -0,0 +1,57 @@
+from processing import analytics, set_history
+import pytest
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    set_history._histories.clear()
+    analytics._sessions_cache.clear()
+
+def saved_sets(exercise, *sessions):
+    """
+    Creates saved sets with one workout per (date, [(lbs, reps), ...]) session
+    """
+    return [
+        {'id':workout,'exercise':exercise,'set_num':set_num+1,'lbs':lbs,'reps':reps,'workout':{'date':workout_date}}
+        for workout, (workout_date, sets) in enumerate(sessions, 1)
+        for set_num, (lbs, reps) in enumerate(sets)
+    ]
+
+def test_progression_features(database):
+    database.tables['set'] = saved_sets('Bench Press',
+        ('2025-01-06', [(135, 5), (135, 8)]),
+        ('2025-01-13', [(145, 5), (135, 10)]),
+        ('2025-01-20', [(155, 5)]),
+        ('2025-02-03', [(165, 5)]) #planned, not done yet
+    )
+    features = analytics.exercise_features('Bench Press', before='2025-02-01')
+    assert features['metric'] == 'estimated_1rm' and features['session_count'] == 3
+    assert [session['top_set'] for session in features['sessions']] == [{'lbs':135,'reps':8}, {'lbs':135,'reps':10}, {'lbs':155,'reps':5}]
+    assert features['best'] == {'date':'2025-01-20','lbs':155,'reps':5,'estimated_1rm':180.8}
+    assert features['rep_prs'] == [{'date':'2025-01-13','lbs':135,'reps':10,'previous_reps':8}]
+    assert features['trend']['slope_per_week'] > 0
+    assert features['plateau'] == {'plateaued':False,'sessions_since_pr':0}
+    assert features['sessions'][1]['volume'] == 145*5+135*10
+
+def test_plateau_and_bodyweight_progression(database):
+    database.tables['set'] = saved_sets('Pull Up', *[(f'2025-01-{day:02d}', [(0, reps)]) for day, reps in ((1, 8), (3, 10), (5, 9), (7, 10), (9, 8), (11, 9))])
+    features = analytics.exercise_features('pull up', before='2025-02-01')
+    assert features['metric'] == 'reps' #bodyweight exercises progress in reps
+    assert features['plateau'] == {'plateaued':True,'sessions_since_pr':4}
+    assert 'Last PR 4 sessions ago (plateaued)' in analytics.feature_summary(features)
+
+def test_sessions_are_recomputed_only_when_sets_change(database, monkeypatch):
+    database.tables['set'] = saved_sets('Squat', ('2025-01-06', [(225, 5)]))
+    computed = []
+    compute_sessions = analytics.compute_sessions
+    monkeypatch.setattr(analytics, 'compute_sessions', lambda rows: computed.append(len(rows)) or compute_sessions(rows))
+    analytics.exercise_features('Squat', before='2025-02-01')
+    analytics.exercise_features('Squat', before='2025-02-01')
+    set_history.record_sets([{'id':2,'exercise':'Squat','lbs':235,'reps':5,'date':'2025-01-13'}])
+    features = analytics.exercise_features('Squat', before='2025-02-01')
+    assert computed == [1, 2]
+    assert features['latest']['lbs'] == 235
+
+def test_exercise_without_sessions(database):
+    features = analytics.exercise_features('Deadlift', before='2025-02-01')
+    assert features['session_count'] == 0
+    assert analytics.feature_summary(features) == 'Deadlift: no past sessions'
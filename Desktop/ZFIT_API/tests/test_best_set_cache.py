@@ -0,0 +1,46 @@
+from processing import best_set_cache, set_history
+from processing.workout_processing import insert_workouts
+import pytest
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    set_history._histories.clear()
+    best_set_cache._caches.clear()
+
+def saved_set(workout, exercise, lbs, reps, workout_date):
+    return {'id':workout,'exercise':exercise,'set_num':1,'lbs':lbs,'reps':reps,'workout':{'date':workout_date}}
+
+def test_aggregates_fold_every_set(database):
+    database.tables['set'] = [
+        saved_set(1, 'Bench Press', 135, 10, '2025-01-01'),
+        saved_set(1, 'Bench Press', 185, 3, '2025-01-01'),
+        saved_set(2, 'bench press', 155, 5, '2025-01-08'),
+        saved_set(2, 'Bench Press', 145, 6, '2025-01-08'),
+        saved_set(2, 'Bench Press', 'heavy', 5, '2025-01-08') #invalid sets are skipped
+    ]
+    assert best_set_cache.ensure_warm()
+    assert best_set_cache.get_aggregate('BENCH PRESS') == {
+        'best_set':{'lbs':135,'reps':10},
+        'last_session':{'date':'2025-01-08','lbs':145,'reps':6}, #the top set of the last session
+        'estimated_1rm':best_set_cache.estimate_one_rep_max(185, 3),
+        'session_count':2
+    }
+    assert best_set_cache.get_aggregate('Squat') is None
+
+def test_inserted_sets_are_folded_without_reloading(database):
+    database.tables['set'] = [saved_set(1, 'Squat', 225, 5, '2025-01-01')]
+    database.last_id = 1 #workout 1 is already saved
+    assert best_set_cache.ensure_warm()
+    assert best_set_cache.get_aggregate('Squat')['session_count'] == 1
+    insert_workouts([{'title':'Legs','date':['2025-01-08'],'musclegroups':['Legs'],'sets':[{'exercise':'Squat','set_num':1,'lbs':245,'reps':5}]}])
+    aggregate = best_set_cache.get_aggregate('Squat')
+    assert (aggregate['best_set'], aggregate['session_count']) == ({'lbs':245,'reps':5}, 2)
+    assert database.calls.count(('set', 'select')) == 1
+
+def test_reloaded_history_rebuilds_the_aggregates(database):
+    database.tables['set'] = [saved_set(1, 'Squat', 225, 5, '2025-01-01')]
+    assert best_set_cache.ensure_warm()
+    assert best_set_cache.get_aggregate('Squat')['best_set'] == {'lbs':225,'reps':5}
+    database.tables['set'] = [saved_set(1, 'Squat', 200, 5, '2025-01-01')] #edited outside the api
+    assert set_history.rebuild()
+    assert best_set_cache.get_aggregate('Squat')['best_set'] == {'lbs':200,'reps':5}
@@ -0,0 +1,34 @@
+from processing import exercise_index
+import pytest
+
+PAST_EXERCISES = ['Bench Press', 'Incline Dumbbell Press', 'Squat', 'Romanian Deadlift', 'Lat Pulldown']
+
+@pytest.fixture(autouse=True)
+def empty_index(monkeypatch, tmp_path):
+    monkeypatch.setattr(exercise_index, 'INDEX_PATH', str(tmp_path/'exercise_index_{}.npz'))
+    exercise_index._indexes.clear()
+
+def test_spelling_differences_are_confident_matches():
+    exercise_index.rebuild(PAST_EXERCISES)
+    assert exercise_index.confident_match('bench-press') == 'Bench Press'
+    assert exercise_index.confident_match('SQUAT') == 'Squat'
+    assert exercise_index.confident_match('Lat Pull Down') is None #close but left to the llm
+    assert exercise_index.confident_match('Cable Fly') is None
+
+def test_lookup_keeps_the_order_of_the_exercises():
+    exercise_index.rebuild(PAST_EXERCISES)
+    matches = exercise_index.lookup(['Romanian Deadlifts', 'Squats'])
+    assert [name for name, _ in matches] == ['Romanian Deadlift', 'Squat']
+    assert all(0 < similarity <= 1.0001 for _, similarity in matches)
+
+def test_empty_index_has_no_matches():
+    assert exercise_index.is_stale()
+    assert exercise_index.lookup(['Squat']) == [(None, 0.0)]
+
+def test_index_is_saved_and_extended():
+    exercise_index.rebuild(PAST_EXERCISES)
+    exercise_index.add_exercises(['bench press', 'Cable Fly']) #bench press is already indexed
+    exercise_index._indexes.clear() #loaded back from disk
+    assert exercise_index.exercise_names() == [*PAST_EXERCISES, 'Cable Fly']
+    assert not exercise_index.is_stale()
+    assert exercise_index.confident_match('cable fly') == 'Cable Fly'
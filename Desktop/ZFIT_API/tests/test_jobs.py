@@ -0,0 +1,51 @@
+from services import jobs
+import threading
+import pytest
+import time
+
+def wait_for(job_id, status):
+    deadline = time.monotonic() + 5
+    while jobs.get_job(job_id)['status'] != status:
+        assert time.monotonic() < deadline, f'job never became {status}'
+        time.sleep(0.001)
+
+def blocking_job(release):
+    def run(progress):
+        progress('waiting')
+        release.wait(5)
+        return 'released'
+    return run
+
+def test_jobs_past_the_queue_depth_are_rejected(monkeypatch):
+    monkeypatch.setattr(jobs, 'MAX_QUEUED_JOBS', 1)
+    release = threading.Event()
+    try:
+        running = [jobs.submit_job('blocking', blocking_job(release)) for _ in range(jobs.MAX_WORKERS)]
+        for job_id in running:
+            wait_for(job_id, 'running')
+        queued = jobs.submit_job('blocking', blocking_job(release))
+        with pytest.raises(jobs.QueueFullError):
+            jobs.submit_job('blocking', blocking_job(release))
+    finally:
+        release.set()
+    for job_id in [*running, queued]:
+        wait_for(job_id, 'done')
+    assert jobs.get_job(queued)['result'] == 'released'
+    assert jobs.submit_job('quick', lambda progress: None) #accepted again once the queue drained
+
+def test_finished_jobs_expire(monkeypatch):
+    job_id = jobs.submit_job('quick', lambda progress: 'result')
+    wait_for(job_id, 'done')
+    monkeypatch.setattr(jobs, 'JOB_TTL_SECONDS', -1)
+    assert jobs.get_job(job_id) is None
+    assert job_id not in jobs._jobs
+
+def test_events_follow_the_job_until_it_finishes():
+    release = threading.Event()
+    job_id = jobs.submit_job('blocking', blocking_job(release))
+    release.set()
+    events = [event.split('\n')[0] for event in jobs.job_events(job_id)]
+    assert events == ['event: status', 'event: status', 'event: stage', 'event: done']
+    failed = jobs.submit_job('failing', lambda progress: 1/0)
+    wait_for(failed, 'failed')
+    assert jobs.get_job(failed)['error'] == 'division by zero'
@@ -0,0 +1,47 @@
+from services import llm_cache
+from prometheus_client import REGISTRY
+import pytest
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(llm_cache, 'DISK_CACHE_PATH', None)
+    llm_cache._entries.clear()
+
+def exported(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+def test_least_recently_used_responses_are_evicted(monkeypatch):
+    monkeypatch.setattr(llm_cache, 'MAX_ENTRIES', 2)
+    evictions = llm_cache.cache_stats()['evictions']
+    llm_cache.put('a', 'first')
+    llm_cache.put('b', 'second')
+    assert llm_cache.get('a') == 'first' #b is now the least recently used
+    llm_cache.put('c', 'third')
+    assert llm_cache.get('b') is None
+    assert (llm_cache.get('a'), llm_cache.get('c')) == ('first', 'third')
+    assert llm_cache.cache_stats()['evictions'] == evictions+1
+
+def test_expired_responses_are_misses():
+    llm_cache.put('expired', 'old', ttl=-1)
+    llm_cache.put('fresh', 'new', ttl=60)
+    assert llm_cache.get('expired') is None
+    assert llm_cache.get('fresh') == 'new'
+    assert 'expired' not in llm_cache._entries
+
+def test_invalidating_a_tag_removes_only_its_responses(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, 'DISK_CACHE_PATH', str(tmp_path/'llm_cache.sqlite'))
+    llm_cache.put('bench', 'bench insights', tags=(llm_cache.insights_tag('bench press'),))
+    llm_cache.put('squat', 'squat insights', tags=(llm_cache.insights_tag('Squat'),))
+    llm_cache.invalidate_tag(llm_cache.insights_tag('Bench Press'))
+    llm_cache._entries.clear() #only the on-disk tier is left
+    assert llm_cache.get('bench') is None
+    assert llm_cache.get('squat') == 'squat insights'
+
+def test_counters_are_exported():
+    hits, misses = exported('zfit_llm_cache_events_total', event='hits'), exported('zfit_llm_cache_events_total', event='misses')
+    llm_cache.put('key', 'response')
+    llm_cache.get('key')
+    llm_cache.get('missing')
+    assert exported('zfit_llm_cache_events_total', event='hits') == hits+1
+    assert exported('zfit_llm_cache_events_total', event='misses') == misses+1
+    assert exported('zfit_llm_cache_entries') == 1
@@ -0,0 +1,52 @@
+from processing import mesocycle, best_set_cache
+from processing.plan_validation import validate_skeleton
+from services import ollama_service
+from utils.util import ProgramSet
+import threading
+import pytest
+
+USER = {'age':'25','level':'intermediate','gender':'male','goal':'strength','days':['Monday'],'equipment':['Barbell'],'startdate':'2025-01-06'}
+
+def test_intensity_ramps_then_deloads():
+    assert [round(mesocycle.week_intensity(week, 5), 2) for week in range(1, 6)] == [0.7, 0.75, 0.8, 0.85, 0.6]
+    assert [round(mesocycle.week_intensity(week, 3), 3) for week in range(1, 4)] == [0.7, 0.775, 0.85] #too short for a deload
+    assert mesocycle.week_intensity(1, 1) == mesocycle.START_INTENSITY
+
+def test_sets_are_progressed_from_the_best_set():
+    barbell = ProgramSet('Legs', '2025-01-06', 'Legs', 'Squat', 1, 200, 5) #estimated one rep max of about 233 lbs
+    assert [(progressed.lbs, progressed.reps) for progressed in (mesocycle.progress_set(barbell, week, 5) for week in range(1, 6))] == [
+        (165, 12), (175, 9), (185, 7), (200, 4), (140, 12) #the deload keeps the first week's reps
+    ]
+    bodyweight = ProgramSet('Pull', '2025-01-06', 'Back', 'Pull Up', 1, 0, 10)
+    assert [mesocycle.progress_set(bodyweight, week, 5).reps for week in range(1, 6)] == [10, 11, 12, 13, 7]
+    untrained = ProgramSet('Pull', '2025-01-06', 'Back', 'Cable Row', 1, 0, 0)
+    assert mesocycle.progress_set(untrained, 3, 5) == untrained
+
+@pytest.fixture
+def skeleton(monkeypatch):
+    focuses = {'weeks':[{'focus':focus} for focus in ('volume', 'intensity', 'peak', 'deload')]}
+    monkeypatch.setattr(ollama_service, 'generate_mesocycle_skeleton', lambda *args: validate_skeleton(focuses, args[4], args[6]))
+    monkeypatch.setattr(ollama_service, 'get_exercise_vocabulary', lambda: [])
+    monkeypatch.setattr(best_set_cache, 'ensure_warm', lambda: True)
+
+def test_later_weeks_start_after_the_first(skeleton, monkeypatch):
+    first_done, started = threading.Event(), []
+
+    def build_week(user, week, weeks, focus, split, resolved_exercises):
+        started.append((week, first_done.is_set()))
+        if week == 1:
+            resolved_exercises['Squat'] = 'matched once'
+            first_done.set()
+        if week == 3:
+            raise ValueError('llm failed')
+        return {'week':week,'focus':focus,'matches':dict(resolved_exercises)}
+    monkeypatch.setattr(mesocycle, 'build_week', build_week)
+    weeks = list(mesocycle.generate_mesocycle(USER, 4))
+    assert [week['week'] for week in weeks] == [1, 2, 3, 4]
+    assert all(is_after_first for week, is_after_first in started if week > 1)
+    assert weeks[1] == {'week':2,'focus':'intensity','matches':{'Squat':'matched once'}} #the first week's matches are shared
+    assert weeks[2]['error'] == 'Could not generate week 3' and weeks[2]['program'] == []
+
+def test_weeks_are_capped(skeleton, monkeypatch):
+    monkeypatch.setattr(mesocycle, 'build_week', lambda user, week, *args: {'week':week})
+    assert len(list(mesocycle.generate_mesocycle(USER, 50))) == mesocycle.MAX_MESOCYCLE_WEEKS
@@ -0,0 +1,82 @@
+from processing.plan_validation import validate_plan, validate_plan_rows, validate_skeleton, rows_from_plan
+from utils.util import PlanRow
+
+DATES = ['2025-01-06', '2025-01-08']
+
+def exercises(*names, sets=3):
+    return [{'musclegroup':'Chest','exercise':name,'sets':sets} for name in names]
+
+def test_valid_plan():
+    plan = {'workouts':[
+        {'title':'Push','date':'2025-01-06','exercises':exercises('Bench Press','Dip','Fly')},
+        {'title':' ','date':'2025-01-08','exercises':exercises('Squat','Lunge','Leg Press')}
+    ]}
+    valid_workouts, invalid_dates = validate_plan(plan, DATES)
+    assert invalid_dates == []
+    assert valid_workouts['2025-01-08']['title'] == 'Workout'
+    assert [row.exercise for row in rows_from_plan(valid_workouts, DATES)] == ['Bench Press','Dip','Fly','Squat','Lunge','Leg Press']
+
+def test_days_missing_or_without_enough_exercises_are_invalid():
+    plan = {'workouts':[
+        {'title':'Push','date':'2025-01-06','exercises':exercises('Bench Press','bench press','Dip')}, #duplicates count once
+        {'title':'Legs','date':'2025-01-10','exercises':exercises('Squat','Lunge','Leg Press')} #not a requested date
+    ]}
+    assert validate_plan(plan, DATES) == ({}, DATES)
+
+def test_invalid_exercises_are_dropped():
+    plan = {'workouts':[{'title':'Push','date':'2025-01-06','exercises':[
+        *exercises('Bench Press','Dip','Fly'),
+        *exercises('Zero Sets', sets=0),
+        *exercises('Too Many Sets', sets=11),
+        *exercises('Bool Sets', sets=True),
+        {'musclegroup':'Chest','exercise':'','sets':3},
+        'Pushup'
+    ]}]}
+    valid_workouts, invalid_dates = validate_plan(plan, DATES)
+    assert [exercise['exercise'] for exercise in valid_workouts['2025-01-06']['exercises']] == ['Bench Press','Dip','Fly']
+    assert invalid_dates == ['2025-01-08']
+
+def test_first_valid_workout_of_a_date_is_kept():
+    plan = {'workouts':[
+        {'title':'Push','date':'2025-01-06','exercises':exercises('Bench Press')},
+        {'title':'Pull','date':'2025-01-06','exercises':exercises('Row','Curl','Pulldown')},
+        {'title':'Legs','date':'2025-01-06','exercises':exercises('Squat','Lunge','Leg Press')}
+    ]}
+    assert validate_plan(plan, DATES)[0]['2025-01-06']['title'] == 'Pull'
+
+def test_malformed_plans_are_invalid():
+    for plan in (None, [], {'workouts':None}, {'workouts':['Push']}):
+        assert validate_plan(plan, DATES) == ({}, DATES)
+
+def test_csv_rows_are_held_back_until_their_day_is_valid():
+    plan_rows = [
+        PlanRow('Push', '2025-01-06', 'Chest', 'Bench Press', '3'),
+        PlanRow('Legs', '2025-01-08', 'Legs', 'Squat', '4'),
+        PlanRow('Push', '2025-01-06', 'Chest', 'Dip', 'three'), #sets is not a number
+        PlanRow('Push', '2025-01-06', 'Chest', 'Dip', '3'),
+        PlanRow('Push', '2025-01-10', 'Chest', 'Fly', '3'), #not a requested date
+        PlanRow('Push', '2025-01-06', 'Chest', 'Fly', '3'),
+        PlanRow('Push', '2025-01-06', 'Chest', 'Push Up', '2')
+    ]
+    yielded = []
+    valid_workouts, problems = {}, {}
+    for plan_row in validate_plan_rows(plan_rows, DATES, valid_workouts, problems):
+        yielded.append((plan_row.exercise, len(valid_workouts['2025-01-06']['exercises'])))
+    assert yielded == [('Bench Press', 3), ('Dip', 3), ('Fly', 3), ('Push Up', 4)] #nothing before the third exercise
+    assert list(valid_workouts) == ['2025-01-06']
+    assert problems == {'2025-01-08':'only had 1 valid exercises'}
+
+def test_skeleton():
+    skeleton = {
+        'split':[
+            {'day':'Monday','title':' Push ','musclegroups':['Chest',' ','Triceps']},
+            {'day':'Monday','title':'Pull','musclegroups':['Back']},
+            {'day':'Tuesday','title':'Legs','musclegroups':['Legs']},
+            {'day':'Friday','title':'Arms','musclegroups':[]}
+        ],
+        'weeks':[{'focus':' volume '},{'focus':None},{'focus':'intensity'},{'focus':'extra'}]
+    }
+    split, focuses = validate_skeleton(skeleton, ['Monday','Wednesday','Friday'], 3)
+    assert split == {'Monday':{'title':'Push','musclegroups':['Chest','Triceps']}}
+    assert focuses == ['volume','','intensity']
+    assert validate_skeleton(None, ['Monday'], 2) == ({}, ['',''])
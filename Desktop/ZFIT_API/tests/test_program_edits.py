@@ -0,0 +1,50 @@
+from processing.program_edits import parse_simple_edits, apply_edits
+
+PROGRAM = [{
+    'title':'Full Body',
+    'date':['2025-01-06'],
+    'musclegroups':['Chest','Legs','Shoulders'],
+    'sets':[
+        {'exercise':'Squat','set_num':1,'lbs':135,'reps':5},
+        {'exercise':'Bench Press','set_num':1,'lbs':100,'reps':5},
+        {'exercise':'Incline Bench Press','set_num':1,'lbs':80,'reps':8},
+        {'exercise':'Overhead Press','set_num':1,'lbs':60,'reps':8}
+    ]
+}]
+
+def test_parses_value_changes():
+    assert parse_simple_edits('Add 10 lbs to bench press', PROGRAM) == [{'op':'change_value','exercise':'Bench Press','field':'lbs','mode':'add','value':10.0}]
+    assert parse_simple_edits('take 5 lbs off the squat', PROGRAM) == [{'op':'change_value','exercise':'Squat','field':'lbs','mode':'add','value':-5.0}]
+    assert parse_simple_edits('set squat to 8 reps', PROGRAM) == [{'op':'change_value','exercise':'Squat','field':'reps','mode':'set','value':8.0}]
+
+def test_parses_every_clause():
+    assert parse_simple_edits('add a set of squat, then remove the last set of overhead press', PROGRAM) == [
+        {'op':'add_set','exercise':'Squat','value':1},
+        {'op':'remove_set','exercise':'Overhead Press'}
+    ]
+
+def test_parses_replacements():
+    assert parse_simple_edits('swap squat for a hack squat', PROGRAM) == [{'op':'replace_exercise','exercise':'Squat','new_exercise':'Hack Squat'}]
+    assert parse_simple_edits("replace squat with farmer's walk", PROGRAM) == [{'op':'replace_exercise','exercise':'Squat','new_exercise':"Farmer's Walk"}]
+
+def test_leaves_trailing_clauses_to_the_llm():
+    assert parse_simple_edits('replace squat with leg press for 3 sets', PROGRAM) is None
+    assert parse_simple_edits('replace squat with leg press for higher reps', PROGRAM) is None
+    assert parse_simple_edits('change bench press to 135', PROGRAM) is None
+
+def test_leaves_ambiguous_names_to_the_llm():
+    assert parse_simple_edits('add 5 lbs to press', PROGRAM) is None
+    assert parse_simple_edits('add 10 lbs to bench', PROGRAM) is None
+
+def test_leaves_unknown_requests_to_the_llm():
+    assert parse_simple_edits('make wednesday focus on legs', PROGRAM) is None
+    assert parse_simple_edits('add 10 lbs to deadlift', PROGRAM) is None
+    assert parse_simple_edits('add 10 lbs to bench press and make it harder', PROGRAM) is None
+
+def test_change_value_keeps_fractional_lbs():
+    edited, applied = apply_edits(PROGRAM, parse_simple_edits('add 2.5 lbs to overhead press', PROGRAM))
+    assert len(applied) == 1
+    assert edited[0]['sets'][3]['lbs'] == 62.5
+    edited, _ = apply_edits(PROGRAM, [{'op':'change_value','exercise':'Squat','field':'reps','mode':'multiply','value':1.3}])
+    assert edited[0]['sets'][0]['reps'] == 6
+    assert PROGRAM[0]['sets'][0]['reps'] == 5 #the original program is not modified
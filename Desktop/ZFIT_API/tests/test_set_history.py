@@ -0,0 +1,44 @@
+from processing import set_history, best_set_cache, analytics, exercise_index
+from services.supabase_client import select_all
+from processing.workout_processing import insert_workouts
+import pytest
+
+@pytest.fixture(autouse=True)
+def empty_history():
+    for cache in (set_history._histories, best_set_cache._caches, analytics._sessions_cache, exercise_index._indexes):
+        cache.clear()
+
+def saved_set(workout, exercise, lbs, reps, workout_date):
+    return {'id':workout,'exercise':exercise,'set_num':1,'lbs':lbs,'reps':reps,'workout':{'date':workout_date}}
+
+def test_history_is_loaded_a_page_at_a_time(database, monkeypatch):
+    monkeypatch.setattr(set_history, 'select_all', lambda build_query: select_all(build_query, page_size=2))
+    database.tables['set'] = [saved_set(i, 'Bench Press', 100+i, 5, f'2025-01-{i+1:02d}') for i in range(5)]
+    assert set_history.ensure_warm()
+    generation, history_sets = set_history.exercise_sets('bench press')
+    assert [history_set.lbs for history_set in history_sets] == [100, 101, 102, 103, 104]
+    assert database.calls.count(('set', 'select')) == 3
+
+def test_inserted_sets_keep_their_workout_date(database):
+    database.tables['set'] = [saved_set(1, 'Squat', 135, 5, '2025-01-01'), saved_set(1, 'Squat', 'heavy', 5, '2025-01-01')]
+    assert set_history.ensure_warm()
+    insert_workouts([{'title':'Legs','date':('2025-01-08',),'musclegroups':['Legs'],'sets':[{'exercise':'Squat','set_num':1,'lbs':140,'reps':5}]}])
+    _, history_sets = set_history.exercise_sets('Squat')
+    assert [(history_set.date, history_set.lbs) for history_set in history_sets] == [('2025-01-01', 135), ('2025-01-08', 140)]
+    assert set_history.exercise_names() == ['Squat'] #invalid sets still count as past exercises
+
+def test_least_recently_seen_users_are_dropped_from_every_cache(database, monkeypatch, tmp_path):
+    monkeypatch.setattr(set_history, 'MAX_USERS', 1)
+    monkeypatch.setattr(exercise_index, 'INDEX_PATH', str(tmp_path/'exercise_index_{}.npz'))
+    database.tables['set'] = [saved_set(1, 'Squat', 135, 5, '2025-01-01')]
+    for user_id in ('first-user', 'second-user'):
+        for module in (set_history, best_set_cache, analytics, exercise_index):
+            monkeypatch.setattr(module, 'current_user_id', lambda: user_id)
+        assert set_history.ensure_warm()
+        assert best_set_cache.get_aggregate('Squat')['session_count'] == 1
+        assert analytics.exercise_features('Squat') is not None
+        exercise_index.rebuild(set_history.exercise_names())
+    assert list(set_history._histories) == ['second-user']
+    assert list(best_set_cache._caches) == ['second-user']
+    assert {user_id for user_id, _ in analytics._sessions_cache} == {'second-user'}
+    assert list(exercise_index._indexes) == ['second-user']
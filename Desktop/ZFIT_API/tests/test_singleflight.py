@@ -0,0 +1,88 @@
+from utils import singleflight
+import threading
+import time
+
+class Caller(threading.Thread):
+    """
+    Calls singleflight.do in a thread and keeps its result or exception
+    """
+    def __init__(self, group, fn):
+        super().__init__(daemon=True) #a call that never lands fails the test instead of hanging it
+        self.group, self.fn, self.result = group, fn, None
+
+    def run(self):
+        try:
+            self.result = singleflight.do(self.group, 'key', self.fn)
+        except BaseException as e:
+            self.result = e
+
+def start_leader(group, outcome):
+    """
+    Starts a call that blocks until it is released, then returns or raises outcome
+
+    Returns:
+        tuple of the calling thread and the event releasing the call
+    """
+    started, release = threading.Event(), threading.Event()
+
+    def fn():
+        started.set()
+        release.wait(5)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+    leader = Caller(group, fn)
+    leader.start()
+    assert started.wait(5)
+    return leader, release
+
+def start_follower(group):
+    """
+    Starts an identical call and waits until it has joined the call in flight
+    """
+    follower = Caller(group, lambda: 'follower')
+    coalesced = singleflight.stats()[group]['coalesced']
+    follower.start()
+    deadline = time.monotonic() + 5
+    while singleflight.stats()[group]['coalesced'] == coalesced:
+        assert time.monotonic() < deadline, 'the follower never joined the call in flight'
+        time.sleep(0.001)
+    return follower
+
+def finish(release, *callers):
+    release.set()
+    for caller in callers:
+        caller.join(5)
+
+def test_waiting_callers_share_the_exception():
+    error = ValueError('llm failed')
+    leader, release = start_leader('failure', error)
+    follower = start_follower('failure')
+    finish(release, leader, follower)
+    assert leader.result is error and follower.result is error
+    assert singleflight.stats()['failure']['in_flight'] == 0
+    assert singleflight.do('failure', 'key', lambda: 'retried') == 'retried' #a failed call is not remembered
+
+def test_interrupted_leader_still_lands():
+    leader, release = start_leader('interrupted', KeyboardInterrupt())
+    follower = start_follower('interrupted')
+    finish(release, leader, follower)
+    assert isinstance(leader.result, KeyboardInterrupt)
+    assert isinstance(follower.result, RuntimeError)
+    assert singleflight.stats()['interrupted']['in_flight'] == 0
+
+def test_waiting_callers_give_up_on_a_stuck_call(monkeypatch):
+    monkeypatch.setattr(singleflight, 'WAIT_TIMEOUT_SECONDS', 0.05)
+    leader, release = start_leader('stuck', 'leader')
+    follower = start_follower('stuck')
+    follower.join(5)
+    assert follower.result == 'follower'
+    finish(release, leader)
+    assert leader.result == 'leader'
+
+def test_timeouts_raised_by_the_call_are_shared():
+    error = TimeoutError('supabase timed out')
+    leader, release = start_leader('call timeout', error)
+    follower = start_follower('call timeout')
+    finish(release, leader, follower)
+    assert follower.result is error
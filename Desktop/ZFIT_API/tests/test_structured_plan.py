@@ -0,0 +1,92 @@
+from services import ollama_service, llm_cache
+from services.llm_backends import StubResponse
+import json
+import pytest
+
+DATES = ['2025-01-06', '2025-01-08'] #Monday and Wednesday of the week starting 2025-01-06
+
+class ScriptedBackend:
+    """
+    Answers each call with the next scripted plan and keeps the prompts and options it was sent
+    """
+    def __init__(self, *plans):
+        self.plans, self.calls = list(plans), []
+
+    def generate(self, model, prompt, **kwargs):
+        self.calls.append((prompt, kwargs['options']['seed']))
+        return StubResponse(json.dumps(self.plans.pop(0)))
+
+def workout(workout_date, *names):
+    return {'title':'Workout','date':workout_date,'exercises':[{'musclegroup':'Chest','exercise':name,'sets':3} for name in names]}
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    llm_cache._entries.clear()
+
+def build_plan(backend, monkeypatch):
+    monkeypatch.setattr(ollama_service, 'backend', backend)
+    return ollama_service.generate_structured_plan('25', 'intermediate', 'male', 'strength', ['Monday', 'Wednesday'], ['barbell'], DATES[0])
+
+def test_repairs_only_the_invalid_dates(monkeypatch):
+    backend = ScriptedBackend(
+        {'workouts':[workout(DATES[0], 'Bench Press', 'Dip', 'Fly'), workout(DATES[1], 'Squat')]},
+        {'workouts':[workout(DATES[1], 'Squat', 'Lunge', 'Leg Press')]}
+    )
+    plan_rows = build_plan(backend, monkeypatch)
+    assert [row.exercise for row in plan_rows] == ['Bench Press', 'Dip', 'Fly', 'Squat', 'Lunge', 'Leg Press']
+    (first_prompt, first_seed), (repair_prompt, repair_seed) = backend.calls
+    assert repair_seed != first_seed
+    assert f'{DATES[1]} only had 1 valid exercises' in repair_prompt and 'Bench Press' in repair_prompt
+
+def test_invalid_plans_are_not_cached(monkeypatch):
+    invalid_plan = {'workouts':[workout(DATES[0], 'Bench Press')]}
+    backend = ScriptedBackend(*[invalid_plan]*(ollama_service.MAX_PLAN_REPAIRS+1))
+    assert build_plan(backend, monkeypatch) == []
+    assert len({call for call in backend.calls}) == len(backend.calls) #every repair was a new call
+    assert not llm_cache._entries
+
+    valid_plan = {'workouts':[workout(DATES[0], 'Bench Press', 'Dip', 'Fly'), workout(DATES[1], 'Squat', 'Lunge', 'Leg Press')]}
+    backend = ScriptedBackend(valid_plan)
+    assert len(build_plan(backend, monkeypatch)) == 6 #the invalid first answer was not replayed
+    assert len(build_plan(ScriptedBackend(), monkeypatch)) == 6 #the valid one was
+
+class StreamingBackend(ScriptedBackend):
+    """
+    Streams the csv plan a line at a time, then answers each repair with the next scripted plan
+    """
+    def __init__(self, csv_plan, *plans):
+        super().__init__(*plans)
+        self.csv_plan = csv_plan
+
+    def generate(self, model, prompt, stream=False, **kwargs):
+        if not stream:
+            return super().generate(model, prompt, **kwargs)
+        self.calls.append((prompt, kwargs['options'].get('seed')))
+        return iter([StubResponse(line+'\n', done=False) for line in self.csv_plan.splitlines()] + [StubResponse('')])
+
+CSV_PLAN = '''Workout Title,Date,Musclegroups,Exercise,Sets
+Push,2025-01-06,Chest,Bench Press,3
+Push,2025-01-06,Chest,Dip,3
+Legs,2025-01-08,Legs,Squat,4
+Push,2025-01-06,Chest,Fly,3'''
+
+def stream_plan(backend, monkeypatch):
+    monkeypatch.setattr(ollama_service, 'backend', backend)
+    return list(ollama_service.generate_plan_rows('25', 'intermediate', 'male', 'strength', ['Monday', 'Wednesday'], ['barbell'], DATES[0]))
+
+def test_streamed_plan_repairs_invalid_days(monkeypatch):
+    backend = StreamingBackend(CSV_PLAN, {'workouts':[workout(DATES[1], 'Squat', 'Lunge', 'Leg Press')]})
+    plan_rows = stream_plan(backend, monkeypatch)
+    assert [(row.date, row.exercise) for row in plan_rows] == [
+        (DATES[0], 'Bench Press'), (DATES[0], 'Dip'), (DATES[0], 'Fly'),
+        (DATES[1], 'Squat'), (DATES[1], 'Lunge'), (DATES[1], 'Leg Press')
+    ]
+    repair_prompt = backend.calls[1][0]
+    assert f'{DATES[1]} only had 1 valid exercises' in repair_prompt and 'Bench Press' in repair_prompt
+    assert len(llm_cache._entries) == 1 #the repair was cached, the invalid csv plan was not
+
+def test_valid_streamed_plan_is_not_repaired(monkeypatch):
+    backend = StreamingBackend(CSV_PLAN.replace('Legs,2025-01-08,Legs,Squat,4', 'Legs,2025-01-08,Legs,Squat,4\nLegs,2025-01-08,Legs,Lunge,3\nLegs,2025-01-08,Legs,Leg Press,3'))
+    assert len(stream_plan(backend, monkeypatch)) == 6
+    assert len(backend.calls) == 1
+    assert len(stream_plan(StreamingBackend(''), monkeypatch)) == 6 #the valid csv plan was cached
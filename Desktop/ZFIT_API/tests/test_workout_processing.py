@@ -0,0 +1,114 @@
+from datetime import date, timedelta
+from processing import workout_processing, exercise_index, set_history
+from processing.workout_processing import structure_csv, clean_csv, get_past_exercise_page, insert_workouts
+from services import ollama_service
+from utils.util import ProgramSet, PlanRow
+import pandas as pd
+import threading
+
+def grouped_program(program_sets):
+    """
+    Structures a program the way structure_csv did with a pandas groupby before it was vectorized
+    """
+    workouts = []
+    for (workout_date,), rows in pd.DataFrame(program_sets).groupby(['date']):
+        workouts.append({
+            'title':'/'.join(dict.fromkeys(rows['title'])),
+            'date':(workout_date,),
+            'musclegroups':list(dict.fromkeys(group for musclegroups in rows['musclegroups'] for group in musclegroups.split(';'))),
+            'sets':[{'exercise':row.exercise,'set_num':row.set_num,'lbs':row.lbs,'reps':row.reps} for row in rows.itertuples()]
+        })
+    return workouts
+
+def test_structure_csv_matches_groupby():
+    program_sets = [
+        ProgramSet('Legs','2025-01-08','Quads;Glutes','Squat',1,135,5),
+        ProgramSet('Push','2025-01-06','Chest','Bench Press',1,100,8),
+        ProgramSet('Legs','2025-01-08','Hamstrings;Glutes','Romanian Deadlift',1,95,10),
+        ProgramSet('Push','2025-01-06','Chest','Bench Press',2,100,8),
+        ProgramSet('Arms','2025-01-06','Triceps','Pushdown',1,40.5,12),
+        ProgramSet('Legs','2025-01-08','Quads;Glutes','Squat',2,135,5)
+    ]
+    assert structure_csv(program_sets) == grouped_program(program_sets)
+    assert [workout['title'] for workout in structure_csv(program_sets)] == ['Push/Arms','Legs']
+
+def test_structure_csv_without_sets():
+    assert structure_csv([]) == []
+
+def test_past_exercise_pages_cover_every_workout_once(database):
+    today = date.today()
+    workouts = []
+    for i in range(25):
+        workout_date = (today - timedelta(days=1 + i//3)).isoformat() #three workouts per day so pages split a day
+        exercise = 'Bench Press' if i % 4 else 'Squat'
+        workouts.append({'id':i+1,'date':workout_date,'set':[{'exercise':exercise,'set_num':1,'lbs':100+i,'reps':5}]})
+    workouts.append({'id':26,'date':(today + timedelta(days=1)).isoformat(),'set':[{'exercise':'Bench Press','set_num':1,'lbs':200,'reps':5}]}) #planned, not past
+    database.tables['workout'] = workouts
+
+    pages, cursor = [], None
+    while True:
+        page, cursor = get_past_exercise_page('Bench Press', limit=4, cursor=cursor)
+        pages.append(page)
+        if cursor is None:
+            break
+    seen = [workout_set['lbs'] for page in pages for workout in page for workout_set in workout['set']]
+    expected = sorted(((workout['date'], workout['id'], workout['set'][0]['lbs']) for workout in workouts[:25] if workout['set'][0]['exercise'] == 'Bench Press'), reverse=True)
+    assert seen == [lbs for _, _, lbs in expected]
+    assert all(len(page) == 4 for page in pages[:-1]) and len(pages[-1]) < 4
+
+def test_past_exercise_page_rejects_invalid_cursors(database):
+    assert get_past_exercise_page('Bench Press', cursor='2025-01-06_1)') is None
+    assert get_past_exercise_page('Bench Press', cursor='yesterday_1') is None
+
+def program(*set_counts):
+    return [{
+        'title':f'Workout {i}',
+        'date':[f'2025-01-{i+6:02d}'],
+        'musclegroups':['Chest'],
+        'sets':[{'exercise':'Bench Press','set_num':set_num+1,'lbs':135,'reps':5} for set_num in range(set_count)]
+    } for i, set_count in enumerate(set_counts)]
+
+def test_inserts_are_chunked_without_splitting_a_workout(database, monkeypatch):
+    monkeypatch.setattr(workout_processing, 'INSERT_CHUNK_SIZE', 2)
+    results = insert_workouts(program(1, 2, 1))
+    assert [(result['status'], result['id'], result['sets']) for result in results] == [('inserted', 1, 1), ('inserted', 2, 2), ('inserted', 3, 1)]
+    assert database.calls.count(('workout', 'insert')) == 2
+    assert database.calls.count(('set', 'insert')) == 3 #the second workout's sets do not fit with the first's
+    assert [workout_set['id'] for workout_set in database.tables['set']] == [1, 2, 2, 3]
+
+def test_workouts_are_rolled_back_when_their_sets_fail(database):
+    database.failing_inserts.add('set')
+    results = insert_workouts(program(2, 3))
+    assert [result['status'] for result in results] == ['failed', 'failed']
+    assert all('Insert into set failed' in result['error'] for result in results)
+    assert database.tables['workout'] == []
+
+def test_workouts_are_rolled_back_when_the_insert_response_is_short(database):
+    database.short_inserts['workout'] = 1
+    results = insert_workouts(program(2, 3))
+    assert [result['status'] for result in results] == ['failed', 'failed']
+    assert ('set', 'insert') not in database.calls
+    assert [workout['id'] for workout in database.tables['workout']] == [2] #only the returned workout can be identified
+
+def test_llm_matches_are_one_batch_with_a_timeout(database, monkeypatch):
+    set_history._histories.clear()
+    database.tables['set'] = [{'id':1,'exercise':'Bench Press','set_num':1,'lbs':135,'reps':5,'workout':{'date':'2025-01-01'}}]
+    monkeypatch.setattr(workout_processing, 'EXERCISE_TIMEOUT_SECONDS', 0.2)
+    monkeypatch.setattr(ollama_service, 'get_exercise_vocabulary', lambda: ['Bench Press'])
+    monkeypatch.setattr(exercise_index, 'confident_match', lambda exercise: 'Bench Press' if exercise == 'Bench Press' else None)
+    batches, release = [], threading.Event()
+
+    def stuck_match(exercises):
+        batches.append(exercises)
+        release.wait(5)
+        return {}
+    monkeypatch.setattr(workout_processing, 'match_and_resolve_exercises', stuck_match)
+    plan_rows = [PlanRow('Push', '2025-01-06', 'Chest', exercise, '1') for exercise in ('Bench Press', 'Cable Fly', 'Dip', 'Cable Fly')]
+    try:
+        program_sets = clean_csv(plan_rows)
+    finally:
+        release.set() #frees the shared resolver worker
+    assert batches == [['Cable Fly', 'Dip']] #the past exercises are sent to the llm once
+    assert [(program_set.exercise, program_set.lbs, program_set.reps) for program_set in program_sets] == [
+        ('Bench Press', 135, 5), ('Cable Fly', 0, 0), ('Dip', 0, 0), ('Cable Fly', 0, 0)
+    ]
@@ -0,0 +1,136 @@
+"""
+This file coalesces concurrent identical calls so only one of them does the work
+
+A call is identified by a group(the kind of call, e.g. llm or set_history) and a key. While a call is in flight,
+callers with the same group and key wait for it and share its result or exception instead of sending their own
+supabase query or llm call. Results are shared as is, so callers must not modify them. Keys of calls that read a
+user's data must include the user id. Waiting callers give up after WAIT_TIMEOUT_SECONDS and make the call
+themselves so a stuck call does not hold up every identical request.
+"""
+from services import metrics
+import threading
+import logging
+import os
+
+WAIT_TIMEOUT_SECONDS = float(os.getenv('ZFIT_SINGLEFLIGHT_TIMEOUT', '300')) #longest a caller waits for an identical call in flight
+
+_lock = threading.Lock()
+_flights = {} #(group, key) -> flight dict with the event set when it lands, its result and error
+_stats = {} #group -> {'calls': calls made, 'coalesced': calls that waited for another call}
+
+def _count(group, coalesced):
+    """
+    Counts a call in the group's stats, callers must hold _lock
+
+    Args:
+        group(str): kind of call
+        coalesced(bool): whether the call waited for another call
+    """
+    stats = _stats.setdefault(group, {'calls':0,'coalesced':0})
+    stats['calls'] += 1
+    stats['coalesced'] += int(coalesced)
+
+def begin(group, key):
+    """
+    Joins the call in flight for a key or starts a new one
+
+    Args:
+        group(str): kind of call
+        key(hashable): identifies identical calls within the group
+
+    Returns:
+        tuple of the flight and True if the caller must make the call and then call land, False if it should wait for it
+    """
+    with _lock:
+        flight = _flights.get((group, key))
+        is_leader = flight is None
+        if is_leader:
+            flight = {'event':threading.Event(),'result':None,'error':None}
+            _flights[(group, key)] = flight
+        _count(group, not is_leader)
+    metrics.record_flight(group, not is_leader)
+    return flight, is_leader
+
+def land(group, key, flight, result=None, error=None):
+    """
+    Finishes a call started with begin and wakes the callers waiting for it
+
+    Args:
+        group(str): kind of call
+        key(hashable): key passed to begin
+        flight(dict): flight returned by begin
+        result: result shared with the waiting callers
+        error(Exception): exception raised in the waiting callers instead of returning a result
+    """
+    with _lock:
+        if _flights.get((group, key)) is flight:
+            del _flights[(group, key)] #later callers start a new call
+    flight['result'], flight['error'] = result, error
+    flight['event'].set()
+
+def wait(flight, timeout=None):
+    """
+    Waits for a call started by another caller
+
+    Args:
+        flight(dict): flight returned by begin
+        timeout(float): seconds to wait, WAIT_TIMEOUT_SECONDS if not provided
+
+    Returns:
+        the call's result, raises the call's exception if it failed
+
+    Raises:
+        TimeoutError: if the call did not land within timeout
+    """
+    timeout = WAIT_TIMEOUT_SECONDS if timeout is None else timeout
+    if not flight['event'].wait(timeout):
+        raise TimeoutError(f'The identical call did not finish within {timeout} seconds')
+    if flight['error'] is not None:
+        raise flight['error']
+    return flight['result']
+
+def do(group, key, fn, *args, **kwargs):
+    """
+    Calls a function unless an identical call is in flight, in which case its result is shared
+
+    Args:
+        group(str): kind of call
+        key(hashable): identifies identical calls within the group
+        fn(function): function making the call
+        args: arguments passed to fn
+        kwargs: keyword arguments passed to fn
+
+    Returns:
+        the result of fn, from this call or the one in flight
+    """
+    flight, is_leader = begin(group, key)
+    if not is_leader:
+        try:
+            return wait(flight)
+        except TimeoutError:
+            if flight['event'].is_set():
+                raise #the call in flight landed with a TimeoutError of its own
+            logging.warning(f'The identical {group} call is taking too long, calling it again')
+            return fn(*args, **kwargs)
+    result, error = None, None
+    try:
+        result = fn(*args, **kwargs)
+        return result
+    except BaseException as e: #includes the thread being interrupted, waiting callers must still be woken up
+        error = e if isinstance(e, Exception) else RuntimeError(f'The {group} call was stopped before it finished')
+        raise
+    finally:
+        land(group, key, flight, result, error)
+
+def stats():
+    """
+    Gets how many calls were made and coalesced in each group since the api started
+
+    Returns:
+        dict mapping each group to its calls, coalesced calls and calls in flight
+    """
+    with _lock:
+        in_flight = {}
+        for group, _ in _flights:
+            in_flight[group] = in_flight.get(group, 0) + 1
+        return {group:{**group_stats, 'in_flight':in_flight.get(group, 0)} for group, group_stats in _stats.items()}
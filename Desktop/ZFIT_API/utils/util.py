@@ -2,10 +2,39 @@
 This file contains general utility functions
 """
 from datetime import datetime, timedelta
+from typing import NamedTuple
+from services.metrics import traced
 import logging
 import csv
+import os
 
 DAYS_IN_WEEK = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+PLAN_HEADER = ['title', 'date', 'musclegroups', 'exercise', 'sets']
+PROGRAM_HEADER = ['title', 'date', 'musclegroups', 'exercise', 'set_num', 'lbs', 'reps']
+DEBUG_CSV_DUMP = os.getenv('ZFIT_DEBUG_CSV') == '1' #writes each pipeline stage to data/ for debugging
+DEBUG_PAYLOADS = os.getenv('ZFIT_DEBUG_PAYLOADS') == '1' #logs full llm responses and edits, off by default because formatting large payloads is slow
+
+class PlanRow(NamedTuple):
+    """
+    An exercise in the workout plan generated by the llm
+    """
+    title: str
+    date: str
+    musclegroups: str
+    exercise: str
+    sets: str #number of sets as written by the llm, may not be a valid int
+
+class ProgramSet(NamedTuple):
+    """
+    A single set in the workout program sent to the front end
+    """
+    title: str
+    date: str
+    musclegroups: str
+    exercise: str
+    set_num: int
+    lbs: float
+    reps: float
 
 def get_dates_list(date_string, valid_dates):
     """
@@ -33,23 +62,39 @@ def get_dates_list(date_string, valid_dates):
             dates_list.append(date_val.isoformat())
     return dates_list
 
-def list_from_csv():
+def rows_from_csv(lines):
     """
-    Gets a list of exercises from unfiltered_program.csv
+    Parses exercises from the lines of a csv workout plan as they arrive
 
-    Returns:
-        List of rows from unfiltered_program.csv that are exercises 
+    Args:
+        lines(iterable[str]): lines of the csv workout plan
+
+    Yields:
+        PlanRow for each line that represents an exercise
+    """
+    for row in csv.reader(lines):
+        if len(row) != 5 or row == PLAN_HEADER:
+            #Skips rows that don't represent exercises
+            continue
+        yield PlanRow(*row)
+
+@traced
+def dump_csv(path, header, rows):
+    """
+    Writes rows to a csv file when DEBUG_CSV_DUMP is enabled
+
+    Args:
+        path(str): path of the csv file
+        header(list[str]): column names written as the first row
+        rows(list[tuple]): rows to write
     """
-    filtered_rows = []
+    if not DEBUG_CSV_DUMP:
+        return
     try:
-        with open('data/unfiltered_program.csv',newline='') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                if len(row) != 5 or row == ['title', 'date', 'musclegroups', 'exercise', 'sets']: 
-                    #Skips rows that don't represent exercises
-                    continue
-                filtered_rows.append(row)
-        logging.info('Successfully loaded plan into csv')
+        with open(path,'w',newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+        logging.info(f'Debug csv written to {path}')
     except Exception as e:
-        logging.error(f'Failed to read unfiltered_program.csv:{e}')
-    return filtered_rows
\ No newline at end of file
+        logging.error(f'Failed to write debug csv to {path}: {e}')